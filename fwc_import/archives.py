@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import tarfile
+import zipfile
+import datetime
+from pathlib import PurePosixPath, Path
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+"""
+The archive types whose members are read in place.
+"""
+
+SEP = '!'
+"""
+Separates the archive name from the member path in a member identifier,
+e.g. ``survey.zip!tables/sites.csv``.
+"""
+
+
+def is_archive(path: Path):
+    """
+    Check whether a file is a zip or tar archive by its name.
+
+    :param Path path: The file.
+    :rtype: bool
+    """
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class MemberStream:
+    """
+    A read-only stream over an archive member that reports the number of
+    bytes left to read as ``len``, so that it can be sent as a multipart body
+    without being read into memory or written to a temporary file. Closing it
+    closes the archive.
+
+    :param fileobj: The member's file object.
+    :param int size: The member's uncompressed size.
+    :param archive: The open archive.
+    """
+    def __init__(self, fileobj, size: int, archive):
+        self.fileobj = fileobj
+        self.size = size
+        self.archive = archive
+        self.pos = 0
+
+    @property
+    def len(self):
+        return self.size - self.pos
+
+    def read(self, n: int=-1):
+        chunk = self.fileobj.read(n)
+        self.pos += len(chunk)
+        return chunk
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.fileobj.close()
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveMember:
+    """
+    A file inside a zip or tar archive. It has the parts of the
+    :py:class:`pathlib.Path` interface that the data file upload uses
+    (``name``, ``suffix`` and ``open``), so it can be uploaded like a file.
+
+    Its ``name`` is the archive name and the member path joined by
+    :py:data:`SEP`, which is stable across runs and is the member's key in
+    the ledger.
+
+    :param Path archive: The archive.
+    :param str member: The member path within the archive.
+    :param int size: The member's uncompressed size.
+    :param int mtime_ns: The member's modification time in ns.
+    """
+    def __init__(self, archive: Path, member: str, size: int, mtime_ns: int):
+        self.archive = Path(archive)
+        self.member = member
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def name(self):
+        return f'{self.archive.name}{SEP}{self.member}'
+
+    @property
+    def suffix(self):
+        return PurePosixPath(self.member).suffix
+
+    def open(self, mode: str='rb'):
+        """
+        Open the member for reading, straight from the archive.
+
+        :param str mode: Must be ``rb``.
+        :rtype: MemberStream
+        """
+        if mode != 'rb':
+            raise ValueError(f'Archive members can only be opened with mode "rb", not "{mode}"')
+        if zipfile.is_zipfile(self.archive):
+            archive = zipfile.ZipFile(self.archive)
+            return MemberStream(archive.open(self.member), self.size, archive)
+        archive = tarfile.open(self.archive, 'r:*')
+        return MemberStream(archive.extractfile(self.member), self.size, archive)
+
+    def __str__(self):
+        return f'{self.archive}{SEP}{self.member}'
+
+    def __repr__(self):
+        return f'ArchiveMember({str(self)!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, ArchiveMember) and (str(self) == str(other))
+
+    def __lt__(self, other):
+        return str(self) < str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+def archive_members(path: Path):
+    """
+    List the regular files in a zip or tar archive, in archive order.
+    Directories, links and special files are skipped.
+
+    :param Path path: The archive.
+    :return: The members.
+    :rtype: list
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            return [ArchiveMember(path, i.filename, i.file_size,
+                                  int(datetime.datetime(*i.date_time, tzinfo=datetime.timezone.utc).timestamp()) * 10**9)
+                    for i in z.infolist() if not i.is_dir()]
+    with tarfile.open(path, 'r:*') as t:
+        return [ArchiveMember(path, m.name, m.size, int(m.mtime) * 10**9) for m in t if m.isfile()]
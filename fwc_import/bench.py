@@ -0,0 +1,373 @@
+import re
+import sys
+import json
+import random
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from time import perf_counter
+
+from .defs import WORK_LOC
+
+STARTUP_TARGET_MS = 100
+"""
+The startup time target, in milliseconds, for the lightweight commands.
+"""
+
+IMPORT_MODULES = [
+    'fwc_import.defs',
+    'fwc_import.utils',
+    'fwc_import.conv',
+    'fwc_import.cli',
+    'fwc_import.run_data_upload',
+]
+"""
+The modules whose import time is measured by :py:func:`import_times`.
+"""
+
+STARTUP_COMMANDS = {
+    'fwcimport --help': ['-c', 'import sys; from fwc_import.cli import fwcimport; sys.argv[0] = "fwcimport"; fwcimport(["--help"])'],
+    'fwcimport merge --help': ['-c', 'import sys; from fwc_import.cli import fwcimport; sys.argv[0] = "fwcimport"; fwcimport(["merge", "--help"])'],
+}
+"""
+Lightweight commands whose wall-clock startup time should stay under
+``STARTUP_TARGET_MS``.
+"""
+
+
+RESULTS_LOC = WORK_LOC.joinpath('bench')
+"""
+The directory benchmark results are written to.
+Defaults to ``~/fwc-import/bench/``.
+"""
+
+WORDS = ['seagrass', 'survey', 'tampa', 'bay', 'estuary', 'snook', 'redfish', 'manatee',
+         'oyster', 'reef', 'habitat', 'monitoring', 'water', 'quality', 'juvenile', 'fisheries',
+         'mangrove', 'wetland', 'sea', 'turtle', 'nesting', 'panther', 'scrub', 'jay', 'algal',
+         'bloom', 'sediment', 'salinity', 'abundance', 'distribution', 'index', 'trawl']
+"""
+The vocabulary for synthetic titles and descriptions.
+"""
+
+NAMES = [('John', 'Smith'), ('Maria', 'Garcia'), ('Robert', 'Johnson'), ('Linda', 'Nguyen'),
+         ('James', 'Williams'), ('Patricia', 'Brown'), ('Kevin', 'De La Cruz'), ('Ann', 'O\'Neil')]
+"""
+The names for synthetic principal investigators.
+"""
+
+
+def synthetic_record(rng: random.Random, i: int):
+    """
+    Make one synthetic FWC record, with the same columns and the same variety
+    of name, date and coordinate formats as the real sheets.
+
+    :param random.Random rng: The random number generator.
+    :param int i: The record number, used for the identifiers.
+    :return: The record.
+    :rtype: dict
+    """
+    given, family = rng.choice(NAMES)
+    pi = rng.choice([f'{given} {family}', f'{family}, {given}', f'{given} {given[0]}. {family}',
+                     f'Dr. {given} {family}', f'{given} {family} and {rng.choice(NAMES)[0]} {family}'])
+    lat, lon = rng.uniform(24.5, 31.0), -rng.uniform(80.0, 87.6)
+    coords = rng.choice([
+        f'{lat:.4f}°N, {abs(lon):.4f}°W',
+        f'{int(lat)}° {(lat % 1) * 60:.3f}\'N, {int(abs(lon))}° {(abs(lon) % 1) * 60:.3f}\'W',
+        f'Location: {lat:.5f} {lon:.5f}',
+        f'{lat:.6f}°, {lon:.6f}°',
+        '',
+    ])
+    paras = [' '.join(rng.choices(WORDS, k=rng.randint(20, 80))).capitalize() + '.'
+             for _ in range(rng.randint(1, 4))]
+    start = datetime.date(rng.randint(1980, 2020), rng.randint(1, 12), rng.randint(1, 28))
+    end = start + datetime.timedelta(days=rng.randint(30, 3650)) if rng.random() < 0.7 else None
+    return {
+        'Title': ' '.join(rng.choices(WORDS, k=rng.randint(3, 10))).title(),
+        'PrincipalInvestigator': pi,
+        'SubunitID': str(rng.choice([1, 2, 3, 4, 5, 7, 8, 10, 12, 15, 18, 24])),
+        'Contact': f'{given.lower()}.{family.lower().replace(" ", "")}@myfwc.com',
+        'PubDate': f'{rng.randint(1990, 2024)}-01-01 00:00:00',
+        'Description': '\n'.join(paras + ([f'Sampled at {coords}'] if coords else [])),
+        'ProjectURL': f'https://myfwc.com/research/project/{i}',
+        'DatasetURL': f'https://myfwc.com/research/dataset/{i}' if rng.random() < 0.5 else '',
+        'StudyArea': rng.choice(['Tampa Bay', 'Charlotte Harbor', 'Florida Keys', 'Apalachicola Bay', coords]),
+        'DatasetID': str(i),
+        'ProjectID': f'P{i}',
+        'StartDate': f'{start.isoformat()} 00:00:00',
+        'EndDate': f'{end.isoformat()} 00:00:00' if end else '',
+        'genus': rng.choice(['Thalassia', 'Centropomus', 'Trichechus', 'Crassostrea', '']),
+        'species': rng.choice(['testudinum', 'undecimalis', 'manatus', 'virginica', '']),
+    }
+
+
+def make_corpus(dest: Path, records: int=1000, seed: int=0):
+    """
+    Write synthetic ``records_to_fwri.xlsx`` and ``records_to_hsc.xlsx``
+    sheets with ``records`` records between them.
+
+    :param Path dest: The directory to write the sheets to.
+    :param int records: The total number of records.
+    :param int seed: The random seed, so that a corpus can be recreated exactly.
+    :return: The paths to the sheets.
+    :rtype: list[Path]
+    """
+    import pandas as pd
+    rng = random.Random(seed)
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    rows = [synthetic_record(rng, i) for i in range(1, records + 1)]
+    paths = []
+    for fname, part in (('records_to_fwri.xlsx', rows[0::2]), ('records_to_hsc.xlsx', rows[1::2])):
+        df = pd.DataFrame(part)
+        df = df.drop(columns=['ProjectID'] if 'fwri' in fname else ['DatasetID'])
+        df.to_excel(dest / fname, index=False)
+        paths.append(dest / fname)
+    return paths
+
+
+def time_per_call(func, args_list: list, repeat: int=3):
+    """
+    Time ``func`` over a list of argument tuples and report the best mean
+    time per call over ``repeat`` passes.
+
+    :param func: The function to time.
+    :param list args_list: The argument tuples, one per call.
+    :param int repeat: The number of passes.
+    :return: The time per call in milliseconds.
+    :rtype: float
+    """
+    best = None
+    for _ in range(repeat):
+        t0 = perf_counter()
+        for args in args_list:
+            func(*args)
+        t = (perf_counter() - t0) * 1000 / max(len(args_list), 1)
+        best = t if best is None else min(best, t)
+    return round(best, 4)
+
+
+def function_times(sheets_dir: Path):
+    """
+    Time the per-record and per-package functions on a corpus.
+
+    :param Path sheets_dir: The directory with the sheets.
+    :return: A dictionary of function names and times per call in milliseconds.
+    :rtype: dict
+    """
+    import pandas as pd
+    from . import conv
+    from .utils import get_lat_lon, parse_name
+    from .coords import bounding_boxes
+    from .run_data_upload import generate_system_metadata, generate_resource_map
+    crosswalk_file = Path(conv.__file__).parent.joinpath('manifest', 'fwc_crosswalk.json')
+    with open(crosswalk_file) as f:
+        crosswalk = json.load(f)
+    rows = []
+    for fp in sorted(Path(sheets_dir).glob('records_to*.xlsx')):
+        df = pd.read_excel(fp, dtype=str)
+        bboxes = bounding_boxes(df)
+        rows += [(row, crosswalk, fp.name, bboxes.loc[idx]) for idx, row in df.iterrows()]
+    times = {'build_eml': time_per_call(conv.build_eml, rows)}
+    trees = [conv.build_eml(*r)[0] for r in rows]
+    with tempfile.TemporaryDirectory() as tmp:
+        times['write_pretty_xml'] = time_per_call(
+            conv.write_pretty_xml, [(t, Path(tmp, f'{i}.xml')) for i, t in enumerate(trees)])
+        emls = [Path(tmp, f'{i}.xml').read_bytes() for i in range(len(trees))]
+    times['get_lat_lon'] = time_per_call(get_lat_lon, [(str(r[0].get('Description')),) for r in rows])
+    times['parse_name'] = time_per_call(parse_name, [(str(r[0].get('PrincipalInvestigator')),) for r in rows])
+    orcid = 'http://orcid.org/0000-0000-0000-0000'
+    times['generate_system_metadata'] = time_per_call(
+        generate_system_metadata,
+        [(f'urn:uuid:{i}', None, 'https://eml.ecoinformatics.org/eml-2.2.0', e, orcid) for i, e in enumerate(emls)])
+    times['generate_resource_map'] = time_per_call(
+        generate_resource_map, [(f'urn:uuid:{i}', f'resource_map_urn:uuid:{i}', [f'urn:uuid:{i}']) for i in range(len(emls))])
+    return times
+
+
+def run_times(sheets_dir: Path, latency: float=0.0):
+    """
+    Time a full convert-and-upload run of a corpus against a local
+    :py:class:`fwc_import.standin.StandInMemberNode`. The package catalog and
+    the ledger for the stand-in node are kept in a temporary directory, not
+    in ``WORK_LOC``.
+
+    :param Path sheets_dir: The directory with the sheets.
+    :param float latency: Seconds the stand-in node waits before answering
+        each request.
+    :return: The convert and upload times in seconds, the number of packages
+        uploaded and the number of requests made.
+    :rtype: dict
+    """
+    from unittest import mock
+    from . import conv, utils
+    from .pool import ClientPool
+    from .utils import load_uploads, uploads_path
+    from .standin import StandInMemberNode
+    from .run_data_upload import upload_metadata_to_new_packages
+    node = 'urn:node:fwcbench'
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        conv.ID_TABLE.clear()
+        t0 = perf_counter()
+        conv.convert(sheets_dir=str(sheets_dir), output_dir=str(tmp / 'eml'),
+                     crosswalk_file=str(Path(conv.__file__).parent.joinpath('manifest', 'fwc_crosswalk.json')),
+                     report_loc=str(tmp / 'duplicates.json'), catalog_loc=str(tmp / 'catalog.sqlite'))
+        convert_s = perf_counter() - t0
+        token_file = tmp / 'token'
+        token_file.write_text('bench')
+        with mock.patch.object(utils, 'WORK_LOC', tmp), StandInMemberNode(latency=latency) as mn:
+            ledger = uploads_path(node)
+            pool = ClientPool(mn.base_url, token_file=token_file)
+            t0 = perf_counter()
+            upload_metadata_to_new_packages(eml_folder=str(tmp / 'eml'), orcid='http://orcid.org/0000-0000-0000-0000',
+                                            pool=pool, node=node)
+            upload_s = perf_counter() - t0
+            pool.close()
+            requests = mn.requests
+        uploaded = sum(1 for v in load_uploads(ledger).values() if v and v.get('resource_map'))
+    return {'convert_s': round(convert_s, 3), 'upload_s': round(upload_s, 3),
+            'packages': uploaded, 'requests': requests, 'latency_s': latency}
+
+
+def compare(old: dict, new: dict):
+    """
+    Print the change in every timing between two result files.
+
+    :param dict old: The earlier results.
+    :param dict new: The later results.
+    """
+    for section in ('import_ms', 'startup_ms', 'functions_ms', 'run'):
+        for k, t in new.get(section, {}).items():
+            before = old.get(section, {}).get(k)
+            if not isinstance(t, (int, float)) or not isinstance(before, (int, float)) or not before:
+                continue
+            print(f'{section}.{k:<35} {before:10.3f} -> {t:10.3f}  ({(t - before) / before:+.1%})')
+
+
+def import_times(modules: list=IMPORT_MODULES):
+    """
+    Measure the cumulative import time of each module in a fresh interpreter
+    using ``python -X importtime``.
+
+    :param list modules: The modules to import.
+    :return: A dictionary of module names and import times in milliseconds.
+    :rtype: dict
+    """
+    times = {}
+    for mod in modules:
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {mod}'],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            times[mod] = None
+            continue
+        # the last matching line is the top-level import; columns are self | cumulative | name
+        m = [l for l in proc.stderr.splitlines() if re.search(rf'\|\s+{re.escape(mod)}$', l)][-1]
+        times[mod] = int(m.split('|')[1]) / 1000
+    return times
+
+
+def startup_times(commands: dict=STARTUP_COMMANDS, repeat: int=5):
+    """
+    Measure the best-of-``repeat`` wall-clock time of each command in a fresh
+    interpreter, including interpreter startup.
+
+    :param dict commands: Command labels and interpreter arguments.
+    :param int repeat: The number of runs per command.
+    :return: A dictionary of command labels and times in milliseconds.
+    :rtype: dict
+    """
+    times = {}
+    for label, args in commands.items():
+        best = None
+        for _ in range(repeat):
+            t0 = perf_counter()
+            subprocess.run([sys.executable] + args, capture_output=True)
+            t = (perf_counter() - t0) * 1000
+            best = t if best is None else min(best, t)
+        times[label] = round(best, 1)
+    return times
+
+
+def package_version():
+    """
+    Get the installed version of fwc-import.
+
+    :return: The version, or None if the package is not installed.
+    :rtype: str or None
+    """
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version('fwc_import')
+    except PackageNotFoundError:
+        return None
+
+
+def main():
+    """
+    The ``benchfwcimport`` console script.
+    """
+    parser = argparse.ArgumentParser(prog='benchfwcimport', description='Benchmark fwc-import.')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--functions', action='store_true',
+                        help='also time the conversion and upload functions on a synthetic corpus')
+    parser.add_argument('--run', action='store_true',
+                        help='also time a full convert-and-upload run against a local stand-in Member Node')
+    parser.add_argument('--records', type=int, default=500, help='number of synthetic records (default: 500)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic corpus (default: 0)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the stand-in Member Node waits before each response (default: 0)')
+    parser.add_argument('--corpus', metavar='DIR', help='write the synthetic sheets to DIR and exit')
+    parser.add_argument('--output', metavar='FILE', help='results file (default: ~/fwc-import/bench/<time>.json)')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with an earlier results file')
+    args = parser.parse_args()
+    if args.corpus:
+        for fp in make_corpus(args.corpus, records=args.records, seed=args.seed):
+            print(fp)
+        return 0
+    results = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'version': package_version(),
+        'python': platform.python_version(),
+        'import_ms': import_times(),
+        'startup_ms': startup_times(),
+    }
+    if args.functions or args.run:
+        results['records'] = args.records
+        results['seed'] = args.seed
+        with tempfile.TemporaryDirectory() as sheets_dir:
+            make_corpus(sheets_dir, records=args.records, seed=args.seed)
+            if args.functions:
+                results['functions_ms'] = function_times(sheets_dir)
+            if args.run:
+                results['run'] = run_times(sheets_dir, latency=args.latency)
+    output = Path(args.output) if args.output else RESULTS_LOC.joinpath(f'{results["created"][:19].replace(":", "")}.json')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, fp=f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for mod, t in results['import_ms'].items():
+            print(f'import {mod:<28} {"failed" if t is None else f"{t:8.1f} ms"}')
+        for label, t in results['startup_ms'].items():
+            flag = '' if t <= STARTUP_TARGET_MS else f'  (over {STARTUP_TARGET_MS} ms target)'
+            print(f'{label:<35} {t:8.1f} ms{flag}')
+        for func, t in results.get('functions_ms', {}).items():
+            print(f'{func:<35} {t:8.3f} ms/call')
+        if 'run' in results:
+            r = results['run']
+            print(f'convert {results["records"]} records{"":<17} {r["convert_s"]:8.2f} s')
+            print(f'upload {r["packages"]} packages ({r["requests"]} requests){"":<6} {r["upload_s"]:8.2f} s')
+        print(f'Results written to {output}')
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), results)
+    slow = [k for k, t in results['startup_ms'].items() if t > STARTUP_TARGET_MS]
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import sqlite3
+import datetime
+from pathlib import Path
+from logging import getLogger
+import xml.etree.ElementTree as ET
+
+from .defs import WORK_LOC
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    package_id TEXT UNIQUE,
+    file TEXT,
+    title TEXT,
+    creator TEXT,
+    subunit TEXT,
+    pub_date TEXT,
+    begin_date TEXT,
+    end_date TEXT,
+    west REAL,
+    east REAL,
+    south REAL,
+    north REAL,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_subunit ON packages (subunit);
+CREATE INDEX IF NOT EXISTS packages_pub_date ON packages (pub_date);
+CREATE INDEX IF NOT EXISTS packages_dates ON packages (begin_date, end_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5(
+    package_id UNINDEXED, title, abstract, place, tokenize='porter unicode61'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS packages_rtree USING rtree(id, west, east, south, north);
+CREATE TABLE IF NOT EXISTS pids (
+    package_id TEXT,
+    node TEXT,
+    kind TEXT,
+    identifier TEXT,
+    PRIMARY KEY (package_id, node, kind, identifier)
+);
+CREATE INDEX IF NOT EXISTS pids_identifier ON pids (identifier);
+"""
+"""
+The catalog schema. ``packages_rtree`` rows have the ``id`` of their
+``packages`` row; ``pids`` holds the identifiers from the upload ledgers.
+"""
+
+BC = ['westBoundingCoordinate', 'eastBoundingCoordinate', 'southBoundingCoordinate', 'northBoundingCoordinate']
+"""
+The EML bounding coordinate elements, in ``packages_rtree`` column order.
+"""
+
+
+def catalog_path():
+    """
+    Get the location of the package catalog.
+
+    :rtype: Path
+    """
+    return Path(WORK_LOC / 'catalog.sqlite')
+
+
+def open_catalog(fp: Path | None=None):
+    """
+    Open the package catalog, creating it if needed.
+
+    :param Path fp: The catalog database. Defaults to :py:func:`catalog_path`.
+    :return: The connection.
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect(fp or catalog_path())
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def text_of(elem):
+    """
+    Get the whitespace-normalized text of an element and its descendants.
+
+    :param elem: The element, or None.
+    :rtype: str or None
+    """
+    if elem is None:
+        return None
+    text = ' '.join(' '.join(elem.itertext()).split())
+    return text or None
+
+
+def eml_fields(root):
+    """
+    Read the catalog fields from an EML document as
+    :py:func:`fwc_import.conv.build_eml` writes it.
+
+    :param root: The EML root element.
+    :return: The package id, title, creator, subunit (the creator's
+        organizationName), pubDate, temporal range, bounding coordinates,
+        abstract and geographic description.
+    :rtype: dict
+    """
+    dataset = root.find('dataset')
+    creator = dataset.find('creator')
+    name = creator.find('individualName') if creator is not None else None
+    temporal = dataset.find('coverage/temporalCoverage')
+    begin = end = None
+    if temporal is not None:
+        begin = text_of(temporal.find('rangeOfDates/beginDate/calendarDate'))
+        end = text_of(temporal.find('rangeOfDates/endDate/calendarDate'))
+        if begin is None:
+            begin = end = text_of(temporal.find('singleDateTime/calendarDate'))
+    bbox = [text_of(dataset.find(f'coverage/geographicCoverage/boundingCoordinates/{c}')) for c in BC]
+    try:
+        bbox = [float(v) for v in bbox]
+    except (TypeError, ValueError):
+        bbox = [None] * 4
+    return {
+        'package_id': text_of(dataset.find('alternateIdentifier')),
+        'title': text_of(dataset.find('title')),
+        'creator': ' '.join(filter(None, [text_of(name.find('givenName')), text_of(name.find('surName'))]))
+                   if name is not None else None,
+        'subunit': text_of(creator.find('organizationName')) if creator is not None else None,
+        'pub_date': text_of(dataset.find('pubDate')),
+        'begin_date': begin,
+        'end_date': end,
+        'west': bbox[0], 'east': bbox[1], 'south': bbox[2], 'north': bbox[3],
+        'abstract': text_of(dataset.find('abstract')),
+        'place': text_of(dataset.find('coverage/geographicCoverage/geographicDescription')),
+    }
+
+
+def add_package(conn: sqlite3.Connection, root, path: Path | str):
+    """
+    Add an EML document to the catalog, or update its entry. The caller
+    commits.
+
+    :param sqlite3.Connection conn: The catalog.
+    :param root: The EML root element.
+    :param path: The EML file.
+    :type path: Path or str
+    :return: The package id, or None if the document has none.
+    :rtype: str or None
+    """
+    f = eml_fields(root)
+    if not f['package_id']:
+        return None
+    f['file'] = str(path)
+    f['updated'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    columns = ['package_id', 'file', 'title', 'creator', 'subunit', 'pub_date', 'begin_date', 'end_date',
+               'west', 'east', 'south', 'north', 'updated']
+    conn.execute(f'INSERT INTO packages ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                 f'ON CONFLICT (package_id) DO UPDATE SET '
+                 f'{", ".join(f"{c} = excluded.{c}" for c in columns[1:])}', [f[c] for c in columns])
+    (id,) = conn.execute('SELECT id FROM packages WHERE package_id = ?', (f['package_id'],)).fetchone()
+    conn.execute('DELETE FROM packages_fts WHERE package_id = ?', (f['package_id'],))
+    conn.execute('INSERT INTO packages_fts VALUES (?, ?, ?, ?)', (f['package_id'], f['title'], f['abstract'], f['place']))
+    conn.execute('DELETE FROM packages_rtree WHERE id = ?', (id,))
+    if f['west'] is not None:
+        conn.execute('INSERT INTO packages_rtree VALUES (?, ?, ?, ?, ?)',
+                     (id, min(f['west'], f['east']), max(f['west'], f['east']),
+                      min(f['south'], f['north']), max(f['south'], f['north'])))
+    return f['package_id']
+
+
+def build_catalog(eml_folder: Path | str, fp: Path | None=None):
+    """
+    Rebuild the package entries of the catalog from the EML files in a
+    folder. The ledger identifiers are kept.
+
+    :param eml_folder: The EML folder.
+    :type eml_folder: Path or str
+    :param Path fp: The catalog database.
+    :return: The number of packages in the catalog.
+    :rtype: int
+    """
+    L = getLogger(__name__)
+    conn = open_catalog(fp)
+    conn.execute('DELETE FROM packages')
+    conn.execute('DELETE FROM packages_fts')
+    conn.execute('DELETE FROM packages_rtree')
+    n = 0
+    for path in sorted(Path(eml_folder).glob('*.xml')):
+        try:
+            root = ET.parse(path).getroot()
+        except ET.ParseError as e:
+            L.error(f'{path} / {repr(e)}')
+            continue
+        if add_package(conn, root, path):
+            n += 1
+    conn.commit()
+    conn.close()
+    L.info(f'Catalog {fp or catalog_path()}: {n} packages from {eml_folder}')
+    return n
+
+
+def sync_pids(conn: sqlite3.Connection, node: str, uploads: dict):
+    """
+    Replace a node's identifiers in the catalog with those in its ledger:
+    the EML, resource map and data objects of each package.
+
+    :param sqlite3.Connection conn: The catalog.
+    :param str node: The node identifier.
+    :param dict uploads: The node's ledger.
+    :return: The number of identifiers.
+    :rtype: int
+    """
+    rows = []
+    for package_id, entry in uploads.items():
+        for kind in ('eml', 'resource_map'):
+            if entry and entry.get(kind) and entry[kind].get('identifier'):
+                rows.append((package_id, node, kind, entry[kind]['identifier']))
+        for d in ((entry or {}).get('data') or {}).values():
+            if d.get('identifier'):
+                rows.append((package_id, node, 'data', d['identifier']))
+    conn.execute('DELETE FROM pids WHERE node = ?', (node,))
+    conn.executemany('INSERT OR IGNORE INTO pids VALUES (?, ?, ?, ?)', rows)
+    conn.commit()
+    return len(rows)
+
+
+def search(conn: sqlite3.Connection, text: str | None=None, bbox: tuple | None=None, subunit: str | None=None,
+           year: str | None=None, start: str | None=None, end: str | None=None, limit: int | None=None):
+    """
+    Find packages in the catalog. Every filter that is given must match.
+
+    :param sqlite3.Connection conn: The catalog.
+    :param str text: An FTS5 query on the title, abstract and geographic
+        description, e.g. ``"tampa bay" seagrass``.
+    :param tuple bbox: ``(west, south, east, north)``; packages whose
+        bounding box overlaps it match.
+    :param str subunit: A subunit number (see :py:data:`fwc_import.conv.SUBUNIT`)
+        or part of a subunit name.
+    :param str year: The year of the pubDate.
+    :param str start: Packages whose temporal coverage ends on or after this
+        date match.
+    :param str end: Packages whose temporal coverage begins on or before this
+        date match.
+    :param int limit: The most packages to return.
+    :return: The matching packages, best text match first, with their
+        identifiers from the ledgers as ``pids``.
+    :rtype: list[dict]
+    """
+    from .conv import SUBUNIT
+    joins, where, params = [], [], []
+    order = 'p.package_id'
+    if text:
+        joins.append('JOIN packages_fts f ON f.package_id = p.package_id')
+        where.append('packages_fts MATCH ?')
+        params.append(text)
+        order = 'f.rank'
+    if bbox:
+        west, south, east, north = bbox
+        joins.append('JOIN packages_rtree r ON r.id = p.id')
+        where.append('r.west <= ? AND r.east >= ? AND r.south <= ? AND r.north >= ?')
+        params += [east, west, north, south]
+    if subunit:
+        name = SUBUNIT.get(int(subunit), subunit) if str(subunit).isdigit() else subunit
+        where.append('p.subunit LIKE ?')
+        params.append(f'%{name}%')
+    if year:
+        where.append('p.pub_date LIKE ?')
+        params.append(f'{year}%')
+    if start:
+        where.append('p.end_date >= ?')
+        params.append(start)
+    if end:
+        where.append('p.begin_date <= ?')
+        params.append(end)
+    query = ("SELECT p.*, (SELECT group_concat(kind || '=' || identifier, ' ') FROM pids "
+             "WHERE pids.package_id = p.package_id) AS pids "
+             f'FROM packages p {" ".join(joins)} {("WHERE " + " AND ".join(where)) if where else ""} ORDER BY {order}')
+    if limit:
+        query += f' LIMIT {int(limit)}'
+    return [dict(r) for r in conn.execute(query, params)]
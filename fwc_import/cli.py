@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import sys
+import json
+import argparse
+from logging import getLogger
+
+from .defs import setup_logging
+from .profiling import add_profile_arguments, start_profiler, stop_profiler
+
+
+def upload(args):
+    """
+    Run the upload loop, optionally for a single shard.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    """
+    from .utils import parse_shard
+    from .run_data_upload import run_data_upload
+    shard = parse_shard(args.shard) if args.shard else None
+    run_data_upload(shard=shard)
+
+
+def plan(args):
+    """
+    Scan and classify the EML files without contacting the Member Node, and
+    write the plan file.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    """
+    from .utils import get_config, parse_shard
+    from .plan import make_plan, save_plan, plan_path
+    from .dirindex import open_index
+    config = get_config()
+    node = config.get('nodeid')
+    shard = parse_shard(args.shard) if args.shard else None
+    data_root = config.get('data_root', 'output_eml')
+    index = open_index(data_root) if config.get('dir_index') else None
+    p = make_plan(data_root, node, shard=shard, workers=args.workers, index=index)
+    save_plan(p, args.output or plan_path(node))
+    print(json.dumps({k: p[k] for k in ('counts', 'bytes', 'operations')}, indent=2))
+
+
+def apply(args):
+    """
+    Carry out the Member Node operations in a plan file.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    :return: The exit code; 1 if any package failed.
+    :rtype: int
+    """
+    from .utils import get_config
+    from .pool import ClientPool
+    from .logs import configure_hot_path_logging
+    from .plan import load_plan, apply_plan, plan_path
+    L = getLogger(__name__)
+    config = get_config()
+    node = config.get('nodeid')
+    p = load_plan(args.plan or plan_path(node))
+    if p['node'] != node:
+        L.error(f'The plan was made for {p["node"]}, but the config file is set to {node}')
+        return 1
+    configure_hot_path_logging(queue=config.get('log_queue', False),
+                               sample_rate=config.get('log_sample_rate'))
+    pool = ClientPool(config.get('mnurl'), token_file=config.get('token_file'))
+    try:
+        _, failed = apply_plan(p, config.get('rightsholder_orcid'), pool, node)
+    finally:
+        pool.close()
+    return 1 if failed else 0
+
+
+def merge(args):
+    """
+    Merge the shard ledgers for the configured node into the main ledger.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    :return: The exit code; 1 if there were conflicts.
+    :rtype: int
+    """
+    from .utils import get_config, merge_uploads
+    node = args.node or get_config().get('nodeid')
+    _, conflicts = merge_uploads(node)
+    return 1 if conflicts else 0
+
+
+def mirror(args):
+    """
+    Build or update the local mirror of the Member Node's object listing.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    """
+    from .utils import get_config, get_token, create_client
+    from .mirror import open_mirror, sync_mirror
+    config = get_config()
+    client = create_client(config['mnurl'], get_token())
+    conn = open_mirror(config['nodeid'])
+    sync_mirror(conn, client, full=args.full)
+    conn.close()
+    client._session.close()
+
+
+def acl(args):
+    """
+    Reconcile the access policies of objects on the Member Node with the
+    groups in the config file.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    :return: The exit code; 1 if any object failed.
+    :rtype: int
+    """
+    from .utils import fix_access_policies
+    counts = fix_access_policies(days=None if args.all else args.days, dry_run=args.dry_run, workers=args.workers)
+    return 1 if counts['failed'] else 0
+
+
+def index(args):
+    """
+    Build or refresh the directory index of the data root.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    """
+    from .utils import get_config
+    from .dirindex import DirIndex
+    idx = DirIndex(get_config().get('data_root', 'output_eml'))
+    idx.refresh(workers=args.workers, full=args.full)
+    idx.close()
+
+
+def verify(args):
+    """
+    Check the node ledger against the Member Node.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    :return: The exit code; 1 if any object is missing, differs or has a
+        broken obsoletes chain.
+    :rtype: int
+    """
+    from .verify import verify_uploads
+    report = verify_uploads(node=args.node, mn_url=args.mnurl, use_mirror=args.mirror, workers=args.workers)
+    return 1 if any(report[k] for k in ('missing', 'mismatch', 'broken_chains', 'errors')) else 0
+
+
+def watch(args):
+    """
+    Watch the sheets directory and the EML folder, and convert and upload
+    changed records as they happen.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    """
+    from .utils import get_config
+    from .logs import configure_hot_path_logging
+    from .watch import watch as watch_dirs
+    config = get_config()
+    configure_hot_path_logging(queue=config.get('log_queue', False),
+                               sample_rate=config.get('log_sample_rate'))
+    options = {'sheets_dir': args.sheets, 'crosswalk_file': args.crosswalk,
+               'interval': args.interval, 'debounce': args.debounce}
+    watch_dirs(eml_folder=args.eml_folder, drop=args.drop, poll=args.poll, once=args.once,
+               **{k: v for k, v in options.items() if v is not None})
+
+
+def catalog(args):
+    """
+    Search the local package catalog, after updating its identifiers from
+    the node ledger.
+
+    :param argparse.Namespace args: The parsed command line arguments.
+    :return: The exit code; 1 if no package matches.
+    :rtype: int
+    """
+    import json
+    from .utils import get_config, load_uploads, uploads_path
+    from .catalog import build_catalog, open_catalog, sync_pids, search
+    config = get_config()
+    if args.rebuild:
+        build_catalog(args.eml_folder or config.get('data_root', 'output_eml'))
+    conn = open_catalog()
+    node = args.node or config.get('nodeid')
+    if node and uploads_path(node).exists():
+        sync_pids(conn, node, load_uploads(uploads_path(node)))
+    bbox = tuple(float(v) for v in args.bbox.split(',')) if args.bbox else None
+    results = search(conn, text=args.text, bbox=bbox, subunit=args.subunit, year=args.year,
+                     start=args.start, end=args.end, limit=args.limit)
+    conn.close()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            print('\t'.join(str(r[k] or '') for k in ('package_id', 'pub_date', 'subunit', 'title', 'pids')))
+    return 0 if results else 1
+
+
+def fwcimport(argv: list | None=None):
+    """
+    The ``fwcimport`` console script. Running it without a subcommand starts
+    the upload loop, as before.
+
+    :param list argv: The command line arguments. Defaults to ``sys.argv[1:]``.
+    :return: The exit code.
+    :rtype: int
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if (not argv) or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv = ['upload'] + argv
+    parser = argparse.ArgumentParser(prog='fwcimport', description='Upload FWC EML packages to a DataONE Member Node.')
+    profiling = argparse.ArgumentParser(add_help=False)
+    add_profile_arguments(profiling)
+    sub = parser.add_subparsers(dest='command', required=True)
+    up = sub.add_parser('upload', parents=[profiling], help='upload EML and resource maps (default)')
+    up.add_argument('--shard', metavar='i/N', help='only upload the packages in shard i of N, e.g. 0/4')
+    up.set_defaults(func=upload)
+    pl = sub.add_parser('plan', parents=[profiling], help='classify EML files as new, changed, unchanged or invalid without uploading')
+    pl.add_argument('--shard', metavar='i/N', help='only plan the packages in shard i of N, e.g. 0/4')
+    pl.add_argument('--workers', type=int, help='number of worker processes (default: number of CPUs)')
+    pl.add_argument('--output', help='the plan file (default: ~/fwc-import/{nodeid}.plan.json)')
+    pl.set_defaults(func=plan)
+    ap = sub.add_parser('apply', parents=[profiling], help='upload the new and changed packages in a plan file')
+    ap.add_argument('--plan', help='the plan file (default: ~/fwc-import/{nodeid}.plan.json)')
+    ap.set_defaults(func=apply)
+    mg = sub.add_parser('merge', help='merge shard ledgers into the main node ledger')
+    mg.add_argument('--node', help='the node identifier; defaults to "nodeid" in the config file')
+    mg.set_defaults(func=merge)
+    mr = sub.add_parser('mirror', help='build or update the local mirror of the Member Node object listing')
+    mr.add_argument('--full', action='store_true', help='discard the mirror and list every object again')
+    mr.set_defaults(func=mirror)
+    ac = sub.add_parser('acl', help='update access policies that differ from the config file')
+    ac.add_argument('--days', type=int, default=3, help='check objects modified in the last DAYS days (default: 3)')
+    ac.add_argument('--all', action='store_true', help='check every object on the Member Node')
+    ac.add_argument('--dry-run', action='store_true', help='only report how many objects differ')
+    ac.add_argument('--workers', type=int, default=8, help='number of concurrent requests (default: 8)')
+    ac.set_defaults(func=acl)
+    ix = sub.add_parser('index', help='build or refresh the directory index of the data root')
+    ix.add_argument('--full', action='store_true', help='list every directory again')
+    ix.add_argument('--workers', type=int, default=8, help='number of directories listed at once (default: 8)')
+    ix.set_defaults(func=index)
+    vf = sub.add_parser('verify', help='check that every ledger object exists on the Member Node with the right checksum')
+    vf.add_argument('--node', help='the node identifier; defaults to "nodeid" in the config file')
+    vf.add_argument('--mnurl', help='the Member Node URL; defaults to the "mnurl" of the node\'s entry in "targets", '
+                                    'or to "mnurl" in the config file')
+    vf.add_argument('--mirror', action='store_true', help='check against the local object mirror (synced first) instead of describe requests')
+    vf.add_argument('--workers', type=int, default=32, help='number of concurrent requests (default: 32)')
+    vf.set_defaults(func=verify)
+    wa = sub.add_parser('watch', help='convert and upload changed records as the sheets and EML files change')
+    wa.add_argument('--sheets', help='the directory with the FWC sheets (default: ./fwc_import/manifest/meta)')
+    wa.add_argument('--eml-folder', help='the EML folder; defaults to "data_root" in the config file')
+    wa.add_argument('--crosswalk', help='the column crosswalk file (default: ./fwc_import/manifest/fwc_crosswalk.json)')
+    wa.add_argument('--drop', metavar='FILE', help='JSON list of record keys (e.g. "records_to_fwri.xlsx:14") not to convert')
+    wa.add_argument('--poll', action='store_true', help='poll the directories even if watchdog is installed')
+    wa.add_argument('--interval', type=float, help='seconds between scans when polling (default: 5)')
+    wa.add_argument('--debounce', type=float, help='seconds without changes before a batch is processed (default: 10)')
+    wa.add_argument('--once', action='store_true', help='catch up on changes since the last run and exit')
+    wa.set_defaults(func=watch)
+    ca = sub.add_parser('catalog', help='search the local catalog of converted packages')
+    ca.add_argument('text', nargs='?', help='full-text query on titles, abstracts and places, e.g. \'"tampa bay" seagrass\'')
+    ca.add_argument('--bbox', metavar='W,S,E,N', help='packages whose bounding box overlaps this one; use --bbox=W,S,E,N for negative W')
+    ca.add_argument('--subunit', help='subunit number or part of its name')
+    ca.add_argument('--year', help='year of publication')
+    ca.add_argument('--from', dest='start', metavar='DATE', help='packages whose temporal coverage ends on or after DATE')
+    ca.add_argument('--to', dest='end', metavar='DATE', help='packages whose temporal coverage begins on or before DATE')
+    ca.add_argument('--limit', type=int, help='the most packages to list')
+    ca.add_argument('--json', action='store_true', help='print the packages as JSON')
+    ca.add_argument('--node', help='the node whose ledger identifiers are listed; defaults to "nodeid" in the config file')
+    ca.add_argument('--rebuild', action='store_true', help='rebuild the catalog from the EML folder first')
+    ca.add_argument('--eml-folder', help='the EML folder to rebuild from; defaults to "data_root" in the config file')
+    ca.set_defaults(func=catalog)
+    args = parser.parse_args(argv)
+    setup_logging()
+    L = getLogger(__name__)
+    L.debug(f'Running fwcimport {args.command}')
+    if getattr(args, 'profile', None):
+        start_profiler(args.profile, f'fwcimport-{args.command}', stages=args.profile_stages, every=args.profile_every)
+    try:
+        return args.func(args) or 0
+    finally:
+        stop_profiler()
+
+
+if __name__ == '__main__':
+    sys.exit(fwcimport())
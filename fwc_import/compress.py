@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import gzip
+import threading
+from urllib.parse import urlsplit
+from logging import getLogger
+
+from requests.adapters import HTTPAdapter
+
+MIN_SIZE = 1024
+"""
+Request bodies smaller than this many bytes are sent uncompressed.
+"""
+
+MAX_SIZE = 64 * 1024 * 1024
+"""
+Streamed request bodies larger than this many bytes (large data files) are
+sent uncompressed rather than read into memory to be compressed.
+"""
+
+LEVEL = 6
+"""
+The gzip compression level.
+"""
+
+SUPPORT = {}
+"""
+Whether each Member Node host (``scheme://netloc``) accepts gzip-compressed
+request bodies: True once a compressed request has succeeded, False once one
+has been rejected. Shared by all clients in the process.
+"""
+
+ENCODING_ERRORS = (400, 415)
+"""
+The error statuses that may mean a host does not understand a
+gzip-compressed body. Other errors (e.g. 401, 409, 500) are returned as
+they are, without resending the upload.
+"""
+
+_lock = threading.Lock()
+
+
+def is_upload(request):
+    """
+    Check whether a request is a ``create`` (``POST object``) or ``update``
+    (``PUT object/{pid}``) call.
+
+    :param request: The prepared request.
+    :type request: requests.PreparedRequest
+    :rtype: bool
+    """
+    parts = [p for p in urlsplit(request.url).path.split('/') if p]
+    return ((request.method == 'POST') and (parts[-1:] == ['object'])) or \
+           ((request.method == 'PUT') and (parts[-2:-1] == ['object']))
+
+
+class GzipAdapter(HTTPAdapter):
+    """
+    A transport adapter that sends the multipart body of ``create`` and
+    ``update`` calls with ``Content-Encoding: gzip``.
+
+    The first compressed request to a host is a probe: if the host rejects
+    it with ``400 Bad Request``, the request is sent again uncompressed, and
+    if that succeeds, compression is turned off for the host for the rest of
+    the run. A ``415 Unsupported Media Type`` always turns it off. Other
+    errors are not caused by the encoding, so the upload is not sent twice.
+
+    :param int min_size: Bodies smaller than this are sent as they are.
+    :param int level: The gzip compression level.
+    """
+    def __init__(self, min_size: int=MIN_SIZE, level: int=LEVEL, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+        self.level = level
+
+    def send(self, request, **kwargs):
+        L = getLogger(__name__)
+        host = '{0.scheme}://{0.netloc}'.format(urlsplit(request.url))
+        if (SUPPORT.get(host) is False) or (request.body is None) or not is_upload(request):
+            return super().send(request, **kwargs)
+        body = request.body
+        if getattr(body, 'len', 0) > MAX_SIZE:
+            return super().send(request, **kwargs)
+        if not isinstance(body, (bytes, bytearray)):
+            # a MultipartEncoder stream
+            body = body.read()
+        if len(body) < self.min_size:
+            request.body = body
+            request.headers['Content-Length'] = str(len(body))
+            return super().send(request, **kwargs)
+        plain = request.copy()
+        plain.body = body
+        plain.headers['Content-Length'] = str(len(body))
+        request.body = gzip.compress(body, compresslevel=self.level)
+        request.headers['Content-Encoding'] = 'gzip'
+        request.headers['Content-Length'] = str(len(request.body))
+        response = super().send(request, **kwargs)
+        if response.ok:
+            if SUPPORT.get(host) is None:
+                with _lock:
+                    SUPPORT[host] = True
+                L.info(f'{host} accepts gzip-compressed uploads')
+            L.debug(f'Sent {len(request.body)} gzip bytes for {len(body)} bytes to {request.url}')
+            return response
+        if (response.status_code == 415) or \
+                ((response.status_code in ENCODING_ERRORS) and (SUPPORT.get(host) is None)):
+            # the host may not understand the compressed body; try it plain
+            response.close()
+            retry = super().send(plain, **kwargs)
+            if (response.status_code == 415) or retry.ok:
+                with _lock:
+                    SUPPORT[host] = False
+                L.warning(f'{host} rejected a gzip-compressed upload ({response.status_code}); '
+                          f'sending uploads uncompressed')
+            return retry
+        return response
+
+
+def enable_gzip(client, min_size: int=MIN_SIZE, level: int=LEVEL):
+    """
+    Make a Member Node client send ``create`` and ``update`` bodies
+    gzip-compressed (see :py:class:`GzipAdapter`).
+
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :param int min_size: Bodies smaller than this are sent as they are.
+    :param int level: The gzip compression level.
+    :return: The client.
+    """
+    session = client._session
+    retries = session.get_adapter(client.base_url).max_retries
+    adapter = GzipAdapter(min_size=min_size, level=level, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return client
@@ -1,11 +1,20 @@
+from __future__ import annotations
+
 import os
 import json
-import pandas as pd
 import xml.etree.ElementTree as ET
 import xml.dom.minidom
 import re
 
-from .utils import parse_name
+from .defs import setup_logging
+from .names import resolve_name, resolve_names, load_authority, update_authority
+from .coords import bounding_boxes, BC_COLUMNS
+from .dedup import find_duplicates, save_report, records_to_drop, record_key
+from .profiling import stage, checkpoint, start_profiler, stop_profiler, add_profile_arguments
+from .catalog import open_catalog, add_package
+
+# pandas is imported in the functions that use it, since it takes longer to
+# import than everything else fwcimport needs from this module
 
 CROSSWALK_FILE = './fwc_import/manifest/fwc_crosswalk.json'
 SHEETS_DIR = './fwc_import/manifest/meta'
@@ -67,13 +76,18 @@ metadataProvider = {
     "onlineUrl": "https://myfwc.com",
 }
 
-def add_unique_id(id):
+def add_unique_id(id, table: set | None=None):
     """
     Ensure the id is unique by incrementing the number after the last period if needed.
     Example: "fwc-fwri.478.1", "fwc-fwri.478.2", etc.
+
+    :param str id: The record id.
+    :param set table: The ids already in use. Defaults to the ids used so far
+        in this process.
     """
-    if id not in ID_TABLE:
-        ID_TABLE.add(id)
+    table = ID_TABLE if table is None else table
+    if id not in table:
+        table.add(id)
         return id
     prefix, _, num = id.rpartition('.')
     try:
@@ -85,8 +99,8 @@ def add_unique_id(id):
     while True:
         num += 1
         new_id = f"{prefix}.{num}"
-        if new_id not in ID_TABLE:
-            ID_TABLE.add(new_id)
+        if new_id not in table:
+            table.add(new_id)
             return new_id
 
 def hyphenate(text):
@@ -152,14 +166,39 @@ def register_namespaces():
     ET.register_namespace('stmml', STMML_NS)
 
 
-def build_eml(row, crosswalk, fname):
+def record_id(row, fname):
+    """
+    Get the package id of an FWC record, e.g. ``fwc-fwri.478.1``, from its
+    DatasetID or ProjectID and the sheet it is in.
+    """
     source = "fwc-fwri" if 'fwri' in fname.lower() else "fwc-hsc"
     id = row.get("DatasetID", "") or row.get("ProjectID", "")
     if not id:
         print(f"Warning: No DatasetID or ProjectID found in row: {row}")
-        id = f"{source}.no-id.1"
-    else:
-        id = f"{source}.{id.strip().replace(' ', '-').lower()}.1"
+        return f"{source}.no-id.1"
+    return f"{source}.{id.strip().replace(' ', '-').lower()}.1"
+
+
+def record_filename(row, crosswalk, id):
+    """
+    Get the EML file name for an FWC record from its unique id and title.
+    """
+    # Use title or fallback as filename
+    title_col = next((c for c in crosswalk if 'title' in c.lower()), None)
+    title = row.get(title_col, 'untitled') if title_col else 'untitled'
+    return f'{id}-{hyphenate(str(title)[0:60])}.xml'
+
+
+def build_eml(row, crosswalk, fname, bbox=None):
+    """
+    Build the EML document for one FWC record.
+
+    If the record's bounding coordinate columns are all empty and ``bbox`` is
+    given (see :py:func:`fwc_import.coords.bounding_boxes`), the bounding box
+    of the coordinates found in the record's text is used instead.
+    """
+    import pandas as pd
+    id = record_id(row, fname)
     register_namespaces()
     eml_root = ET.Element(
         f'{{{EML_NS}}}eml',
@@ -172,6 +211,7 @@ def build_eml(row, crosswalk, fname):
         }
     )
     dataset_elem = ET.SubElement(eml_root, f'dataset')
+    creator_name = None
     alt_id_elem = ET.SubElement(dataset_elem, f'alternateIdentifier')
     alt_id_elem.text = id
     # Special handling for urls/alt identifiers
@@ -189,11 +229,11 @@ def build_eml(row, crosswalk, fname):
         if col.lower() == "principalinvestigator":
             # split name into givenName and surName
             if pd.notna(value) and str(value).strip().lower() not in ("", "nan", "nat"):
-                given_name, sur_name = parse_name(value)
+                creator_name = resolve_name(value)
                 creator_elem = ET.SubElement(dataset_elem, "creator")
                 name_elem = ET.SubElement(creator_elem, "individualName")
-                ET.SubElement(name_elem, "givenName").text = clean_xml_text(given_name)
-                ET.SubElement(name_elem, "surName").text = clean_xml_text(sur_name)
+                ET.SubElement(name_elem, "givenName").text = clean_xml_text(creator_name['givenName'])
+                ET.SubElement(name_elem, "surName").text = clean_xml_text(creator_name['surName'])
             continue
         if pd.isna(value) or str(value).strip().lower() in ('', 'nan', 'nat'):
             continue
@@ -211,6 +251,19 @@ def build_eml(row, crosswalk, fname):
             else:
                 leaf = ensure_path(eml_root, path_parts)
                 leaf.text = clean_xml_text(value)
+    if creator_name:
+        # after the crosswalk loop, which may add organizationName and
+        # electronicMailAddress to the creator; userId must come last
+        if creator_name['email'] and creator_elem.find('electronicMailAddress') is None:
+            ET.SubElement(creator_elem, "electronicMailAddress").text = clean_xml_text(creator_name['email'])
+        if creator_name['orcid']:
+            ET.SubElement(creator_elem, "userId", {'directory': 'https://orcid.org'}).text = clean_xml_text(creator_name['orcid'])
+    if (bbox is not None) and pd.notna(bbox['WestBC']) and \
+            all(pd.isna(row.get(c)) or str(row.get(c)).strip().lower() in ('', 'nan', 'nat') for c in BC_COLUMNS):
+        for col in BC_COLUMNS:
+            if crosswalk.get(col):
+                leaf = ensure_path(eml_root, crosswalk[col].split('/'))
+                leaf.text = f'{bbox[col]:.6f}'
     add_contact(dataset_elem)
     add_contact(dataset_elem, elem_type='publisher')
     # Special handling for temporalCoverage: if StartDate exists and EndDate does not, use singleDateTime
@@ -258,28 +311,125 @@ def write_pretty_xml(element, filename, repretty=True):
     with open(filename, 'wb') as f:
         f.write(pretty_xml)
 
-def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    with open(CROSSWALK_FILE) as f:
+def convert(sheets_dir: str=SHEETS_DIR, output_dir: str=OUTPUT_DIR, crosswalk_file: str=CROSSWALK_FILE,
+            dedup_report: bool=False, drop_duplicates: bool=False, drop: str | None=None,
+            update_names: bool=False, report_loc: str | None=None, catalog_loc: str | None=None):
+    """
+    Convert every ``records_to*.xlsx`` sheet in ``sheets_dir`` to EML files in
+    ``output_dir``, and add them to the package catalog (see
+    :py:mod:`fwc_import.catalog`).
+
+    :param str sheets_dir: The directory with the FWC sheets.
+    :param str output_dir: The directory to write the EML files to.
+    :param str crosswalk_file: The column crosswalk file.
+    :param bool dedup_report: Only write the duplicate record report.
+    :param bool drop_duplicates: Convert only the first record of each group
+        of exact duplicates.
+    :param str drop: A JSON file with a list of record keys not to convert.
+    :param bool update_names: Add names that are not in the name authority
+        file to it.
+    :param str report_loc: Where to write the duplicate report. Defaults to
+        :py:data:`fwc_import.dedup.REPORT_LOC`.
+    :param str catalog_loc: The package catalog to add to. Defaults to
+        :py:func:`fwc_import.catalog.catalog_path`.
+    :return: The number of EML files written.
+    :rtype: int
+    """
+    import pandas as pd
+    os.makedirs(output_dir, exist_ok=True)
+    with open(crosswalk_file) as f:
         crosswalk = json.load(f)
+    load_authority()
+
+    sheets = []
+    with stage('read_sheets'):
+        for fname in sorted(os.listdir(sheets_dir)):
+            if (('records_to' in fname) and fname.endswith('.xlsx')):
+                sheets.append((fname, pd.read_excel(os.path.join(sheets_dir, fname), dtype=str)))
+    # find duplicates across all sheets before any EML is written
+    with stage('dedup'):
+        duplicates = find_duplicates(sheets, crosswalk)
+        report_loc = save_report(duplicates, **({'fp': report_loc} if report_loc else {}))
+    if dedup_report:
+        print(len(duplicates['exact']), "exact,", len(duplicates['near']), "near-duplicate and",
+              len(duplicates['shared_id']), "shared id groups written to", report_loc)
+        return 0
+    drop = records_to_drop(duplicates, drop_exact=drop_duplicates, drop_file=drop)
+    catalog = open_catalog(catalog_loc)
+    written = 0
+    for fname, df in sheets:
+        with stage('prepare'):
+            bboxes = bounding_boxes(df)
+            if 'PrincipalInvestigator' in df.columns:
+                names = resolve_names(df['PrincipalInvestigator'])
+                if update_names:
+                    update_authority(names)
+        for idx, row in df.iterrows():
+            if record_key(fname, idx) in drop:
+                continue
+            with stage('build_eml'):
+                eml_tree, id = build_eml(row, crosswalk, fname, bbox=bboxes.loc[idx])
+            id = add_unique_id(id)
+            filename = record_filename(row, crosswalk, id)
+            try:
+                with stage('write_pretty_xml'):
+                    write_pretty_xml(eml_tree, os.path.join(output_dir, filename))
+                add_package(catalog, eml_tree, os.path.join(output_dir, filename))
+                written += 1
+            except Exception as e:
+                print(f"Error writing {filename}: {e}\n{ET.tostring(eml_tree, encoding='utf-8')}")
+                exit(1)
+            checkpoint(written)
+    catalog.commit()
+    catalog.close()
+    print(written, "EML files written to", output_dir)
+    return written
 
-    for fname in os.listdir(SHEETS_DIR):
-        if (('records_to' in fname) and fname.endswith('.xlsx')):
-            df = pd.read_excel(os.path.join(SHEETS_DIR, fname), dtype=str)
-            for _, row in df.iterrows():
-                eml_tree, id = build_eml(row, crosswalk, fname)
-                # Use title or fallback as filename
-                title_col = next((c for c in crosswalk if 'title' in c.lower()), None)
-                title = row.get(title_col, 'untitled') if title_col else 'untitled'
-                id = add_unique_id(id)
-                filename = f'{id}-{hyphenate(str(title)[0:60])}.xml'
-                try:
-                    write_pretty_xml(eml_tree, os.path.join(OUTPUT_DIR, filename))
-                except Exception as e:
-                    print(f"Error writing {filename}: {e}\n{ET.tostring(eml_tree, encoding='utf-8')}")
-                    exit(1)
-    print(len(ID_TABLE), "EML files written to", OUTPUT_DIR)
 
+def main(argv: list | None=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='fwcconvert', description='Convert FWC metadata sheets to EML.')
+    parser.add_argument('--update-names', action='store_true',
+                        help='add names that are not in the name authority file to it, as parsed, for review')
+    parser.add_argument('--dedup-report', action='store_true',
+                        help='only write the duplicate record report; do not write any EML')
+    parser.add_argument('--drop-duplicates', action='store_true',
+                        help='convert only the first record of each group of exact duplicates')
+    parser.add_argument('--drop', metavar='FILE',
+                        help='JSON list of record keys (e.g. "records_to_fwri.xlsx:14") not to convert')
+    parser.add_argument('--db', metavar='SOURCE',
+                        help='convert the records changed since the last run from a SQLite file '
+                             '(or a DB-API DSN, with --dbapi) instead of the sheets')
+    parser.add_argument('--table', default='records',
+                        help='the table or view to read with --db (default: records); a view needs '
+                             '--key and --hwm-column, since it has no rowid')
+    parser.add_argument('--key', default='rowid',
+                        help='the column that identifies a record with --db (default: rowid)')
+    parser.add_argument('--hwm-column', default='rowid',
+                        help='the column past whose last value rows are read with --db, e.g. a '
+                             'modified timestamp (default: rowid, which only picks up new rows, '
+                             'not updated ones)')
+    parser.add_argument('--sheet-name',
+                        help='the sheet name to convert --db records as, e.g. records_to_fwri.xlsx '
+                             '(default: the table name)')
+    parser.add_argument('--dbapi', metavar='MODULE', help='the DB-API driver module for --db, e.g. psycopg2')
+    parser.add_argument('--full', action='store_true', help='with --db, ignore the high-water mark')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    setup_logging()
+    if args.profile:
+        start_profiler(args.profile, 'fwcconvert', stages=args.profile_stages, every=args.profile_every)
+    try:
+        if args.db:
+            from .dbsource import convert_db
+            written = convert_db(args.db, args.table, key=args.key, column=args.hwm_column, fname=args.sheet_name,
+                                 dbapi=args.dbapi, full=args.full)
+            print(len(written), "EML files written to", OUTPUT_DIR)
+        else:
+            convert(dedup_report=args.dedup_report, drop_duplicates=args.drop_duplicates,
+                    drop=args.drop, update_names=args.update_names)
+    finally:
+        stop_profiler()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,177 @@
+import re
+from logging import getLogger
+
+COORD_RE = re.compile(r"""
+    (?<![\w.])
+    (?:
+        # 9°9'42.36"N, 79°50'15.67"W
+        (?P<dms_lat_d>\d{1,2})[°º]\s*(?P<dms_lat_m>\d{1,2})['′]\s*(?P<dms_lat_s>\d{1,2}(?:\.\d+)?)(?:["″]|'')?\s*(?P<dms_lat_h>[NS])\b
+        \s*,?\s*
+        (?P<dms_lon_d>\d{1,3})[°º]\s*(?P<dms_lon_m>\d{1,2})['′]\s*(?P<dms_lon_s>\d{1,2}(?:\.\d+)?)(?:["″]|'')?\s*(?P<dms_lon_h>[EW])\b
+    |
+        # 7° 38.422'N, 81° 42.079'W  /  8° 38.743'N    79° 2.887'W  /  0°41′ S latitude, 76°24′ W longitude
+        (?P<dm_lat_d>\d{1,2})[°º]\s*(?P<dm_lat_m>\d{1,2}(?:\.\d+)?)['′]?\s*(?P<dm_lat_h>[NS])\b(?:\s*latitude)?
+        \s*,?\s*
+        (?P<dm_lon_d>\d{1,3})[°º]\s*(?P<dm_lon_m>\d{1,2}(?:\.\d+)?)['′]?\s*(?P<dm_lon_h>[EW])\b(?:\s*longitude)?
+    |
+        # 8.910718°N, -79.528919°  /  27.5°N, 82.6°W
+        (?P<ddh_lat>[+-]?\d{1,2}(?:\.\d+)?)[°º]?\s*(?P<ddh_lat_h>[NS])\b\s*,?\s*
+        (?P<ddh_lon>[+-]?\d{1,3}(?:\.\d+)?)[°º]?(?:\s*(?P<ddh_lon_h>[EW])\b)?
+    |
+        # Location: 7.69633 -81.61603
+        Location:\s*(?P<loc_lat>[+-]?\d{1,3}(?:\.\d+)?)\s*,?\s+(?P<loc_lon>[+-]?\d{1,3}(?:\.\d+)?)
+    |
+        # 8.994410°, -79.543000°
+        (?P<dd_lat>[+-]?\d{1,3}\.\d+)[°º]?\s*,\s*(?P<dd_lon>[+-]?\d{1,3}\.\d+)[°º]?
+    )
+""", re.VERBOSE)
+"""
+A single regular expression matching every supported coordinate pair format.
+The alternatives are ordered from most to least specific, so each pair in a
+text is matched once, by the most specific format, in a single pass.
+"""
+
+GATE_RE = r'[°º]|Location:'
+"""
+Only text matching this pattern is scanned for coordinates.
+"""
+
+GATE = re.compile(GATE_RE)
+
+BC_COLUMNS = ['WestBC', 'EastBC', 'NorthBC', 'SouthBC']
+"""
+The FWC bounding coordinate columns, in EML order.
+"""
+
+
+def match_pair(m):
+    """
+    Convert one :py:data:`COORD_RE` match to decimal degrees, the same way
+    :py:func:`scan_coordinates` converts a column.
+
+    :param m: The match.
+    :type m: re.Match
+    :return: The latitude and longitude, or None if they are out of range.
+    :rtype: tuple or None
+    """
+    g = m.groupdict()
+
+    def sign(key, neg):
+        return -1.0 if g[key] == neg else 1.0
+    if g['dms_lat_d'] is not None:
+        lat = (float(g['dms_lat_d']) + float(g['dms_lat_m']) / 60 + float(g['dms_lat_s']) / 3600) * sign('dms_lat_h', 'S')
+        lon = (float(g['dms_lon_d']) + float(g['dms_lon_m']) / 60 + float(g['dms_lon_s']) / 3600) * sign('dms_lon_h', 'W')
+    elif g['dm_lat_d'] is not None:
+        lat = (float(g['dm_lat_d']) + float(g['dm_lat_m']) / 60) * sign('dm_lat_h', 'S')
+        lon = (float(g['dm_lon_d']) + float(g['dm_lon_m']) / 60) * sign('dm_lon_h', 'W')
+    elif g['ddh_lat'] is not None:
+        lat = abs(float(g['ddh_lat'])) * sign('ddh_lat_h', 'S')
+        lon = abs(float(g['ddh_lon'])) * sign('ddh_lon_h', 'W') if g['ddh_lon_h'] else float(g['ddh_lon'])
+    else:
+        la, lo = ('loc_lat', 'loc_lon') if g['loc_lat'] is not None else ('dd_lat', 'dd_lon')
+        lat, lon = float(g[la]), float(g[lo])
+        if (abs(lat) > 90) and (abs(lon) <= 90):
+            # written longitude first
+            lat, lon = lon, lat
+    if (abs(lat) <= 90) and (abs(lon) <= 180):
+        return lat, lon
+    return None
+
+
+def find_coordinates(text: str):
+    """
+    Find every coordinate pair in one string. This is the single-string
+    counterpart of :py:func:`scan_coordinates`, without the pandas overhead.
+
+    :param str text: The text to scan.
+    :return: The latitude and longitude pairs, in text order, or None if the
+        text does not match :py:data:`GATE_RE`.
+    :rtype: list or None
+    """
+    if not GATE.search(text):
+        return None
+    return [p for p in map(match_pair, COORD_RE.finditer(text)) if p is not None]
+
+
+def scan_coordinates(text):
+    """
+    Find every coordinate pair in a column of text and convert it to decimal
+    degrees.
+
+    The whole column is matched with :py:data:`COORD_RE` by
+    :py:meth:`pandas.Series.str.extractall`, and the degree/minute/second
+    conversions are done on NumPy arrays. Pairs outside the valid range are
+    dropped; decimal pairs written longitude first are swapped.
+
+    :param text: The text to scan.
+    :type text: pandas.Series
+    :return: One row per pair found, indexed by (original index, match), with
+        ``lat`` and ``lon`` columns.
+    :rtype: pandas.DataFrame
+    """
+    import numpy as np
+    import pandas as pd
+    text = text.fillna('').astype(str)
+    text = text[text.str.contains(GATE_RE)]
+    m = text.str.extractall(COORD_RE)
+    if m.empty:
+        return pd.DataFrame({'lat': [], 'lon': []}, index=m.index)
+
+    def num(col):
+        return m[col].astype(float).to_numpy()
+
+    def sign(col, neg):
+        return np.where(m[col].isin([neg]).to_numpy(), -1.0, 1.0)
+
+    lat = np.full(len(m), np.nan)
+    lon = np.full(len(m), np.nan)
+    # degrees, minutes and seconds
+    k = m['dms_lat_d'].notna().to_numpy()
+    lat = np.where(k, (num('dms_lat_d') + num('dms_lat_m') / 60 + num('dms_lat_s') / 3600) * sign('dms_lat_h', 'S'), lat)
+    lon = np.where(k, (num('dms_lon_d') + num('dms_lon_m') / 60 + num('dms_lon_s') / 3600) * sign('dms_lon_h', 'W'), lon)
+    # degrees and decimal minutes
+    k = m['dm_lat_d'].notna().to_numpy()
+    lat = np.where(k, (num('dm_lat_d') + num('dm_lat_m') / 60) * sign('dm_lat_h', 'S'), lat)
+    lon = np.where(k, (num('dm_lon_d') + num('dm_lon_m') / 60) * sign('dm_lon_h', 'W'), lon)
+    # decimal degrees with hemisphere; the sign of the longitude is kept if it
+    # has no hemisphere
+    k = m['ddh_lat'].notna().to_numpy()
+    lat = np.where(k, np.abs(num('ddh_lat')) * sign('ddh_lat_h', 'S'), lat)
+    lon_h = m['ddh_lon_h'].notna().to_numpy()
+    lon = np.where(k & lon_h, np.abs(num('ddh_lon')) * sign('ddh_lon_h', 'W'), lon)
+    lon = np.where(k & ~lon_h, num('ddh_lon'), lon)
+    # plain decimal degrees
+    for la, lo in (('loc_lat', 'loc_lon'), ('dd_lat', 'dd_lon')):
+        k = m[la].notna().to_numpy()
+        a, b = num(la), num(lo)
+        # written longitude first
+        swap = k & (np.abs(a) > 90) & (np.abs(b) <= 90)
+        lat = np.where(k, np.where(swap, b, a), lat)
+        lon = np.where(k, np.where(swap, a, b), lon)
+    found = pd.DataFrame({'lat': lat, 'lon': lon}, index=m.index)
+    valid = (found['lat'].abs() <= 90) & (found['lon'].abs() <= 180)
+    return found[valid]
+
+
+def bounding_boxes(df, columns: list=['StudyArea', 'Description']):
+    """
+    Compute a bounding box per record from the coordinates found in its text
+    columns.
+
+    :param df: The records.
+    :type df: pandas.DataFrame
+    :param list columns: The text columns to scan.
+    :return: A DataFrame with the same index as ``df`` and ``WestBC``,
+        ``EastBC``, ``NorthBC`` and ``SouthBC`` columns (NaN where no
+        coordinates were found).
+    :rtype: pandas.DataFrame
+    """
+    L = getLogger(__name__)
+    columns = [c for c in columns if c in df.columns]
+    text = df[columns].fillna('').astype(str).agg('\n'.join, axis=1)
+    found = scan_coordinates(text)
+    g = found.groupby(level=0)
+    bbox = g.agg(WestBC=('lon', 'min'), EastBC=('lon', 'max'),
+                 NorthBC=('lat', 'max'), SouthBC=('lat', 'min'))
+    L.info(f'Found {len(found)} coordinate pairs in {len(bbox)} of {len(df)} records')
+    return bbox.reindex(df.index)[BC_COLUMNS]
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import os
+import json
+import sqlite3
+import hashlib
+import importlib
+from pathlib import Path
+from logging import getLogger
+
+from .defs import WORK_LOC
+from .conv import CROSSWALK_FILE, OUTPUT_DIR, build_eml, record_filename, add_unique_id, write_pretty_xml
+from .names import load_authority
+from .coords import bounding_boxes
+from .profiling import stage, checkpoint
+from .catalog import open_catalog, add_package
+
+PLACEHOLDERS = {
+    'qmark': '?',
+    'numeric': ':1',
+    'named': ':hwm',
+    'format': '%s',
+    'pyformat': '%(hwm)s',
+}
+"""
+The query parameter placeholder for each DB-API ``paramstyle``.
+"""
+
+
+def state_path(source: str, table: str):
+    """
+    Get the location of the state file (high-water mark and converted
+    records) for a database table.
+
+    :param str source: The database file or DSN.
+    :param str table: The table or view.
+    :return: The path to the state file.
+    :rtype: Path
+    """
+    key = hashlib.md5(f'{source}|{table}'.encode('utf-8')).hexdigest()[:12]
+    return Path(WORK_LOC / f'dbsource-{key}.json')
+
+
+def load_state(fp: Path):
+    """
+    Read the state of a database source: the high-water mark, and the
+    package id and EML file of each converted record by key.
+
+    :param Path fp: The state file.
+    :return: The state dictionary.
+    :rtype: dict
+    """
+    try:
+        with open(fp, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'hwm': None, 'records': {}}
+
+
+def save_state(state: dict, fp: Path):
+    """
+    Write the state of a database source.
+
+    :param dict state: The state dictionary.
+    :param Path fp: The state file.
+    """
+    tmp = Path(f'{fp}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, fp=f, indent=2)
+    os.replace(tmp, fp)
+
+
+def connect(source: str, dbapi: str | None=None):
+    """
+    Open a database connection: a SQLite file by default, or any DB-API
+    driver by module name (e.g. ``psycopg2``), which is passed ``source`` as
+    its connection string.
+
+    :param str source: The SQLite file or the DSN.
+    :param str dbapi: The DB-API module name, or None for SQLite.
+    :return: The connection and the driver's ``paramstyle``.
+    :rtype: tuple
+    """
+    if not dbapi:
+        if not Path(source).exists():
+            raise FileNotFoundError(f'No SQLite database at {source}')
+        return sqlite3.connect(source), sqlite3.paramstyle
+    module = importlib.import_module(dbapi)
+    return module.connect(source), module.paramstyle
+
+
+def read_changes(conn, table: str, key: str='rowid', column: str='rowid', since=None, paramstyle: str='qmark'):
+    """
+    Select the rows of a table whose ``column`` is past the high-water mark,
+    in ``column`` order, as a DataFrame of strings like the one
+    ``pd.read_excel(..., dtype=str)`` gives for a sheet (empty values are
+    NaN). Two extra columns, ``_key`` and ``_hwm``, hold each row's key (as
+    a string) and its ``column`` value (as the driver returns it).
+
+    :param conn: The DB-API connection.
+    :param str table: The table or view, with the sheet's column names. A
+        view has no ``rowid``, so ``key`` and ``column`` must be given.
+    :param str key: The column that identifies a record across runs.
+    :param str column: The column that increases when a row is added or
+        changed, e.g. a modified timestamp. The SQLite ``rowid`` only
+        increases when a row is added, so updated rows are not read again.
+    :param since: The high-water mark, or None to select every row.
+    :param str paramstyle: The driver's DB-API ``paramstyle``.
+    :rtype: pandas.DataFrame
+    :raises ValueError: If ``rowid`` is used with a SQLite view.
+    """
+    import pandas as pd
+    if ('rowid' in (key, column)) and isinstance(conn, sqlite3.Connection) and \
+            conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (table,)).fetchone():
+        raise ValueError(f'{table} is a view, which has no rowid; give its key and high-water mark columns '
+                         f'(--key and --hwm-column)')
+    query = f'SELECT {key} AS _key, {column} AS _hwm, * FROM {table}'
+    params = ()
+    if since is not None:
+        query += f' WHERE {column} > {PLACEHOLDERS[paramstyle]}'
+        params = {'hwm': since} if paramstyle in ('named', 'pyformat') else (since,)
+    query += f' ORDER BY {column}'
+    cur = conn.cursor()
+    cur.execute(query, params)
+    columns = [d[0] for d in cur.description]
+    df = pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+    hwm = df['_hwm']
+    df = df.astype(object).apply(lambda s: s.map(lambda v: v if pd.isna(v) else str(v)))
+    df['_hwm'] = hwm
+    return df
+
+
+def convert_db(source: str, table: str, output_dir: str=OUTPUT_DIR, crosswalk_file: str=CROSSWALK_FILE,
+               key: str='rowid', column: str='rowid', fname: str | None=None, dbapi: str | None=None,
+               full: bool=False):
+    """
+    Convert the records in a database table (for example a SQLite export of
+    the FWC database, with the columns the crosswalk expects) to EML files in
+    ``output_dir``, incrementally.
+
+    Only rows whose ``column`` is past the high-water mark stored after the
+    last run are read and passed to :py:func:`fwc_import.conv.build_eml`.
+    A record keeps its package id across runs, by ``key``, so a changed row
+    overwrites its EML file. The duplicate checks of
+    :py:func:`fwc_import.conv.convert` need every row and are not run.
+
+    :param str source: The SQLite file or the DSN.
+    :param str table: The table, or a view with ``key`` and ``column`` given.
+    :param str output_dir: The directory to write the EML files to.
+    :param str crosswalk_file: The column crosswalk file.
+    :param str key: The column that identifies a record.
+    :param str column: The high-water mark column.
+    :param str fname: The sheet name to convert the records as (it decides
+        whether ids start with ``fwc-fwri`` or ``fwc-hsc``). Defaults to the
+        table name.
+    :param str dbapi: The DB-API module name, or None for SQLite.
+    :param bool full: Ignore the high-water mark and convert every row.
+    :return: The EML files written.
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = Path(output_dir)
+    with open(crosswalk_file) as f:
+        crosswalk = json.load(f)
+    fname = fname or table
+    fp = state_path(source, table)
+    state = load_state(fp)
+    since = None if full else state['hwm']
+    conn, paramstyle = connect(source, dbapi=dbapi)
+    try:
+        with stage('read_sheets'):
+            df = read_changes(conn, table, key=key, column=column, since=since, paramstyle=paramstyle)
+    finally:
+        conn.close()
+    L.info(f'{table}: {len(df)} rows changed since {since}')
+    if df.empty:
+        return []
+    load_authority()
+    records = state['records']
+    taken = {r['id'] for r in records.values()}
+    bboxes = bounding_boxes(df)
+    catalog = open_catalog()
+    written = []
+    for idx, row in df.iterrows():
+        rkey = row['_key']
+        with stage('build_eml'):
+            eml_tree, id = build_eml(row.drop(['_key', '_hwm']), crosswalk, fname, bbox=bboxes.loc[idx])
+        old = records.get(rkey)
+        id = old['id'] if old else add_unique_id(id, table=taken)
+        filename = record_filename(row, crosswalk, id)
+        if old and (old['file'] != filename):
+            # the title changed; keep one EML file per record
+            output_dir.joinpath(old['file']).unlink(missing_ok=True)
+        with stage('write_pretty_xml'):
+            write_pretty_xml(eml_tree, output_dir.joinpath(filename))
+        add_package(catalog, eml_tree, output_dir.joinpath(filename))
+        records[rkey] = {'id': id, 'file': filename}
+        written.append(output_dir.joinpath(filename))
+        checkpoint(len(written))
+    catalog.commit()
+    catalog.close()
+    hwm = df['_hwm'].iloc[-1]
+    hwm = hwm.item() if hasattr(hwm, 'item') else hwm
+    state['hwm'] = hwm if isinstance(hwm, (int, float, str)) else str(hwm)
+    save_state(state, fp)
+    L.info(f'{table}: {len(written)} EML files written to {output_dir}; high-water mark {state["hwm"]}')
+    return written
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import json
+import hashlib
+from pathlib import Path
+from logging import getLogger
+from difflib import SequenceMatcher
+
+from .defs import WORK_LOC
+
+EXCLUDE_COLUMNS = ['DatasetURL', 'ProjectURL']
+"""
+Crosswalk columns that are left out of the record content hash, since the
+same dataset is linked from different places in the FWRI and HSC sheets.
+"""
+
+NEAR_THRESHOLD = 0.9
+"""
+The minimum :py:class:`difflib.SequenceMatcher` ratio of two records'
+normalized content for them to be reported as near-duplicates.
+"""
+
+REPORT_LOC = WORK_LOC.joinpath('duplicates.json')
+"""
+The location of the duplicate report.
+Defaults to ``~/fwc-import/duplicates.json``.
+"""
+
+
+def record_key(fname: str, idx: int):
+    """
+    Identify a record by its sheet and spreadsheet row number (the header is
+    row 1, so the first record is row 2).
+
+    :param str fname: The sheet file name.
+    :param int idx: The 0-based DataFrame index of the record.
+    :return: The record key, e.g. ``records_to_fwri.xlsx:14``.
+    :rtype: str
+    """
+    return f'{fname}:{idx + 2}'
+
+
+def normalize_records(df, columns: list):
+    """
+    Normalize the content columns of every record into one string per record:
+    empty values are blanked, case is folded and whitespace is collapsed.
+
+    :param df: The records.
+    :type df: pandas.DataFrame
+    :param list columns: The content columns.
+    :return: The normalized content of each record.
+    :rtype: pandas.Series
+    """
+    cols = [c for c in columns if c in df.columns]
+    norm = df[cols].fillna('').astype(str)
+    norm = norm.apply(lambda s: s.str.replace(' 00:00:00', '', regex=False)
+                                 .str.replace(r'\s+', ' ', regex=True)
+                                 .str.strip()
+                                 .str.casefold()
+                                 .replace({'nan': '', 'nat': ''}))
+    return norm.agg('\x1f'.join, axis=1)
+
+
+def find_duplicates(sheets: list, crosswalk: dict, threshold: float=NEAR_THRESHOLD):
+    """
+    Find exact and near-duplicate records across all sheets.
+
+    Records are exact duplicates when the MD5 of their normalized content is
+    the same. Records with different content are compared for near-duplicates
+    only when they share a normalized title, so the comparison stays cheap.
+    Records that share a DatasetID (or ProjectID) but not their content are
+    reported as well, whatever their titles: they are often the same dataset
+    edited in one sheet and not the other, and their package ids collide.
+
+    :param list sheets: (file name, DataFrame) pairs.
+    :param dict crosswalk: The column crosswalk.
+    :param float threshold: The similarity ratio for near-duplicates.
+    :return: A dictionary with ``exact``, ``near`` and ``shared_id`` lists of
+        groups; each group is a list of ``{key, id, title}`` records, in sheet
+        order.
+    :rtype: dict
+    """
+    import pandas as pd
+    L = getLogger(__name__)
+    columns = [c for c in crosswalk if c not in EXCLUDE_COLUMNS]
+    frames = []
+    for fname, df in sheets:
+        def col(name):
+            return (df[name] if name in df.columns else pd.Series('', index=df.index)).fillna('').astype(str)
+        dataset_id, project_id = col('DatasetID'), col('ProjectID')
+        frames.append(pd.DataFrame({
+            'key': [record_key(fname, i) for i in df.index],
+            'id': dataset_id.where(dataset_id != '', project_id),
+            'title': col('Title'),
+            'norm': normalize_records(df, columns),
+        }))
+    records = pd.concat(frames, ignore_index=True)
+    records['hash'] = [hashlib.md5(n.encode('utf-8')).hexdigest() for n in records['norm']]
+    records['block'] = records['title'].str.replace(r'\W+', ' ', regex=True).str.strip().str.casefold()
+
+    def describe(rows):
+        return [{'key': r.key, 'id': r.id, 'title': r.title} for r in rows.itertuples()]
+
+    exact = [describe(g) for _, g in records.groupby('hash', sort=False) if len(g) > 1]
+    # near-duplicates: one representative per distinct content within each title block
+    near = []
+    reps = records.drop_duplicates('hash')
+    for block, g in reps.groupby('block', sort=False):
+        if (not block) or (len(g) < 2):
+            continue
+        rows = list(g.itertuples())
+        # union-find over the pairs that are similar enough
+        parent = list(range(len(rows)))
+
+        def find(a):
+            while parent[a] != a:
+                parent[a] = parent[parent[a]]
+                a = parent[a]
+            return a
+
+        for a in range(len(rows)):
+            for b in range(a + 1, len(rows)):
+                if SequenceMatcher(None, rows[a].norm, rows[b].norm).ratio() >= threshold:
+                    parent[find(b)] = find(a)
+        groups = {}
+        for a in range(len(rows)):
+            groups.setdefault(find(a), []).append(rows[a].hash)
+        for hashes in groups.values():
+            if len(hashes) > 1:
+                near.append(describe(records[records['hash'].isin(hashes)]))
+    # shared ids; a group that is all one exact duplicate is already reported
+    ids = records['id'].str.strip()
+    shared = [describe(g) for i, g in records[ids != ''].groupby(ids[ids != ''], sort=False)
+              if (len(g) > 1) and (g['hash'].nunique() > 1)]
+    L.info(f'Found {len(exact)} groups of exact duplicates ({sum(len(g) - 1 for g in exact)} redundant records), '
+           f'{len(near)} groups of near-duplicates and {len(shared)} shared ids in {len(records)} records')
+    return {'exact': exact, 'near': near, 'shared_id': shared}
+
+
+def save_report(duplicates: dict, fp: Path=REPORT_LOC):
+    """
+    Write the duplicate report.
+
+    :param dict duplicates: The duplicates found by :py:func:`find_duplicates`.
+    :param Path fp: The file to write.
+    :return: The path to the report.
+    :rtype: Path
+    """
+    L = getLogger(__name__)
+    fp = Path(fp)
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    with open(fp, 'w') as f:
+        json.dump(duplicates, fp=f, indent=2, ensure_ascii=False)
+    L.info(f'Wrote duplicate report to {fp}')
+    return fp
+
+
+def records_to_drop(duplicates: dict, drop_exact: bool=False, drop_file: Path | None=None):
+    """
+    Decide which records to leave out of the conversion.
+
+    :param dict duplicates: The duplicates found by :py:func:`find_duplicates`.
+    :param bool drop_exact: Drop all but the first record of each group of
+        exact duplicates.
+    :param Path drop_file: A JSON file with a list of record keys to drop,
+        e.g. chosen by the operator from the near-duplicate groups.
+    :return: The record keys to drop.
+    :rtype: set
+    """
+    drop = set()
+    if drop_exact:
+        for group in duplicates['exact']:
+            drop.update(r['key'] for r in group[1:])
+    if drop_file:
+        with open(drop_file, 'r') as f:
+            drop.update(json.load(f))
+    return drop
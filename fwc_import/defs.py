@@ -46,14 +46,48 @@ The location of the logging configuration file.
 Defaults to ``~/.config/fwc-import/log/config.json``.
 """
 
-with open(LOGCONFIG, 'r') as lc:
-    LOGGING_CONFIG = json.load(lc)
+LOGGING_CONFIG = None
+"""
+The logging configuration dictionary.
+Read from the file specified by ``LOGCONFIG`` by :py:func:`setup_logging`.
+"""
+
+
+def setup_logging():
     """
-    The logging configuration dictionary.
-    Defaults to the values in the file specified by ``LOGCONFIG``.
+    Apply the logging configuration in ``LOGCONFIG``. This is done on first use
+    by the console scripts rather than on import, so that importing the package
+    is cheap and does not fail when the logging config file is missing. In that
+    case, INFO and above are logged to stdout.
+
+    Calling this more than once has no effect.
+
+    :return: The logging configuration dictionary.
+    :rtype: dict
     """
+    global LOGGING_CONFIG
+    if LOGGING_CONFIG is not None:
+        return LOGGING_CONFIG
+    try:
+        with open(LOGCONFIG, 'r') as lc:
+            LOGGING_CONFIG = json.load(lc)
+    except FileNotFoundError:
+        LOGGING_CONFIG = {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "formatters": {"standard": {
+                "format": "%(asctime)s:%(levelname)s:%(name)s.%(funcName)s: %(message)s",
+                "datefmt": "%Y-%m-%dT%H:%M:%S"}},
+            "handlers": {"stream": {
+                "level": "INFO", "formatter": "standard",
+                "class": "logging.StreamHandler", "stream": "ext://sys.stdout"}},
+            "loggers": {"": {"handlers": ["stream"], "level": "INFO"}},
+        }
+    dictConfig(LOGGING_CONFIG)
+    if not LOGCONFIG.exists():
+        getLogger(__name__).warning(f'No logging config found at {LOGCONFIG}; logging to stdout only')
+    return LOGGING_CONFIG
 
-dictConfig(LOGGING_CONFIG)
 WORK_LOC = Path('~/fwc-import/').expanduser().absolute()
 """
 The location of the working directory.
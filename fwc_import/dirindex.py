@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import hashlib
+from pathlib import Path
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+
+from .defs import WORK_LOC
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir, name);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+"""
+"""
+The directory index schema. Paths are absolute.
+"""
+
+
+def index_path(root: Path | str):
+    """
+    Get the location of the directory index for a root directory.
+
+    :param root: The root directory.
+    :type root: Path or str
+    :return: The path to the SQLite database.
+    :rtype: Path
+    """
+    key = hashlib.md5(os.path.abspath(root).encode('utf-8')).hexdigest()[:12]
+    return Path(WORK_LOC / f'dirindex-{key}.sqlite')
+
+
+def visit(path: str, known_mtime: int | None):
+    """
+    Stat a directory and, if its modification time differs from the indexed
+    one, list it. This is the per-directory work of :py:meth:`DirIndex.refresh`
+    and runs in a worker thread.
+
+    :param str path: The directory.
+    :param int known_mtime: The indexed modification time in ns, or None.
+    :return: The directory, its modification time (None if it no longer
+        exists), and its ``(files, subdirs)`` listing (None if it has not
+        changed).
+    :rtype: tuple
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return path, None, None
+    if mtime == known_mtime:
+        return path, mtime, None
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.path, path, entry.name, st.st_size, st.st_mtime_ns))
+                except FileNotFoundError:
+                    continue
+    except (FileNotFoundError, PermissionError):
+        return path, None, None
+    return path, mtime, (files, subdirs)
+
+
+class DirIndex:
+    """
+    A persistent index of the files under a directory, for file systems such
+    as CephFS where every ``stat``, ``exists`` and directory listing is a
+    metadata server round trip.
+
+    :py:meth:`refresh` walks the tree with :py:func:`os.scandir`, in parallel
+    across directories. On later refreshes only the directories whose
+    modification time has changed are listed again; the others cost one
+    ``stat``. Lookups (:py:meth:`exists`, :py:meth:`files`, :py:meth:`find`)
+    then go to the index instead of the file system.
+
+    A directory's modification time changes when entries are added, removed
+    or renamed, not when a file is rewritten in place, so the size and
+    modification time of such a file are as of the last time its directory
+    was listed. Use ``full`` to list everything again.
+
+    :param root: The root directory.
+    :type root: Path or str
+    :param Path fp: The index database. Defaults to :py:func:`index_path`.
+    """
+    def __init__(self, root: Path | str, fp: Path | None=None):
+        self.root = os.path.abspath(root)
+        self.fp = fp or index_path(root)
+        self.conn = sqlite3.connect(self.fp, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def refresh(self, workers: int=8, full: bool=False):
+        """
+        Bring the index up to date with the file system.
+
+        :param int workers: The number of directories to stat and list at once.
+        :param bool full: List every directory again.
+        :return: The number of directories listed and the number visited.
+        :rtype: tuple
+        """
+        L = getLogger(__name__)
+        conn = self.conn
+        known = {} if full else dict(conn.execute('SELECT path, mtime_ns FROM dirs'))
+        seen = []
+        listed = 0
+        frontier = [self.root]
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            while frontier:
+                next_frontier = []
+                for path, mtime, listing in ex.map(lambda d: visit(d, known.get(d)), frontier):
+                    if mtime is None:
+                        continue
+                    seen.append((path,))
+                    if listing is None:
+                        next_frontier += [r[0] for r in conn.execute('SELECT path FROM dirs WHERE parent = ?', (path,))]
+                        continue
+                    files, subdirs = listing
+                    listed += 1
+                    conn.execute('DELETE FROM files WHERE dir = ?', (path,))
+                    conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', files)
+                    parent = os.path.dirname(path) if path != self.root else None
+                    conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (path, parent, mtime))
+                    # the subdirectories' own rows are written when they are visited
+                    conn.executemany('INSERT OR IGNORE INTO dirs VALUES (?, ?, NULL)', [(s, path) for s in subdirs])
+                    next_frontier += subdirs
+                conn.commit()
+                frontier = next_frontier
+        # forget directories that are gone, and their files
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM seen')
+        conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)', seen)
+        conn.execute('DELETE FROM files WHERE dir NOT IN (SELECT path FROM seen)')
+        conn.execute('DELETE FROM dirs WHERE path NOT IN (SELECT path FROM seen)')
+        conn.commit()
+        L.info(f'Directory index of {self.root}: listed {listed} of {len(seen)} directories; '
+               f'{self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]} files')
+        return listed, len(seen)
+
+    def files(self, folder: Path | str, pattern: str='*'):
+        """
+        Enumerate the files in a directory (not recursively) whose names match
+        a glob pattern, in name order. The rows are read from the index as
+        they are consumed.
+
+        :param folder: The directory.
+        :type folder: Path or str
+        :param str pattern: The glob pattern, e.g. ``*.xml``.
+        :return: A generator of paths.
+        """
+        cur = self.conn.execute('SELECT path FROM files WHERE dir = ? AND name GLOB ? ORDER BY name',
+                                (os.path.abspath(folder), pattern))
+        for (path,) in cur:
+            yield Path(path)
+
+    def count(self, folder: Path | str, pattern: str='*'):
+        """
+        Count the files in a directory whose names match a glob pattern.
+
+        :param folder: The directory.
+        :type folder: Path or str
+        :param str pattern: The glob pattern.
+        :rtype: int
+        """
+        return self.conn.execute('SELECT COUNT(*) FROM files WHERE dir = ? AND name GLOB ?',
+                                 (os.path.abspath(folder), pattern)).fetchone()[0]
+
+    def stat(self, path: Path | str):
+        """
+        Get the indexed size and modification time of a file.
+
+        :param path: The file.
+        :type path: Path or str
+        :return: ``(size, mtime_ns)``, or None if the file is not indexed.
+        :rtype: tuple or None
+        """
+        return self.conn.execute('SELECT size, mtime_ns FROM files WHERE path = ?',
+                                 (os.path.abspath(path),)).fetchone()
+
+    def exists(self, path: Path | str):
+        """
+        Check whether a file or directory is in the index.
+
+        :param path: The file or directory.
+        :type path: Path or str
+        :rtype: bool
+        """
+        return (self.stat(path) is not None) or (self.conn.execute(
+            'SELECT 1 FROM dirs WHERE path = ?', (os.path.abspath(path),)).fetchone() is not None)
+
+    def find(self, name: str):
+        """
+        Find the files with a given name anywhere under the root.
+
+        :param str name: The file name.
+        :return: The paths.
+        :rtype: list
+        """
+        return [Path(r[0]) for r in self.conn.execute('SELECT path FROM files WHERE name = ? ORDER BY path', (name,))]
+
+    def close(self):
+        self.conn.close()
+
+
+def list_files(folder: Path | str, pattern: str='*.xml', index: DirIndex | None=None):
+    """
+    List the files in a folder that match a glob pattern, in order, from the
+    directory index if one is given and from the file system otherwise.
+
+    :param folder: The folder.
+    :type folder: Path or str
+    :param str pattern: The glob pattern.
+    :param DirIndex index: The directory index, or None.
+    :return: The number of files and an iterable of their paths.
+    :rtype: tuple
+    """
+    if index is not None:
+        return index.count(folder, pattern), index.files(folder, pattern)
+    paths = sorted(Path(folder).glob(pattern))
+    return len(paths), paths
+
+
+def open_index(root: Path | str, workers: int=8):
+    """
+    Open and refresh the directory index for a root directory.
+
+    :param root: The root directory.
+    :type root: Path or str
+    :param int workers: The number of directories to stat and list at once.
+    :return: The index.
+    :rtype: DirIndex
+    """
+    index = DirIndex(root)
+    index.refresh(workers=workers)
+    return index
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import uuid
+import hashlib
+import datetime
+from pathlib import Path
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+
+from d1_common.types import dataoneTypes, exceptions
+
+from .defs import CN_URL
+from .utils import load_uploads, save_uploads, shard_of, uploads_path
+from .conv import write_pretty_xml, register_namespaces
+from .pool import ClientPool
+from .logs import sample_package
+from .plan import classify, content_hash
+from .dirindex import list_files
+from .profiling import stage, checkpoint
+from .run_data_upload import generate_system_metadata, generate_resource_map, \
+            sysmeta_obsolete_updates, load_shard_uploads, report
+
+EML_FORMAT = 'https://eml.ecoinformatics.org/eml-2.2.0'
+ORE_FORMAT = 'http://www.openarchives.org/ore/terms'
+
+
+class SerializedSysMeta:
+    """
+    System metadata that is serialized once and then sent as the same bytes
+    to every target. Stands in for the pyxb object in
+    ``MemberNodeClient_2_0.create``, which only calls ``toxml``.
+
+    :param sysmeta: The system metadata.
+    :type sysmeta: dataoneTypes.systemMetadata
+    """
+    def __init__(self, sysmeta):
+        self.xml = sysmeta.toxml('utf-8')
+
+    def toxml(self, encoding: str='utf-8'):
+        return self.xml if encoding.lower() in ('utf-8', 'utf8') else self.xml.decode('utf-8').encode(encoding)
+
+
+class Target:
+    """
+    One Member Node to upload to, with its own client pool, ledger and
+    success and failure lists.
+
+    :param dict target: The target config: ``nodeid``, ``mnurl`` and
+        optionally ``token_file``.
+    :param tuple shard: The shard index and shard count, or None.
+    """
+    def __init__(self, target: dict, shard: tuple | None=None):
+        L = getLogger(__name__)
+        self.node = target['nodeid']
+        self.mn_url = target['mnurl']
+        self.pool = ClientPool(self.mn_url, token_file=target.get('token_file'))
+        self.uploads_loc = uploads_path(self.node, shard)
+        try:
+            self.uploads = load_shard_uploads(self.node, shard) if shard else load_uploads(self.uploads_loc)
+        except FileNotFoundError:
+            self.uploads = {}
+        self.succ_list = []
+        self.err_list = []
+        L.info(f'Target {self.node} at {self.mn_url}; ledger {self.uploads_loc}')
+
+    def needs(self, package_id: str, scanned: dict):
+        """
+        Check whether this target still needs a package: its ledger entry is
+        not classified as unchanged (see :py:func:`fwc_import.plan.classify`).
+
+        :param str package_id: The package's alternateIdentifier.
+        :param dict scanned: The EML's ``content_md5`` and file ``md5``, as
+            from :py:func:`fwc_import.plan.scan_eml`.
+        :rtype: bool
+        """
+        return classify(scanned, self.uploads.get(package_id)) != 'unchanged'
+
+
+def prepare_package(eml_path: Path, root: ET.Element, package_id: str, orcid: str):
+    """
+    Do the local work for a package once for all targets: assign a new
+    packageId (a UUID, so that the EML bytes are the same on every node),
+    write the EML, and build and serialize the EML system metadata, the
+    resource map and the resource map system metadata.
+
+    :param Path eml_path: The EML file.
+    :param root: The parsed EML root element.
+    :type root: xml.etree.ElementTree.Element
+    :param str package_id: The package's alternateIdentifier.
+    :param str orcid: The ORCID of the uploader.
+    :return: The prepared objects and their metadata.
+    :rtype: dict
+    """
+    rpid = f'urn:uuid:{uuid.uuid4()}'
+    root.attrib['packageId'] = rpid
+    with stage('write_eml'):
+        write_pretty_xml(root, eml_path, repretty=False)
+        eml_bytes = eml_path.read_bytes()
+    with stage('sysmeta'):
+        eml_sm, eml_md5, eml_size = generate_system_metadata(pid=rpid, sid=package_id, format_id=EML_FORMAT,
+                                                             science_object=eml_bytes, orcid=orcid)
+        eml_sm = SerializedSysMeta(eml_sm)
+    rm_pid = f'resource_map_{rpid}'
+    with stage('resource_map'):
+        rm_bytes = generate_resource_map(eml_pid=rpid, rm_pid=rm_pid, data_pids=[rpid]).serialize(format='xml')
+        if isinstance(rm_bytes, str):
+            rm_bytes = rm_bytes.encode('utf-8')
+        rm_sm, rm_md5, rm_size = generate_system_metadata(pid=rm_pid, sid=package_id, format_id=ORE_FORMAT,
+                                                          science_object=rm_bytes, orcid=orcid)
+        rm_sm = SerializedSysMeta(rm_sm)
+    return {
+        'package_id': package_id,
+        'filename': eml_path.name,
+        'content_md5': content_hash(root),
+        'eml': {'pid': rpid, 'bytes': eml_bytes, 'sysmeta': eml_sm, 'md5': eml_md5, 'size': eml_size},
+        'resource_map': {'pid': rm_pid, 'bytes': rm_bytes, 'sysmeta': rm_sm, 'md5': rm_md5, 'size': rm_size},
+    }
+
+
+def create_object(pid: str, data: bytes, sysmeta: SerializedSysMeta, client):
+    """
+    Create one prepared object on a Member Node.
+
+    :param str pid: The object identifier.
+    :param bytes data: The object.
+    :param SerializedSysMeta sysmeta: The serialized system metadata.
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :raises exceptions.DataONEException: If the Member Node does not return
+        the identifier.
+    """
+    response = client.create(pid, data, sysmeta)
+    if not (isinstance(response, dataoneTypes.Identifier) and response.value() == pid):
+        raise exceptions.DataONEException(f'Unexpected response creating {pid}: {response}')
+
+
+def send_package(prepared: dict, target: Target):
+    """
+    Send a prepared package to one target: create the EML and resource map,
+    obsolete the target's previous versions, and record the result in the
+    target's ledger. The EML's ``content_md5`` is only recorded once the
+    resource map is created.
+
+    :param dict prepared: The result of :py:func:`prepare_package`.
+    :param Target target: The Member Node to send to.
+    """
+    L = getLogger(__name__)
+    sep = '' if CN_URL.endswith('/') else '/'
+    package_id = prepared['package_id']
+    entry = target.uploads.get(package_id) or {}
+    target.uploads[package_id] = entry
+    old_eml_pid = entry['eml']['identifier'] if entry.get('eml') else None
+    old_resource_map_pid = entry['resource_map']['identifier'] if entry.get('resource_map') else None
+    for kind, old_pid, fname, fmt in (('eml', old_eml_pid, prepared['filename'], EML_FORMAT),
+                                      ('resource_map', old_resource_map_pid, 'resource_map.xml', ORE_FORMAT)):
+        obj = prepared[kind]
+        with stage(f'upload_{kind}'):
+            target.pool.call(create_object, obj['pid'], obj['bytes'], obj['sysmeta'])
+        L.info(f'{package_id} {target.node} {kind} uploaded: {obj["pid"]}')
+        if old_pid:
+            with stage('obsolete'):
+                target.pool.call(sysmeta_obsolete_updates, old_pid=old_pid, new_pid=obj['pid'])
+        entry[kind] = {
+            'filename': fname,
+            'size': obj['size'],
+            'doi': package_id,
+            'identifier': obj['pid'],
+            'md5': obj['md5'],
+            'formatId': fmt,
+            'url': f"{CN_URL}{sep}v2/resolve/{obj['pid']}",
+            'obsoletes': old_pid,
+        }
+        if kind == 'eml':
+            # set once the resource map is created, so that an incomplete package counts as changed
+            entry[kind]['content_md5'] = None
+    entry['eml']['content_md5'] = prepared['content_md5']
+
+
+def upload_to_targets(eml_folder: str, orcid: str, targets: list, shard: tuple | None=None, index=None):
+    """
+    Upload each EML file in a folder to several Member Nodes in one pass.
+
+    Each package is read, parsed, hashed and serialized once
+    (:py:func:`prepare_package`) and then sent to every target that does not
+    already have the same content, concurrently, one thread per target. A
+    failure on one target does not stop the others; each target keeps its
+    own ledger and report.
+
+    :param str eml_folder: Path to the folder containing EML files.
+    :param str orcid: The ORCID of the uploader.
+    :param list targets: The :py:class:`Target` objects.
+    :param tuple shard: The shard index and shard count, or None.
+    :param index: The directory index to enumerate the EML files from, or None.
+    :type index: fwc_import.dirindex.DirIndex or None
+    :return: The targets, with their success and failure lists filled in.
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    register_namespaces()
+    n, eml_files = list_files(eml_folder, '*.xml', index=index)
+    L.info(f'Uploading {n} EML files to {len(targets)} targets: {", ".join(t.node for t in targets)}')
+    started = datetime.datetime.now(datetime.timezone.utc)
+    i = 0
+    try:
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            for eml_path in eml_files:
+                i += 1
+                try:
+                    with stage('parse'):
+                        eml_bytes = eml_path.read_bytes()
+                        root = ET.fromstring(eml_bytes)
+                        alt_id_elem = root.find('.//alternateIdentifier')
+                        package_id = alt_id_elem.text if alt_id_elem is not None else None
+                    if not package_id:
+                        L.error(f'No packageId found in {eml_path.name}, skipping.')
+                        for t in targets:
+                            t.err_list.append(eml_path.name)
+                        continue
+                    if shard and (shard_of(package_id, shard[1]) != shard[0]):
+                        continue
+                    scanned = {'error': None, 'content_md5': content_hash(root),
+                               'md5': hashlib.md5(eml_bytes).hexdigest()}
+                    todo = [t for t in targets if t.needs(package_id, scanned)]
+                    if not todo:
+                        L.debug(f'{package_id} is up to date on every target; skipping')
+                        continue
+                    sample_package(package_id)
+                    L.info(f'({i}/{n}) Working on {package_id} from {eml_path.name} for {", ".join(t.node for t in todo)}')
+                    prepared = prepare_package(eml_path, root, package_id, orcid)
+                except Exception as e:
+                    L.error(f'{eml_path} / {repr(e)}')
+                    for t in targets:
+                        t.err_list.append(str(eml_path))
+                    continue
+                futures = {t: executor.submit(send_package, prepared, t) for t in todo}
+                for t, future in futures.items():
+                    try:
+                        future.result()
+                        t.succ_list.append(package_id)
+                    except Exception as e:
+                        t.err_list.append(str(eml_path))
+                        L.error(f'{eml_path} / {t.node} / {repr(e)}')
+                    finally:
+                        with stage('ledger'):
+                            save_uploads(t.uploads, fp=t.uploads_loc)
+                sample_package(None)
+                checkpoint(i)
+                now = datetime.datetime.now(datetime.timezone.utc)
+                for t in todo:
+                    t.pool.warn_if_expiring(now + (now - started) / i * (n - i))
+    except KeyboardInterrupt:
+        L.info('Caught KeyboardInterrupt; generating report...')
+    finally:
+        for t in targets:
+            save_uploads(t.uploads, fp=t.uploads_loc)
+            L.info(f'Report for {t.node}:')
+            report(succ=len(t.succ_list), fail=len(t.err_list), finished_dois=t.succ_list, failed_dois=t.err_list)
+    return targets
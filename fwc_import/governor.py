@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import datetime
+import threading
+from pathlib import Path
+from logging import getLogger
+
+from .defs import CONFIG_LOC
+
+GOVERNED = ['generateIdentifier', 'create', 'update', 'updateSystemMetadata']
+"""
+Member Node calls that count against the request rate. The bodies of
+``create`` and ``update`` also count against the byte rate.
+"""
+
+BURST = 2.0
+"""
+The bucket sizes, in seconds of their rates, so that short bursts are sent
+at full speed.
+"""
+
+CHECK_INTERVAL = 5.0
+"""
+The most seconds between checks of the governor file for changes.
+"""
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def governor_path():
+    """
+    Get the default location of the governor file.
+
+    :rtype: Path
+    """
+    return Path(CONFIG_LOC / 'governor.json')
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. Tokens are added at ``rate`` per second up to
+    ``burst`` seconds' worth. A take larger than the bucket waits for a full
+    bucket and leaves it in debt, so the average rate holds for large bodies
+    too.
+
+    :param rate: Tokens per second, or None for no limit.
+    :type rate: float or None
+    :param float burst: The bucket size in seconds of ``rate``.
+    """
+    def __init__(self, rate: float | None=None, burst: float=BURST):
+        self._lock = threading.Lock()
+        self.rate = None
+        self.burst = burst
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.set_rate(rate, burst)
+
+    @property
+    def capacity(self):
+        return self.rate * self.burst
+
+    def set_rate(self, rate: float | None, burst: float=BURST):
+        """
+        Change the rate. The tokens already in the bucket are kept, up to
+        the new size.
+        """
+        with self._lock:
+            self._fill()
+            was = self.rate
+            self.rate = float(rate) if rate else None
+            self.burst = burst
+            if self.rate:
+                self.tokens = self.capacity if was is None else min(self.tokens, self.capacity)
+
+    def _fill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, n: float):
+        """
+        Take ``n`` tokens, waiting until they are available.
+
+        :param float n: The number of tokens.
+        :return: The seconds waited.
+        :rtype: float
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return waited
+                self._fill()
+                need = min(n, self.capacity)
+                if self.tokens >= need:
+                    self.tokens -= n
+                    return waited
+                delay = (need - self.tokens) / self.rate
+            # sleep in short steps so that a rate change takes effect
+            delay = min(delay, 1.0)
+            time.sleep(delay)
+            waited += delay
+
+
+def profile_limits(settings: dict, now: datetime.datetime):
+    """
+    Get the limits that apply at a time. The first profile whose days and
+    hours include ``now`` overrides the top-level values; a missing or null
+    value means no limit.
+
+    :param dict settings: The governor settings, e.g.
+        ``{"bytes_per_second": 2e6, "requests_per_second": 5, "profiles":
+        [{"start": "19:00", "end": "07:00", "bytes_per_second": 2e7}]}``.
+        A profile may also list ``days`` (``mon`` to ``sun``); one whose
+        ``end`` is before its ``start`` runs past midnight.
+    :param datetime now: The local time.
+    :return: The bytes per second and requests per second.
+    :rtype: tuple
+    """
+    limits = dict(settings)
+    hhmm = now.strftime('%H:%M')
+    for profile in settings.get('profiles') or []:
+        if profile.get('days') and (DAYS[now.weekday()] not in [d.lower()[:3] for d in profile['days']]):
+            continue
+        start, end = profile.get('start', '00:00'), profile.get('end', '24:00')
+        if (start <= hhmm < end) if start <= end else (hhmm >= start or hhmm < end):
+            limits.update(profile)
+            break
+    return limits.get('bytes_per_second'), limits.get('requests_per_second')
+
+
+class Governor:
+    """
+    Limit the bytes per second and requests per second sent to the Member
+    Node by every client in the process, with one token bucket for each.
+
+    The limits are read from a JSON file (see :py:func:`profile_limits` for
+    its format) that is checked for changes every ``CHECK_INTERVAL`` seconds,
+    so they can be changed while an import runs, and time-of-day profiles
+    are applied as the day goes on. If the file is missing or cannot be
+    read, the last limits are kept.
+
+    :param Path fp: The governor file. Defaults to :py:func:`governor_path`.
+    :param float burst: The bucket sizes in seconds.
+    """
+    def __init__(self, fp: Path | None=None, burst: float=BURST):
+        self.fp = Path(fp or governor_path()).expanduser()
+        self.burst = burst
+        self.bytes = TokenBucket(burst=burst)
+        self.requests = TokenBucket(burst=burst)
+        self.settings = {}
+        self.mtime = None
+        self.limits = (None, None)
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force: bool=False):
+        """
+        Re-read the governor file if it has changed, and apply the limits
+        for the current time.
+
+        :param bool force: Check now even if the last check was recent.
+        """
+        L = getLogger(__name__)
+        with self._lock:
+            if (time.monotonic() < self._next_check) and not force:
+                return
+            self._next_check = time.monotonic() + CHECK_INTERVAL
+            mtime = None
+            try:
+                mtime = self.fp.stat().st_mtime
+                if mtime != self.mtime:
+                    with open(self.fp, 'r') as f:
+                        self.settings = json.load(f)
+                    self.mtime = mtime
+                    L.info(f'Read upload limits from {self.fp}')
+            except FileNotFoundError:
+                if self.mtime is not False:
+                    L.warning(f'No governor file at {self.fp}; keeping the current upload limits')
+                self.mtime = False
+            except (OSError, ValueError) as e:
+                L.error(f'Could not read {self.fp}; keeping the current upload limits: {repr(e)}')
+                self.mtime = mtime
+            limits = profile_limits(self.settings, datetime.datetime.now())
+            burst = self.settings.get('burst') or self.burst
+            if (limits, burst) == (self.limits, self.bytes.burst):
+                return
+            self.limits = limits
+        self.bytes.set_rate(limits[0], burst)
+        self.requests.set_rate(limits[1], burst)
+        L.info(f'Upload limits: {limits[0] or "unlimited"} bytes/s, {limits[1] or "unlimited"} requests/s')
+
+    def request(self, nbytes: int=0):
+        """
+        Wait for a request, and for ``nbytes`` of its body, to be allowed.
+
+        :param int nbytes: The bytes to send with the request up front.
+        """
+        self.refresh()
+        waited = self.requests.take(1)
+        if nbytes:
+            waited += self.bytes.take(nbytes)
+        if waited:
+            with self._lock:
+                self.waited += waited
+
+
+class GovernedStream:
+    """
+    A read-only stream over a file object that takes a byte token for each
+    byte read, so that a large body is paced as it is sent rather than all at
+    once. Like :py:class:`fwc_import.archives.MemberStream`, it reports the
+    bytes left to read as ``len``.
+
+    :param fileobj: The file object (a file, or a stream with ``len``).
+    :param TokenBucket bucket: The byte bucket.
+    """
+    def __init__(self, fileobj, bucket: TokenBucket):
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    @property
+    def len(self):
+        if hasattr(self.fileobj, 'len'):
+            return self.fileobj.len
+        return os.fstat(self.fileobj.fileno()).st_size - self.fileobj.tell()
+
+    def read(self, n: int=-1):
+        chunk = self.fileobj.read(n)
+        self.bucket.take(len(chunk))
+        return chunk
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+
+
+def enable_governor(client, governor: Governor):
+    """
+    Route a Member Node client's ``generateIdentifier``, ``create``,
+    ``update`` and ``updateSystemMetadata`` calls through a
+    :py:class:`Governor`. A bytes body is counted before it is sent; a file
+    body is counted as it is read.
+
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :param Governor governor: The governor, shared by the clients of a run.
+    :return: The client.
+    """
+    def governed(fn, body_arg=None):
+        def call(*args, **kwargs):
+            args = list(args)
+            body = args[body_arg] if (body_arg is not None) and (len(args) > body_arg) else None
+            if isinstance(body, (bytes, bytearray, str)):
+                governor.request(len(body))
+            else:
+                governor.request()
+                if body is not None:
+                    args[body_arg] = GovernedStream(body, governor.bytes)
+            return fn(*args, **kwargs)
+        return call
+    for name in GOVERNED:
+        setattr(client, name, governed(getattr(client, name), body_arg=1 if name in ('create', 'update') else None))
+    return client
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor(**options):
+    """
+    Get the governor shared by every client in the process, so that the
+    limits hold for the run as a whole. It is made with ``options`` the
+    first time.
+
+    :rtype: Governor
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = Governor(**options)
+        return _governor
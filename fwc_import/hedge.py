@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+import time
+import threading
+import functools
+from collections import deque
+from logging import getLogger
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+from d1_common.types import dataoneTypes, exceptions
+
+READS = ['getSystemMetadata', 'describe', 'get', 'getChecksum', 'listObjects']
+"""
+Idempotent Member Node calls. A read that runs past its deadline gets a
+hedged duplicate, and whichever returns first is used.
+"""
+
+WRITES = ['create', 'update', 'updateSystemMetadata']
+"""
+Member Node calls that change the node. A write that runs past its deadline
+is abandoned, and retried only if the node does not already have its result.
+"""
+
+MULTIPLIER = 3.0
+"""
+A call is stalled when it has run this many times the rolling p99 latency
+of its kind of call.
+"""
+
+FLOOR = 10.0
+"""
+The shortest deadline in seconds, so that calls are not hedged over
+ordinary jitter.
+"""
+
+MIN_SAMPLES = 20
+"""
+The number of completed calls of a kind needed before its p99 is trusted.
+Until then, calls of that kind have no deadline.
+"""
+
+WINDOW = 500
+"""
+The number of recent latencies per kind of call the p99 is taken over.
+"""
+
+RETRIES = 2
+"""
+The number of times a stalled write is retried before waiting for it
+without a deadline.
+"""
+
+TIMEOUT = 300.0
+"""
+The HTTP read timeout in seconds of a client with a watchdog, so that a
+call on a dead connection fails instead of waiting forever.
+"""
+
+
+def spawn(fn, *args, **kwargs):
+    """
+    Run a function in a new daemon thread, so that an abandoned call cannot
+    keep the process from exiting.
+
+    :param fn: The function to call.
+    :return: A future for its result.
+    :rtype: concurrent.futures.Future
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def size_class(obj, sysmeta_pyxb=None):
+    """
+    Get the power-of-two size class of an object body, so that uploads are
+    compared with uploads of a similar size.
+
+    :param obj: The body (bytes, a stream with ``len``, or a function that
+        opens one).
+    :param sysmeta_pyxb: The object's system metadata, whose ``size`` is used
+        for a body that is opened by a function.
+    :rtype: int
+    """
+    if isinstance(obj, (bytes, bytearray, str)):
+        size = len(obj)
+    elif callable(obj):
+        size = getattr(sysmeta_pyxb, 'size', None) or 0
+    else:
+        size = getattr(obj, 'len', 0)
+    return int(size).bit_length()
+
+
+def opened(fn, body_arg: int):
+    """
+    Wrap a client method so that a body given as a function is opened for
+    each call and closed after it. Each attempt of a stalled write then
+    reads its own stream, so the write can be sent again.
+
+    :param fn: The client method.
+    :param int body_arg: The position of the body in the arguments.
+    """
+    def call(*args):
+        if not callable(args[body_arg]):
+            return fn(*args)
+        args = list(args)
+        with args[body_arg]() as body:
+            args[body_arg] = body
+            return fn(*args)
+    return call
+
+
+class Watchdog:
+    """
+    Keep the rolling latency of each kind of Member Node call and act on
+    calls that run well past it.
+
+    A call's deadline is ``multiplier`` times the p99 of the last ``window``
+    calls of its kind, and at least ``floor`` seconds. Reads that pass the
+    deadline are hedged (see :py:meth:`read`); writes are abandoned, checked
+    for on the node, and retried if needed (see :py:meth:`write`). Abandoned
+    calls are left to finish or time out in the background.
+
+    :param float multiplier: The deadline as a multiple of the p99.
+    :param float floor: The shortest deadline in seconds.
+    :param int min_samples: The calls needed before a deadline is set.
+    :param int window: The number of latencies kept per kind of call.
+    :param int retries: The retries of a stalled write.
+    """
+    def __init__(self, multiplier: float=MULTIPLIER, floor: float=FLOOR, min_samples: int=MIN_SAMPLES,
+                 window: int=WINDOW, retries: int=RETRIES):
+        self.multiplier = multiplier
+        self.floor = floor
+        self.min_samples = min_samples
+        self.window = window
+        self.retries = retries
+        self.latencies = {}
+        self.hedged = 0
+        self.abandoned = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, seconds: float):
+        """
+        Record the latency of a completed call.
+
+        :param str kind: The kind of call, e.g. ``getSystemMetadata``.
+        :param float seconds: The latency.
+        """
+        with self._lock:
+            self.latencies.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+
+    def p99(self, kind: str):
+        """
+        Get the p99 latency of a kind of call.
+
+        :param str kind: The kind of call.
+        :return: The latency in seconds, or None if there are too few samples.
+        :rtype: float or None
+        """
+        with self._lock:
+            samples = sorted(self.latencies.get(kind, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+    def deadline(self, kind: str):
+        """
+        Get the time after which a call of a kind is stalled.
+
+        :param str kind: The kind of call.
+        :return: The deadline in seconds, or None if there is none yet.
+        :rtype: float or None
+        """
+        p99 = self.p99(kind)
+        return None if p99 is None else max(self.floor, self.multiplier * p99)
+
+    def timed(self, kind: str, fn, *args, **kwargs):
+        """
+        Call a function and record its latency if it succeeds.
+        """
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.record(kind, time.monotonic() - start)
+        return result
+
+    def read(self, kind: str, fn, *args, **kwargs):
+        """
+        Make an idempotent call. If it has not returned by its deadline, send
+        the same call again and use whichever returns first; a failure of one
+        is only raised if the other fails too.
+
+        :param str kind: The kind of call.
+        :param fn: The client method.
+        :return: The result of the call.
+        """
+        L = getLogger(__name__)
+        call = f'{kind} {args[0]}' if args else kind
+        deadline = self.deadline(kind)
+        first = spawn(self.timed, kind, fn, *args, **kwargs)
+        if (deadline is None) or wait([first], timeout=deadline).done:
+            return first.result()
+        with self._lock:
+            self.hedged += 1
+        L.warning(f'{call} has run past {deadline:.1f}s; sending a hedged request')
+        return first_success([first, spawn(self.timed, kind, fn, *args, **kwargs)])
+
+    def write(self, kind: str, fn, args: tuple, kwargs: dict, applied, retryable: bool):
+        """
+        Make a call that changes the node. If it has not returned by its
+        deadline, it is abandoned and ``applied`` is asked whether the node
+        already has its result; if so, that is returned. Otherwise the call
+        is sent again, if ``retryable``, up to ``retries`` times, and then
+        waited for without a deadline.
+
+        :param str kind: The kind of call.
+        :param fn: The client method.
+        :param tuple args: The positional arguments.
+        :param dict kwargs: The keyword arguments.
+        :param applied: A function that returns the call's result if the node
+            already has it, and None otherwise.
+        :param bool retryable: Whether the call can be sent again (its body
+            is not a stream that the abandoned call may still be reading;
+            see :py:func:`enable_watchdog`).
+        :return: The result of the call.
+        """
+        L = getLogger(__name__)
+        call = f'{kind} {args[0]}' if args else kind
+        attempts = {spawn(self.timed, kind, fn, *args, **kwargs)}
+        retries = self.retries if retryable else 0
+        stalled = False
+        while True:
+            deadline = self.deadline(kind)
+            done, pending = wait(attempts, timeout=deadline, return_when=FIRST_COMPLETED)
+            if done:
+                ok = [f for f in done if f.exception() is None]
+                if ok:
+                    return ok[0].result()
+                if pending:
+                    attempts = pending
+                    continue
+                error = done.pop().exception()
+                if isinstance(error, exceptions.IdentifierNotUnique) and stalled:
+                    # an abandoned attempt may have got there first
+                    result = self.check(applied)
+                    if result is not None:
+                        return result
+                raise error
+            stalled = True
+            with self._lock:
+                self.abandoned += 1
+            L.warning(f'{call} has run past {deadline:.1f}s; checking whether the node has it')
+            result = self.check(applied)
+            if result is not None:
+                L.info(f'{call} was applied by the stalled call')
+                return result
+            if not retries:
+                L.warning(f'{call} is still running; waiting for it without a deadline')
+                return first_success(attempts)
+            retries -= 1
+            L.warning(f'{call} was not applied; sending it again')
+            attempts.add(spawn(self.timed, kind, fn, *args, **kwargs))
+
+    def check(self, applied):
+        """
+        Ask whether a stalled write was applied. An error while checking
+        counts as not applied.
+        """
+        L = getLogger(__name__)
+        try:
+            return applied()
+        except exceptions.DataONEException as e:
+            L.warning(f'Could not check for a stalled write: {repr(e)}')
+            return None
+
+
+def first_success(futures):
+    """
+    Wait for the first of several calls to succeed.
+
+    :param futures: The calls.
+    :return: The result of the first call to succeed.
+    :raises Exception: The error of the last call, if every call fails.
+    """
+    pending = set(futures)
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if (f.exception() is None) or not pending:
+                return f.result()
+
+
+def enable_watchdog(client, watchdog: Watchdog):
+    """
+    Route a Member Node client's reads and writes through a
+    :py:class:`Watchdog`. Reads are hedged. A stalled ``create`` or
+    ``update`` is checked for with ``describe`` on the new identifier, and a
+    stalled ``updateSystemMetadata`` with ``getSystemMetadata``, whose
+    ``serialVersion`` has gone up if the update was applied.
+
+    The body of a ``create`` or ``update`` may be given as a function that
+    opens a stream, e.g. ``functools.partial(path.open, 'rb')``; it is opened
+    again for each attempt, so a stalled streamed upload can be retried. A
+    stream that is already open is not retried, since the abandoned call may
+    still be reading it. The client's ``watchdog`` attribute is set, so that
+    callers can tell whether it takes such bodies.
+
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :param Watchdog watchdog: The watchdog, shared by the clients of a run.
+    :return: The client.
+    """
+    for name in READS:
+        setattr(client, name, functools.partial(watchdog.read, name, getattr(client, name)))
+    create, update, update_sysmeta = opened(client.create, 1), opened(client.update, 1), client.updateSystemMetadata
+
+    def exists(pid):
+        try:
+            client.describe(pid)
+        except exceptions.NotFound:
+            return None
+        return dataoneTypes.Identifier(pid)
+
+    def retryable(obj):
+        return isinstance(obj, (bytes, bytearray, str)) or callable(obj)
+
+    def watched_create(pid, obj, sysmeta_pyxb, vendorSpecific=None):
+        return watchdog.write(f'create:{size_class(obj, sysmeta_pyxb)}', create,
+                              (pid, obj, sysmeta_pyxb, vendorSpecific), {},
+                              applied=lambda: exists(pid), retryable=retryable(obj))
+
+    def watched_update(pid, obj, newPid, sysmeta_pyxb, vendorSpecific=None):
+        return watchdog.write(f'update:{size_class(obj, sysmeta_pyxb)}', update,
+                              (pid, obj, newPid, sysmeta_pyxb, vendorSpecific), {},
+                              applied=lambda: exists(newPid), retryable=retryable(obj))
+
+    def watched_update_sysmeta(pid, sysmeta_pyxb, vendorSpecific=None):
+        sent = sysmeta_pyxb.serialVersion
+
+        def applied():
+            current = client.getSystemMetadata(pid)
+            return True if (sent is not None) and (current.serialVersion > sent) else None
+        return watchdog.write('updateSystemMetadata', update_sysmeta, (pid, sysmeta_pyxb, vendorSpecific), {},
+                              applied=applied, retryable=True)
+
+    client.create = watched_create
+    client.update = watched_update
+    client.updateSystemMetadata = watched_update_sysmeta
+    client.watchdog = watchdog
+    return client
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_watchdog(**options):
+    """
+    Get the watchdog shared by every client in the process, so that latency
+    is tracked across the clients of a pool. It is made with ``options`` the
+    first time.
+
+    :rtype: Watchdog
+    """
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = Watchdog(**options)
+        return _watchdog
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import zlib
+import atexit
+import logging
+from queue import SimpleQueue
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+SAMPLED = ContextVar('SAMPLED', default=True)
+"""
+Whether log records below WARNING should be kept for the package currently
+being processed in this thread. See :py:func:`sample_package`.
+"""
+
+SAMPLE_RATE = None
+"""
+The fraction of packages whose DEBUG and INFO records are kept, or None to
+keep all of them. Set by :py:func:`configure_hot_path_logging`.
+"""
+
+
+class Lazy:
+    """
+    Defer an expensive log message argument until a handler actually formats
+    the record. Use with %-style logging calls, e.g.
+    ``L.debug('Dump:\\n%s', Lazy(json.dumps, d, indent=2))``. With the log
+    queue, the record is formatted later on the listener thread, so the
+    arguments must not be changed after the call.
+
+    :param func: The function that produces the message.
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+class PackageSampler(logging.Filter):
+    """
+    Drop records below WARNING for packages that were not sampled by
+    :py:func:`sample_package`. Warnings and errors always pass.
+    """
+    def filter(self, record):
+        return (record.levelno >= logging.WARNING) or SAMPLED.get()
+
+
+def sample_package(package_id: str | None):
+    """
+    Decide whether DEBUG and INFO records are kept while ``package_id`` is
+    processed. The decision is a stable hash of the package id, so the same
+    packages are sampled on every run. Pass None between packages to keep
+    everything.
+
+    :param str package_id: The package being processed, or None.
+    :return: Whether the package is sampled.
+    :rtype: bool
+    """
+    sampled = (package_id is None) or (SAMPLE_RATE is None) or \
+        ((zlib.crc32(package_id.encode('utf-8')) % 10000) < SAMPLE_RATE * 10000)
+    SAMPLED.set(sampled)
+    return sampled
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    A :py:class:`logging.handlers.QueueHandler` that enqueues records as they
+    are, instead of formatting them first, so that the message (including
+    any :py:class:`Lazy` arguments) is formatted by the listener's handlers
+    on the listener thread.
+    """
+    def prepare(self, record):
+        return record
+
+
+def configure_hot_path_logging(queue: bool=False, sample_rate: float | None=None):
+    """
+    Reduce the cost of logging in the upload loop.
+
+    With ``queue``, the handlers of the root logger are moved behind a
+    :py:class:`DeferredQueueHandler` and run by a
+    :py:class:`logging.handlers.QueueListener` thread, so that message
+    formatting and file and stream I/O no longer happen on the hot path. With ``sample_rate``, only that
+    fraction of packages log below WARNING (see :py:func:`sample_package`).
+
+    :param bool queue: Move the root handlers to a background thread.
+    :param float sample_rate: The fraction of packages to log, e.g. ``0.01``.
+    :return: The queue listener, or None.
+    :rtype: QueueListener or None
+    """
+    global SAMPLE_RATE
+    L = logging.getLogger(__name__)
+    root = logging.getLogger()
+    listener = None
+    if queue and not any(isinstance(h, QueueHandler) for h in root.handlers):
+        handlers = root.handlers[:]
+        q = SimpleQueue()
+        qh = DeferredQueueHandler(q)
+        qh.setLevel(min(h.level for h in handlers) if handlers else logging.NOTSET)
+        for h in handlers:
+            root.removeHandler(h)
+        root.addHandler(qh)
+        listener = QueueListener(q, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        L.info(f'Logging to {len(handlers)} handlers through a queue')
+    if sample_rate is not None:
+        SAMPLE_RATE = float(sample_rate)
+        for h in root.handlers:
+            if not any(isinstance(f, PackageSampler) for f in h.filters):
+                h.addFilter(PackageSampler())
+        L.info(f'Logging DEBUG and INFO for {SAMPLE_RATE:.2%} of packages')
+    return listener
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from logging import getLogger
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from .defs import WORK_LOC
+
+if TYPE_CHECKING:
+    from d1_client.mnclient_2_0 import MemberNodeClient_2_0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    pid TEXT PRIMARY KEY,
+    checksum TEXT,
+    checksum_algorithm TEXT,
+    format_id TEXT,
+    size INTEGER,
+    modified TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_checksum ON objects (checksum);
+CREATE INDEX IF NOT EXISTS objects_format_id ON objects (format_id);
+CREATE TABLE IF NOT EXISTS sync (
+    base_url TEXT PRIMARY KEY,
+    last_modified TEXT,
+    synced TEXT
+);
+"""
+"""
+The object mirror schema. ``pid`` is indexed as the primary key.
+"""
+
+PAGE_SIZE = 1000
+"""
+The number of objects requested per ``listObjects`` call.
+"""
+
+
+def mirror_path(node: str):
+    """
+    Get the location of the object mirror for a node.
+
+    :param str node: The node identifier.
+    :return: The path to the SQLite database.
+    :rtype: Path
+    """
+    return Path(WORK_LOC / f'{node}.objects.sqlite')
+
+
+def open_mirror(node: str):
+    """
+    Open (creating if needed) the local object mirror for a node.
+
+    :param str node: The node identifier.
+    :return: The database connection.
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect(mirror_path(node), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def iter_object_pages(client: MemberNodeClient_2_0, from_date: datetime | None=None, count: int=PAGE_SIZE):
+    """
+    Page through ``listObjects`` on the Member Node, yielding one
+    ``ObjectList`` at a time so that the full listing is never held in memory.
+
+    :param MemberNodeClient_2_0 client: The Member Node client.
+    :param datetime from_date: Only list objects whose system metadata was
+        modified at or after this time.
+    :param int count: The page size.
+    :return: A generator of ObjectList pages.
+    """
+    L = getLogger(__name__)
+    start = 0
+    while True:
+        page = client.listObjects(fromDate=from_date, start=start, count=count)
+        n = len(page.objectInfo)
+        L.debug(f'Listed objects {start}-{start + n} of {page.total}')
+        if n == 0:
+            break
+        yield page
+        start += n
+        if start >= page.total:
+            break
+
+
+def sync_mirror(conn: sqlite3.Connection, client: MemberNodeClient_2_0, full: bool=False, count: int=PAGE_SIZE):
+    """
+    Bring the object mirror up to date with the Member Node.
+
+    After the first sync, only objects modified since the newest modification
+    date already in the mirror are requested (``fromDate``). Objects that are
+    deleted from the Member Node are not removed; use ``full`` to rebuild.
+
+    :param sqlite3.Connection conn: The mirror database.
+    :param MemberNodeClient_2_0 client: The Member Node client.
+    :param bool full: Discard the mirror and list every object again.
+    :param int count: The page size.
+    :return: The number of objects added or updated.
+    :rtype: int
+    """
+    L = getLogger(__name__)
+    base_url = client.base_url
+    from_date = None
+    if full:
+        conn.execute('DELETE FROM objects')
+        conn.execute('DELETE FROM sync')
+    else:
+        row = conn.execute('SELECT last_modified FROM sync WHERE base_url = ?', (base_url,)).fetchone()
+        if row and row['last_modified']:
+            from_date = datetime.fromisoformat(row['last_modified'])
+    L.info(f'Syncing object mirror from {base_url}' + (f' since {from_date.isoformat()}' if from_date else ' (full listing)'))
+    n = 0
+    last_modified = from_date
+    for page in iter_object_pages(client, from_date=from_date, count=count):
+        rows = []
+        for obj in page.objectInfo:
+            modified = obj.dateSysMetadataModified
+            if modified.tzinfo is None:
+                modified = modified.replace(tzinfo=timezone.utc)
+            if (last_modified is None) or (modified > last_modified):
+                last_modified = modified
+            rows.append((
+                obj.identifier.value(),
+                obj.checksum.value(),
+                str(obj.checksum.algorithm),
+                str(obj.formatId),
+                int(obj.size),
+                modified.isoformat(),
+            ))
+        conn.executemany('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)', rows)
+        # commit per page so an interrupted sync keeps what it has
+        conn.commit()
+        n += len(rows)
+    conn.execute('INSERT OR REPLACE INTO sync VALUES (?, ?, ?)',
+                 (base_url, last_modified.isoformat() if last_modified else None,
+                  datetime.now(timezone.utc).isoformat()))
+    conn.commit()
+    L.info(f'Object mirror sync added or updated {n} objects')
+    return n
+
+
+def find_by_checksum(conn: sqlite3.Connection, checksum: str):
+    """
+    Look up objects in the mirror by checksum.
+
+    :param sqlite3.Connection conn: The mirror database.
+    :param str checksum: The checksum value.
+    :return: The matching objects.
+    :rtype: list[sqlite3.Row]
+    """
+    return conn.execute('SELECT * FROM objects WHERE checksum = ?', (checksum,)).fetchall()
+
+
+def find_by_pid(conn: sqlite3.Connection, pid: str):
+    """
+    Look up an object in the mirror by identifier.
+
+    :param sqlite3.Connection conn: The mirror database.
+    :param str pid: The object identifier.
+    :return: The object, or None.
+    :rtype: sqlite3.Row or None
+    """
+    return conn.execute('SELECT * FROM objects WHERE pid = ?', (pid,)).fetchone()
@@ -0,0 +1,137 @@
+import re
+import json
+from pathlib import Path
+from logging import getLogger
+from functools import lru_cache
+
+from .defs import CONFIG_LOC
+from .utils import parse_name
+
+AUTHORITY_LOC = CONFIG_LOC.joinpath('names.json')
+"""
+The location of the personnel name authority file.
+Defaults to ``~/.config/fwc-import/names.json``.
+
+The file maps raw ``PrincipalInvestigator`` strings to names, e.g.::
+
+    {
+        "Smith, J.": {
+            "givenName": "John",
+            "surName": "Smith",
+            "orcid": "https://orcid.org/0000-0000-0000-0000",
+            "email": "john.smith@myfwc.com"
+        }
+    }
+
+``orcid`` and ``email`` are optional.
+"""
+
+AUTHORITY = {}
+"""
+The loaded name authority, keyed by :py:func:`name_key`.
+"""
+
+
+def name_key(raw: str):
+    """
+    Normalize a raw name string for authority lookups: whitespace is collapsed
+    and case is ignored.
+
+    :param str raw: The raw name string.
+    :return: The lookup key.
+    :rtype: str
+    """
+    return re.sub(r'\s+', ' ', raw).strip().casefold()
+
+
+def load_authority(fp: Path=AUTHORITY_LOC):
+    """
+    Load the name authority file and clear the name cache. A missing file is
+    treated as an empty authority.
+
+    :param Path fp: The authority file.
+    :return: The authority dictionary, keyed by :py:func:`name_key`.
+    :rtype: dict
+    """
+    global AUTHORITY
+    L = getLogger(__name__)
+    fp = Path(fp)
+    if fp.exists():
+        with open(fp, 'r') as f:
+            AUTHORITY = {name_key(k): v for k, v in json.load(f).items()}
+        L.info(f'Loaded {len(AUTHORITY)} names from {fp}')
+    else:
+        AUTHORITY = {}
+    resolve_name.cache_clear()
+    return AUTHORITY
+
+
+@lru_cache(maxsize=None)
+def resolve_name(raw: str):
+    """
+    Resolve a raw name string to its parts, using the authority file entry if
+    there is one and :py:func:`fwc_import.utils.parse_name` otherwise. Results
+    are cached, so each distinct string is parsed once per process.
+
+    :param str raw: The raw name string.
+    :return: A dictionary with ``givenName``, ``surName``, ``orcid`` and
+        ``email`` (the last two may be None).
+    :rtype: dict
+    """
+    entry = AUTHORITY.get(name_key(raw))
+    if entry:
+        return {
+            'givenName': entry.get('givenName'),
+            'surName': entry.get('surName'),
+            'orcid': entry.get('orcid'),
+            'email': entry.get('email'),
+        }
+    given, family = parse_name(raw)
+    return {'givenName': given, 'surName': family, 'orcid': None, 'email': None}
+
+
+def resolve_names(column):
+    """
+    Resolve every distinct name in a column in one pass.
+
+    :param column: The raw name strings, e.g. ``df['PrincipalInvestigator']``.
+    :type column: pandas.Series
+    :return: A dictionary of raw name strings and resolved names.
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    raws = [r for r in column.dropna().astype(str).unique()
+            if r.strip().lower() not in ('', 'nan', 'nat')]
+    names = {raw: resolve_name(raw) for raw in raws}
+    L.info(f'Resolved {len(names)} distinct names ({sum(1 for r in raws if name_key(r) in AUTHORITY)} from the authority file)')
+    return names
+
+
+def update_authority(names: dict, fp: Path=AUTHORITY_LOC):
+    """
+    Add the names that are not yet in the authority file, as parsed, so that
+    they can be reviewed and corrected by hand. Existing entries are kept.
+
+    :param dict names: Raw name strings and resolved names, as returned by
+        :py:func:`resolve_names`.
+    :param Path fp: The authority file.
+    :return: The number of names added.
+    :rtype: int
+    """
+    L = getLogger(__name__)
+    fp = Path(fp)
+    existing = {}
+    if fp.exists():
+        with open(fp, 'r') as f:
+            existing = json.load(f)
+    keys = {name_key(k) for k in existing}
+    added = 0
+    for raw, name in sorted(names.items()):
+        if name_key(raw) not in keys:
+            existing[raw] = {k: v for k, v in name.items() if v}
+            keys.add(name_key(raw))
+            added += 1
+    with open(fp, 'w') as f:
+        json.dump(existing, fp=f, indent=2, ensure_ascii=False)
+    L.info(f'Added {added} names to {fp}')
+    return added
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import json
+import hashlib
+import datetime
+from pathlib import Path
+from logging import getLogger
+from concurrent.futures import ProcessPoolExecutor
+import xml.etree.ElementTree as ET
+
+from .defs import WORK_LOC
+from .conv import register_namespaces
+from .utils import load_uploads, save_uploads, shard_of, uploads_path
+from .profiling import stage, checkpoint
+from .dirindex import list_files
+
+STATUSES = ['new', 'changed', 'unchanged', 'invalid']
+"""
+The classifications of EML files in a plan.
+"""
+
+OPERATIONS = {
+    'new': {'generateIdentifier': 1, 'create': 2, 'updateSystemMetadata': 0},
+    'changed': {'generateIdentifier': 1, 'create': 2, 'updateSystemMetadata': 4},
+}
+"""
+The Member Node calls made for each package, by classification: an EML and a
+resource map are created, and for changed packages the old and new system
+metadata of both are updated with ``obsoletes`` and ``obsoletedBy``.
+"""
+
+
+def plan_path(node: str):
+    """
+    Get the location of the plan file for a node.
+
+    :param str node: The node identifier.
+    :return: The path to the plan file.
+    :rtype: Path
+    """
+    return Path(WORK_LOC / f'{node}.plan.json')
+
+
+def content_hash(root: ET.Element):
+    """
+    Hash the content of an EML document, ignoring the ``packageId`` attribute
+    (which is set to a new UUID on every upload) and whitespace between
+    elements.
+
+    :param root: The EML root element.
+    :type root: xml.etree.ElementTree.Element
+    :return: The MD5 hex digest of the canonicalized document.
+    :rtype: str
+    """
+    package_id = root.attrib.pop('packageId', None)
+    try:
+        xml_string = ET.tostring(root, encoding='unicode')
+    finally:
+        if package_id is not None:
+            root.attrib['packageId'] = package_id
+    c14n = ET.canonicalize(xml_data=xml_string, strip_text=True)
+    return hashlib.md5(c14n.encode('utf-8')).hexdigest()
+
+
+def scan_eml(eml_path: Path):
+    """
+    Read and parse one EML file. This is the per-file work of
+    :py:func:`make_plan` and runs in a worker process, so it does not touch the
+    ledger or the network.
+
+    :param Path eml_path: The EML file.
+    :return: A dictionary with ``file``, ``package_id``, ``content_md5``,
+        ``md5`` (of the file as it is on disk), ``size`` and ``error``.
+    :rtype: dict
+    """
+    scanned = {'file': str(eml_path), 'package_id': None, 'content_md5': None,
+               'md5': None, 'size': None, 'error': None}
+    try:
+        eml_bytes = Path(eml_path).read_bytes()
+        scanned['size'] = len(eml_bytes)
+        scanned['md5'] = hashlib.md5(eml_bytes).hexdigest()
+        root = ET.fromstring(eml_bytes)
+        alt_id_elem = root.find('.//alternateIdentifier')
+        scanned['package_id'] = alt_id_elem.text if alt_id_elem is not None else None
+        if not scanned['package_id']:
+            scanned['error'] = 'no alternateIdentifier'
+        scanned['content_md5'] = content_hash(root)
+    except Exception as e:
+        scanned['error'] = repr(e)
+    return scanned
+
+
+def classify(scanned: dict, entry: dict | None):
+    """
+    Classify a scanned EML file against its ledger entry.
+
+    A package is unchanged if its content hash matches the ``content_md5`` in
+    the ledger. A null ``content_md5`` marks an upload whose resource map did
+    not complete, so the package is changed. Ledger entries written before
+    content hashes were recorded are compared by the MD5 of the uploaded file
+    instead.
+
+    :param dict scanned: The result of :py:func:`scan_eml`.
+    :param dict entry: The package's ledger entry, or None.
+    :return: One of :py:data:`STATUSES`.
+    :rtype: str
+    """
+    if scanned['error']:
+        return 'invalid'
+    eml = entry.get('eml') if entry else None
+    if not (eml and entry.get('resource_map')):
+        return 'new' if not eml else 'changed'
+    if 'content_md5' in eml:
+        return 'unchanged' if eml['content_md5'] == scanned['content_md5'] else 'changed'
+    return 'unchanged' if eml.get('md5') == scanned['md5'] else 'changed'
+
+
+def backfill_content_hashes(eml_folder: str, uploads: dict, index=None):
+    """
+    Add ``content_md5`` to ledger entries written before content hashes were
+    recorded, from the EML files in a folder that are still the uploaded
+    version (the file MD5 matches the ledger). Once filled in, such packages
+    stay unchanged when their EML is written again with a different
+    ``packageId``.
+
+    :param str eml_folder: Path to the folder containing EML files.
+    :param dict uploads: The ledger, which is updated in place.
+    :param index: The directory index to enumerate the EML files from, or None.
+    :type index: fwc_import.dirindex.DirIndex or None
+    :return: The number of entries filled in.
+    :rtype: int
+    """
+    L = getLogger(__name__)
+    legacy = {k for k, v in uploads.items()
+              if v and v.get('eml') and v.get('resource_map') and ('content_md5' not in v['eml'])}
+    if not legacy:
+        return 0
+    filled = 0
+    n, eml_files = list_files(eml_folder, '*.xml', index=index)
+    for eml_path in eml_files:
+        scanned = scan_eml(eml_path)
+        package_id = scanned['package_id']
+        if (package_id in legacy) and (classify(scanned, uploads[package_id]) == 'unchanged'):
+            uploads[package_id]['eml']['content_md5'] = scanned['content_md5']
+            legacy.discard(package_id)
+            filled += 1
+    L.info(f'Filled in content hashes for {filled} ledger entries from {eml_folder}')
+    if legacy:
+        L.warning(f'{len(legacy)} ledger entries have no content hash and no matching EML file in {eml_folder}; '
+                  f'they are uploaded again if their EML is written')
+    return filled
+
+
+def make_plan(eml_folder: str, node: str, shard: tuple | None=None, workers: int | None=None, index=None):
+    """
+    Scan every EML file in a folder in parallel and classify it as new,
+    changed, unchanged or invalid against the node's ledger. No Member Node
+    calls are made.
+
+    :param str eml_folder: Path to the folder containing EML files.
+    :param str node: The node identifier.
+    :param tuple shard: The shard index and shard count, e.g. ``(0, 4)``, or
+        None. The shard's ledger is used, and other shards' packages are left
+        out of the plan.
+    :param int workers: The number of worker processes. Defaults to the
+        number of CPUs.
+    :param index: The directory index to enumerate the EML files from, or None.
+    :type index: fwc_import.dirindex.DirIndex or None
+    :return: The plan dictionary.
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    register_namespaces()
+    n, eml_files = list_files(eml_folder, '*.xml', index=index)
+    L.info(f'Scanning {n} EML files in {eml_folder}')
+    try:
+        if shard:
+            from .run_data_upload import load_shard_uploads
+            uploads = load_shard_uploads(node, shard)
+        else:
+            uploads = load_uploads(uploads_path(node))
+    except FileNotFoundError:
+        uploads = {}
+    counts = {s: 0 for s in STATUSES}
+    nbytes = {s: 0 for s in STATUSES}
+    operations = {'generateIdentifier': 0, 'create': 0, 'updateSystemMetadata': 0}
+    packages = []
+    with stage('scan'), ProcessPoolExecutor(max_workers=workers, initializer=register_namespaces) as executor:
+        for scanned in executor.map(scan_eml, eml_files, chunksize=64):
+            package_id = scanned['package_id']
+            if shard and package_id and (shard_of(package_id, shard[1]) != shard[0]):
+                continue
+            entry = uploads.get(package_id)
+            status = classify(scanned, entry)
+            scanned['status'] = status
+            if status == 'changed':
+                scanned['old_eml'] = entry['eml']['identifier'] if entry.get('eml') else None
+                scanned['old_resource_map'] = entry['resource_map']['identifier'] if entry.get('resource_map') else None
+            counts[status] += 1
+            nbytes[status] += scanned['size'] or 0
+            for op, k in OPERATIONS.get(status, {}).items():
+                operations[op] += k
+            packages.append(scanned)
+    plan = {
+        'node': node,
+        'eml_folder': str(eml_folder),
+        'shard': list(shard) if shard else None,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'counts': counts,
+        'bytes': nbytes,
+        'operations': operations,
+        'packages': packages,
+    }
+    L.info(f'Plan: {counts["new"]} new, {counts["changed"]} changed, {counts["unchanged"]} unchanged, '
+           f'{counts["invalid"]} invalid; {nbytes["new"] + nbytes["changed"]} EML bytes to upload in '
+           f'{sum(operations.values())} Member Node calls')
+    return plan
+
+
+def save_plan(plan: dict, fp: Path):
+    """
+    Write a plan file.
+
+    :param dict plan: The plan, as returned by :py:func:`make_plan`.
+    :param Path fp: The file to write.
+    """
+    L = getLogger(__name__)
+    with open(fp, 'w') as f:
+        json.dump(plan, fp=f, indent=2)
+    L.info(f'Wrote plan to {fp}')
+
+
+def load_plan(fp: Path):
+    """
+    Read a plan file.
+
+    :param Path fp: The plan file.
+    :return: The plan dictionary.
+    :rtype: dict
+    """
+    with open(fp, 'r') as f:
+        return json.load(f)
+
+
+def apply_plan(plan: dict, orcid: str, pool, node: str):
+    """
+    Carry out the Member Node operations in a plan. Only packages classified
+    as new or changed are uploaded. A file that no longer matches the content
+    hash recorded in the plan is skipped; run ``fwcimport plan`` again to pick
+    it up.
+
+    :param dict plan: The plan, as returned by :py:func:`make_plan`.
+    :param str orcid: The ORCID of the uploader.
+    :param pool: The Member Node client pool.
+    :type pool: fwc_import.pool.ClientPool
+    :param str node: The node identifier.
+    :return: The successful and failed package identifiers.
+    :rtype: tuple
+    """
+    from .run_data_upload import upload_package, load_shard_uploads, report
+    L = getLogger(__name__)
+    register_namespaces()
+    shard = tuple(plan['shard']) if plan.get('shard') else None
+    uploads_loc = uploads_path(node, shard)
+    try:
+        uploads = load_shard_uploads(node, shard) if shard else load_uploads(uploads_loc)
+    except FileNotFoundError:
+        uploads = {}
+    todo = [p for p in plan['packages'] if p['status'] in OPERATIONS]
+    n = len(todo)
+    succ_list, err_list = [], []
+    L.info(f'Applying plan from {plan["created"]}: {n} packages to upload to {node}')
+    try:
+        for i, planned in enumerate(todo, start=1):
+            eml_path = Path(planned['file'])
+            package_id = planned['package_id']
+            try:
+                root = ET.fromstring(eml_path.read_bytes())
+                if content_hash(root) != planned['content_md5']:
+                    L.warning(f'{package_id} {eml_path.name} has changed since the plan was made; skipping')
+                    err_list.append(str(eml_path))
+                    continue
+                L.info(f'({i}/{n}) Working on {package_id} ({planned["status"]}) from {eml_path.name}')
+                upload_package(eml_path, root, package_id, orcid, pool, uploads, uploads_loc)
+                succ_list.append(package_id)
+                checkpoint(i)
+            except Exception as e:
+                err_list.append(str(eml_path))
+                L.error(f'{eml_path} / {repr(e)}')
+    except KeyboardInterrupt:
+        L.info('Caught KeyboardInterrupt; generating report...')
+    finally:
+        save_uploads(uploads, fp=uploads_loc)
+        report(succ=len(succ_list), fail=len(err_list), finished_dois=succ_list, failed_dois=err_list)
+    return succ_list, err_list
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import json
+import base64
+import threading
+from pathlib import Path
+from logging import getLogger
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from d1_common.types import exceptions
+
+from .defs import CONFIG_LOC
+from .utils import create_client
+
+AUTH_ERRORS = (
+    exceptions.InvalidToken,
+    exceptions.NotAuthorized,
+    exceptions.InvalidCredentials,
+    exceptions.AuthenticationTimeout,
+)
+"""
+DataONE exceptions that indicate the token has expired or been revoked.
+"""
+
+
+def token_expiry(token: str):
+    """
+    Read the expiry time from a DataONE JSON Web Token without verifying it.
+
+    :param str token: The DataONE token.
+    :return: The expiry time, or None if the token carries no ``exp`` claim.
+    :rtype: datetime or None
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+    except (IndexError, ValueError):
+        return None
+    return datetime.fromtimestamp(exp, tz=timezone.utc) if exp else None
+
+
+class ClientPool:
+    """
+    A pool of warmed, keep-alive Member Node clients that follows the token
+    file.
+
+    Every lease checks the token file's mtime; when it changes (or when a call
+    fails with an authentication error) the token is re-read and a new
+    generation of clients is built. Clients that are leased at the time keep
+    their session until the call in flight finishes, and are closed when they
+    are returned instead of going back into the pool.
+
+    :param str mn_url: The URL of the Member Node.
+    :param Path token_file: The token file. Defaults to ``{CONFIG_LOC}/.d1_token``.
+    :param int size: The number of idle clients to keep.
+    :param bool warm: Ping the Member Node when a client is built so that the
+        connection is already open when the first real request is made.
+    """
+    def __init__(self, mn_url: str, token_file: Path | None=None, size: int=1, warm: bool=True):
+        self.mn_url = mn_url
+        self.token_file = Path(token_file or CONFIG_LOC / '.d1_token').expanduser()
+        self.size = size
+        self.warm = warm
+        self._lock = threading.Lock()
+        self._idle = []
+        self._generation = 0
+        self._expiry_warned = False
+        self._read_token()
+        for _ in range(size):
+            self._idle.append(self._new_client())
+
+    def _read_token(self):
+        """
+        Read the token file and record its mtime and expiry.
+        """
+        L = getLogger(__name__)
+        with open(self.token_file, 'r') as tf:
+            self.token = tf.read().split('\n')[0]
+        self.mtime = self.token_file.stat().st_mtime
+        self.expires = token_expiry(self.token)
+        L.info(f'Read token from {self.token_file}; expires {self.expires.isoformat() if self.expires else "unknown"}')
+
+    def _new_client(self):
+        """
+        Build a client for the current token.
+
+        :return: The client and the token generation it belongs to.
+        :rtype: tuple[MemberNodeClient_2_0, int]
+        """
+        L = getLogger(__name__)
+        client = create_client(self.mn_url, auth_token=self.token)
+        if self.warm:
+            try:
+                client.ping()
+            except Exception as e:
+                L.warning(f'Could not warm connection to {self.mn_url}: {repr(e)}')
+        return client, self._generation
+
+    def refresh(self, force: bool=False):
+        """
+        Re-read the token if the token file has changed. Idle clients from the
+        previous generation are closed; leased ones are closed on release.
+
+        :param bool force: Re-read the token even if the file's mtime has not
+            changed, e.g. after an authentication failure.
+        :return: True if a new token was loaded.
+        :rtype: bool
+        """
+        L = getLogger(__name__)
+        with self._lock:
+            try:
+                mtime = self.token_file.stat().st_mtime
+            except FileNotFoundError:
+                L.error(f'Token file {self.token_file} has disappeared; keeping current token')
+                return False
+            if (mtime == self.mtime) and not force:
+                return False
+            old_token = self.token
+            self._read_token()
+            if self.token == old_token:
+                if force:
+                    L.error(f'Token in {self.token_file} has not changed; replace it to continue')
+                return False
+            self._generation += 1
+            self._expiry_warned = False
+            stale, self._idle = self._idle, []
+        for client, _ in stale:
+            client._session.close()
+        L.info(f'Loaded new token (generation {self._generation})')
+        return True
+
+    @contextmanager
+    def client(self):
+        """
+        Lease a client from the pool for the duration of a ``with`` block.
+
+        :return: The leased client.
+        :rtype: MemberNodeClient_2_0
+        """
+        self.refresh()
+        with self._lock:
+            lease = self._idle.pop() if self._idle else None
+        if lease is None:
+            lease = self._new_client()
+        try:
+            yield lease[0]
+        finally:
+            with self._lock:
+                keep = (lease[1] == self._generation) and (len(self._idle) < self.size)
+                if keep:
+                    self._idle.append(lease)
+            if not keep:
+                lease[0]._session.close()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call ``func`` with a leased client passed as the ``client`` keyword
+        argument. If the call fails with an authentication error, the token
+        file is re-read and the call is retried once with a fresh client.
+
+        :param func: The function to call.
+        :return: The return value of ``func``.
+        """
+        L = getLogger(__name__)
+        try:
+            with self.client() as client:
+                return func(*args, client=client, **kwargs)
+        except AUTH_ERRORS as e:
+            L.warning(f'Authentication failed ({e.__class__.__name__}); re-reading token and retrying')
+            if not self.refresh(force=True):
+                raise
+            with self.client() as client:
+                return func(*args, client=client, **kwargs)
+
+    def warn_if_expiring(self, finish: datetime):
+        """
+        Warn (once per token) if a projected finish time is past the token's
+        expiry.
+
+        :param datetime finish: The projected finish time (timezone-aware).
+        """
+        L = getLogger(__name__)
+        if self.expires and (finish > self.expires) and not self._expiry_warned:
+            self._expiry_warned = True
+            L.warning(f'Projected finish {finish.isoformat(timespec="minutes")} is past token expiry '
+                      f'{self.expires.isoformat(timespec="minutes")}; replace {self.token_file} before then')
+
+    def close(self):
+        """
+        Close all idle clients.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            client._session.close()
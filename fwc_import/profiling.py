@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import json
+import datetime
+import threading
+from pathlib import Path
+from logging import getLogger
+from contextlib import contextmanager
+from time import perf_counter
+
+from .defs import WORK_LOC
+
+PROFILE_LOC = WORK_LOC.joinpath('profile')
+"""
+The directory profiles are written to.
+Defaults to ``~/fwc-import/profile/``.
+"""
+
+MODES = ['cpu', 'memory']
+"""
+The profiling modes.
+"""
+
+TOP = 30
+"""
+The number of functions or allocation sites listed in the text summaries.
+"""
+
+PROFILER = None
+"""
+The active :py:class:`Profiler`, or None. Set by :py:func:`start_profiler`.
+"""
+
+
+class Profiler:
+    """
+    Profile a run of ``fwcconvert`` or ``fwcimport``.
+
+    In ``cpu`` mode, :py:mod:`cProfile` records the whole run, or, with
+    ``stages``, each named stage (see :py:meth:`stage`) separately. The
+    ``.pstats`` dumps can be opened with :py:mod:`pstats` or snakeviz, and a
+    text summary sorted by cumulative time is written next to each one.
+
+    In ``memory`` mode, :py:mod:`tracemalloc` is started and a snapshot is
+    taken every ``every`` packages (see :py:meth:`checkpoint`) and at the end.
+    The top allocation sites, and their growth since the previous snapshot,
+    are written as text.
+
+    In both modes, the wall-clock time and call count of each stage are
+    written to ``{name}.stages.json``. Stages may be marked from several
+    threads at once (e.g. the fan-out and lane workers); their times are
+    added up, so a stage can take more seconds than the run.
+
+    :param str mode: ``cpu`` or ``memory``.
+    :param str name: The run name, used in the file names.
+    :param bool stages: In ``cpu`` mode, profile each stage separately
+        instead of the whole run.
+    :param int every: In ``memory`` mode, take a snapshot every ``every``
+        packages.
+    :param Path dest: The directory to write to.
+    """
+    def __init__(self, mode: str, name: str, stages: bool=False, every: int=100, dest: Path=PROFILE_LOC):
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiling mode {mode}; use one of {MODES}')
+        self.mode = mode
+        self.stages = stages
+        self.every = every
+        self.dest = Path(dest)
+        self.name = f'{name}-{datetime.datetime.now().strftime("%Y%m%dT%H%M%S")}'
+        self.profile = None
+        self.stage_profiles = {}
+        self.stage_times = {}
+        self.snapshot = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def path(self, suffix: str):
+        """
+        Get the path of an output file.
+
+        :param str suffix: The file name suffix.
+        :return: The path.
+        :rtype: Path
+        """
+        return self.dest.joinpath(f'{self.name}{suffix}')
+
+    def start(self):
+        """
+        Start profiling.
+        """
+        L = getLogger(__name__)
+        self.dest.mkdir(parents=True, exist_ok=True)
+        if self.mode == 'cpu' and not self.stages:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.mode == 'memory':
+            import tracemalloc
+            # one frame per allocation keeps the overhead low enough for
+            # production runs; sites are reported by file and line
+            tracemalloc.start(1)
+        L.info(f'Profiling {self.mode}{" by stage" if self.stages else ""}; writing to {self.path("*")}')
+        return self
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of the run and, in per-stage ``cpu`` mode, profile it.
+        Stages are not nested within a thread; an inner stage is counted as
+        part of the outer. Each thread profiles a stage with its own
+        :py:class:`cProfile.Profile`, and they are merged when written.
+
+        :param str name: The stage name, e.g. ``build_eml`` or ``ledger``.
+        """
+        local = self._local
+        if getattr(local, 'current', None) is not None:
+            yield
+            return
+        local.current = name
+        prof = None
+        if self.mode == 'cpu' and self.stages:
+            import cProfile
+            if not hasattr(local, 'profiles'):
+                local.profiles = {}
+            prof = local.profiles.get(name) or cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                # another thread's profiler is active (Python 3.12+); time only
+                prof = None
+            else:
+                if name not in local.profiles:
+                    # registered only once enabled, so that every written profile has stats
+                    local.profiles[name] = prof
+                    with self._lock:
+                        self.stage_profiles.setdefault(name, []).append(prof)
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            t = perf_counter() - t0
+            if prof:
+                prof.disable()
+            with self._lock:
+                total, calls = self.stage_times.get(name, (0.0, 0))
+                self.stage_times[name] = (total + t, calls + 1)
+            local.current = None
+
+    def checkpoint(self, n: int):
+        """
+        Take a memory snapshot after every ``every`` packages.
+
+        :param int n: The number of packages processed so far.
+        """
+        if (self.mode == 'memory') and n and (n % self.every == 0):
+            self.write_snapshot(f'-{n:06d}')
+
+    def write_snapshot(self, suffix: str):
+        """
+        Write the top allocation sites, and their growth since the previous
+        snapshot, to a text file.
+
+        :param str suffix: The file name suffix.
+        """
+        import tracemalloc
+        L = getLogger(__name__)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        fp = self.path(f'{suffix}.memory.txt')
+        with open(fp, 'w') as f:
+            f.write(f'Traced memory: {current / 1024 / 1024:.1f} MiB (peak {peak / 1024 / 1024:.1f} MiB)\n\n')
+            f.write(f'Top {TOP} allocation sites:\n')
+            for stat in snapshot.statistics('lineno')[:TOP]:
+                f.write(f'{stat}\n')
+            if self.snapshot is not None:
+                f.write(f'\nTop {TOP} changes since the previous snapshot:\n')
+                for stat in snapshot.compare_to(self.snapshot, 'lineno')[:TOP]:
+                    f.write(f'{stat}\n')
+        self.snapshot = snapshot
+        L.info(f'Traced memory {current / 1024 / 1024:.1f} MiB; wrote allocation sites to {fp}')
+
+    def write_stats(self, profiles: list, suffix: str):
+        """
+        Dump one or more cProfile profiles, merged, and a text summary sorted
+        by cumulative time. Profiles that collected nothing are skipped.
+
+        :param list profiles: The profiles.
+        :param str suffix: The file name suffix.
+        """
+        import io
+        import pstats
+        profiles = [p for p in profiles if p.getstats()]
+        if not profiles:
+            return
+        out = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=out)
+        stats.dump_stats(self.path(f'{suffix}.pstats'))
+        stats.sort_stats('cumulative').print_stats(TOP)
+        self.path(f'{suffix}.txt').write_text(out.getvalue())
+
+    def stop(self):
+        """
+        Stop profiling and write the results.
+        """
+        L = getLogger(__name__)
+        if self.profile:
+            self.profile.disable()
+            self.write_stats([self.profile], '')
+        for name, profs in self.stage_profiles.items():
+            self.write_stats(profs, f'.{name}')
+        if self.mode == 'memory':
+            import tracemalloc
+            self.write_snapshot('-final')
+            tracemalloc.stop()
+        with open(self.path('.stages.json'), 'w') as f:
+            json.dump({k: {'seconds': round(t, 4), 'calls': c} for k, (t, c) in self.stage_times.items()}, fp=f, indent=2)
+        L.info(f'Wrote {self.mode} profile to {self.path("*")}')
+
+
+def start_profiler(mode: str, name: str, stages: bool=False, every: int=100):
+    """
+    Start the process-wide profiler used by :py:func:`stage` and
+    :py:func:`checkpoint`.
+
+    :param str mode: ``cpu`` or ``memory``.
+    :param str name: The run name.
+    :param bool stages: Profile each stage separately (``cpu`` mode).
+    :param int every: Snapshot interval in packages (``memory`` mode).
+    :return: The profiler.
+    :rtype: Profiler
+    """
+    global PROFILER
+    PROFILER = Profiler(mode, name, stages=stages, every=every).start()
+    return PROFILER
+
+
+def stop_profiler():
+    """
+    Stop the process-wide profiler, if there is one, and write its results.
+    """
+    global PROFILER
+    if PROFILER is not None:
+        PROFILER.stop()
+        PROFILER = None
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mark a stage of the run for the active profiler. Does nothing when no
+    profiler is running.
+
+    :param str name: The stage name.
+    """
+    if PROFILER is None:
+        yield
+    else:
+        with PROFILER.stage(name):
+            yield
+
+
+def checkpoint(n: int):
+    """
+    Tell the active profiler that ``n`` packages have been processed. Does
+    nothing when no profiler is running.
+
+    :param int n: The number of packages processed so far.
+    """
+    if PROFILER is not None:
+        PROFILER.checkpoint(n)
+
+
+def add_profile_arguments(parser):
+    """
+    Add the ``--profile`` options to an argument parser.
+
+    :param argparse.ArgumentParser parser: The parser.
+    """
+    parser.add_argument('--profile', choices=MODES,
+                        help='profile the run; results are written to ~/fwc-import/profile/')
+    parser.add_argument('--profile-stages', action='store_true',
+                        help='with --profile cpu, write one profile per stage instead of one for the whole run')
+    parser.add_argument('--profile-every', type=int, default=100, metavar='N',
+                        help='with --profile memory, take a snapshot every N packages (default: 100)')
@@ -1,6 +1,9 @@
+from __future__ import annotations
+
 import uuid
 import hashlib
 import datetime
+import threading
 from pathlib import Path
 
 from d1_client.mnclient_2_0 import *
@@ -11,11 +14,19 @@ from d1_common.resource_map import ResourceMap
 from logging import getLogger
 from copy import deepcopy
 
-from .defs import fmts, CN_URL, DATA_ROOT, WORK_LOC
+from .defs import fmts, CN_URL, DATA_ROOT, WORK_LOC, setup_logging
 from .utils import load_uploads, save_uploads, \
-            get_token, get_config, create_client, \
-            generate_access_policy
+            get_config, \
+            generate_access_policy, shard_of, uploads_path
 from .conv import write_pretty_xml, register_namespaces
+from .pool import ClientPool
+from .logs import Lazy, configure_hot_path_logging, sample_package
+from .mirror import mirror_path, open_mirror, sync_mirror, find_by_pid
+from .plan import content_hash
+from .dirindex import list_files, open_index
+from .sysmeta import SysMeta
+from .archives import archive_members, is_archive
+from .profiling import stage, checkpoint
 
 rpt_txt = """
 Package creation report:
@@ -33,6 +44,15 @@ The package creation report text template.
 """
 
 
+LEDGER_LOCK = threading.RLock()
+"""
+Held while a ledger is changed or saved, so that packages can be uploaded
+from several threads (see :py:mod:`fwc_import.schedule`).
+"""
+
+_rdf_lock = threading.Lock()
+
+
 def generate_sys_meta(pid: str, sid: str, format_id: str, size: int, md5, now, orcid: str):
     """
     Fills out the system metadata object with the needed properties
@@ -69,7 +89,10 @@ def generate_system_metadata(pid: str, sid: str, format_id: str, science_object:
     :param pid: The pid that the object will have
     :param format_id: The format of the object (e.g text/csv)
     :param science_object: The object that is being described
-    :return: The system metadata document, MD5 sum, and size of the object
+    :return: The system metadata document, MD5 sum, and size of the object.
+        The document is a :py:class:`fwc_import.sysmeta.SysMeta` filled in
+        from a template; set ``pyxb_sysmeta`` in the config file to build a
+        pyxb object with :py:func:`generate_sys_meta` instead.
     :rtype: tuple
     """
     L = getLogger(__name__)
@@ -85,7 +108,10 @@ def generate_system_metadata(pid: str, sid: str, format_id: str, science_object:
     md5.update(science_object)
     md5 = md5.hexdigest()
     now = datetime.datetime.now()
-    sys_meta = generate_sys_meta(pid, sid, format_id, size, md5, now, orcid)
+    if get_config().get('pyxb_sysmeta'):
+        sys_meta = generate_sys_meta(pid, sid, format_id, size, md5, now, orcid)
+    else:
+        sys_meta = SysMeta(pid, format_id, size, md5, now, orcid)
     return sys_meta, md5, size
 
 
@@ -148,20 +174,28 @@ def get_format(fmt: Path):
     return "application/octet-stream"
 
 
-def get_filepaths(files: list, doidir: Path):
+def get_filepaths(files: list, doidir: Path, index=None):
     """
-    Get the paths to the files in the data directory.
+    Get the paths to the files in the data directory. A zip or tar archive
+    is listed as its members, which are read in place, so archives do not
+    need to be extracted first; if an archive is missing, the folder it would
+    have been extracted to is used.
 
     :param list files: The list of files to search for.
     :param Path doidir: The path to the data directory.
-    :return: The list of paths to the files.
+    :param index: The directory index of the data root, or None to look on
+        the file system.
+    :type index: fwc_import.dirindex.DirIndex or None
+    :return: The list of paths to the files and archive members.
     :rtype: list
     """
     paths = []
     for f in files:
         p = Path(doidir / f['name'])
-        if p.exists():
-            paths.append(p)
+        if (index.exists(p) if index is not None else p.exists()):
+            paths += archive_members(p) if is_archive(p) else [p]
+        elif index is not None:
+            paths += list(index.files(p.parent / p.stem))
         else:
             for pa in Path(p.parent / p.stem).glob('*'):
                 paths.append(pa)
@@ -192,7 +226,8 @@ def upload_eml(orcid: str, doi: str, rpid: str, eml: str, client: MemberNodeClie
     eml_dmd = client.create(eml_pid, eml_bytes, eml_sm)
     if isinstance(eml_dmd, dataoneTypes.Identifier):
         try:
-            L.info(f'{doi} Received response for EML upload: {eml_dmd.value()}\n{eml_dmd}')
+            L.info('%s Received response for EML upload: %s', doi, eml_dmd.value())
+            L.debug('%s Response:\n%s', doi, Lazy(eml_dmd.toxml, 'utf-8'))
             if eml_dmd.value() == eml_pid:
                 L.info(f'{doi} EML uploaded successfully: {eml_pid}')
             else:
@@ -203,7 +238,7 @@ def upload_eml(orcid: str, doi: str, rpid: str, eml: str, client: MemberNodeClie
     else:
         L.error(f'{doi} Unexpected response type: {type(eml_dmd)}')
         try:
-            L.debug(f'{doi} Received response:\n{eml_dmd.value()}')
+            L.debug('%s Received response:\n%s', doi, Lazy(eml_dmd.value))
         except Exception as e:
             L.error(f'{doi} Could not print response: {repr(e)}')
         return None
@@ -220,12 +255,14 @@ def generate_resource_map(eml_pid: str, rm_pid: str, data_pids: list):
     :rtype: str
     """
     L = getLogger(__name__)
-    resource_map: ResourceMap = createSimpleResourceMap(
-        ore_pid=rm_pid,
-        scimeta_pid=eml_pid,
-        sciobj_pid_list=data_pids,
-    )
-    L.debug(f"Generated resource map:\n{resource_map}")
+    # rdflib's SPARQL parser, used while the map is built, is not thread-safe
+    with _rdf_lock:
+        resource_map: ResourceMap = createSimpleResourceMap(
+            ore_pid=rm_pid,
+            scimeta_pid=eml_pid,
+            sciobj_pid_list=data_pids,
+        )
+    L.debug('Generated resource map:\n%s', resource_map)
     return resource_map
 
 
@@ -264,7 +301,7 @@ def upload_resource_map(doi: str, rm_pid: str, resource_map: ResourceMap, client
     else:
         L.error(f'{doi} Unexpected response type: {type(resource_map_dmd)}')
         try:
-            L.debug(f'{doi} Received response:\n{resource_map_dmd.value()}')
+            L.debug('%s Received response:\n%s', doi, Lazy(resource_map_dmd.value))
         except Exception as e:
             L.error(f'{doi} Could not print response: {repr(e)}')
         return None
@@ -286,48 +323,231 @@ def report(succ: int, fail: int, finished_dois: list, failed_dois: list):
     L.info(rpt_txt % (fail, succ, failed_str, finished_str))
 
 
-def upload_metadata_to_new_packages(eml_folder: str, orcid: str, client: MemberNodeClient_2_0, node: str):
+def load_shard_uploads(node: str, shard: tuple):
+    """
+    Load the ledger for one shard. If the shard has no ledger yet, it is seeded
+    with the entries of the main ``{node}.json`` ledger that belong to the
+    shard, so that previous versions are still obsoleted correctly.
+
+    :param str node: The node identifier.
+    :param tuple shard: The shard index and shard count.
+    :return: The uploads dictionary for the shard.
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    try:
+        return load_uploads(uploads_path(node, shard))
+    except FileNotFoundError:
+        pass
+    try:
+        uploads = load_uploads(uploads_path(node))
+    except FileNotFoundError:
+        return {}
+    uploads = {k: v for k, v in uploads.items() if shard_of(k, shard[1]) == shard[0]}
+    L.info(f'Seeded shard {shard[0]}/{shard[1]} ledger with {len(uploads)} packages from the main ledger')
+    return uploads
+
+
+def is_uploaded(mirror, entry: dict | None, eml_string: str, pid: str | None):
+    """
+    Check the local object mirror to see whether an EML file and its resource
+    map are already on the Member Node. This is the case when the file's
+    packageId is the EML PID recorded in the ledger, the mirror has an object
+    with that PID and the same MD5, and the mirror also has the ledger's
+    resource map.
+
+    :param mirror: The object mirror database.
+    :type mirror: sqlite3.Connection
+    :param dict entry: The package's ledger entry, or None.
+    :param str eml_string: The EML file contents.
+    :param str pid: The packageId attribute of the EML file.
+    :return: True if the package does not need to be uploaded again.
+    :rtype: bool
+    """
+    if not (entry and entry.get('eml') and entry.get('resource_map') and pid):
+        return False
+    if entry['eml']['identifier'] != pid:
+        return False
+    eml_obj = find_by_pid(mirror, pid)
+    if (eml_obj is None) or (eml_obj['checksum'] != hashlib.md5(eml_string.encode('utf-8')).hexdigest()):
+        return False
+    return find_by_pid(mirror, entry['resource_map']['identifier']) is not None
+
+
+def upload_package(eml_path: Path, root, package_id: str, orcid: str, pool: ClientPool, uploads: dict, uploads_loc: Path,
+                   data_pids: list | None=None):
+    """
+    Upload one package: a new EML (with a new UUID as packageId, written back
+    to the file) and a resource map. If the ledger has a previous version,
+    its EML and resource map are obsoleted by the new ones. The ledger is
+    saved after each object, holding :py:data:`LEDGER_LOCK`; the EML's
+    ``content_md5`` is only recorded once the resource map is uploaded.
+
+    :param Path eml_path: The EML file.
+    :param root: The parsed EML root element.
+    :type root: xml.etree.ElementTree.Element
+    :param str package_id: The package's alternateIdentifier.
+    :param str orcid: The ORCID of the uploader.
+    :param ClientPool pool: The Member Node client pool.
+    :param dict uploads: The ledger.
+    :param Path uploads_loc: The ledger file.
+    :param list data_pids: The identifiers of data objects already uploaded
+        for the package, to list in the resource map.
+    :raises exceptions.DataONEException: If the EML or resource map upload fails.
+    """
+    L = getLogger(__name__)
+    sep = '' if CN_URL.endswith('/') else '/'
+    old_eml_pid, old_resource_map_pid = None, None
+    rpid = pool.call(lambda client: client.generateIdentifier(scheme="UUID", fragment="urn:uuid:").value())
+    root.attrib['packageId'] = str(rpid)
+    with stage('write_eml'):
+        write_pretty_xml(root, eml_path, repretty=False)
+        eml_string = eml_path.read_text(encoding='utf-8')
+        content_md5 = content_hash(root)
+    # Use packageId as the identifier
+    with LEDGER_LOCK:
+        if uploads.get(package_id) and uploads[package_id].get('eml'):
+            old_eml_pid = uploads[package_id]['eml']['identifier']
+            L.info(f'{package_id} Found previous EML: {old_eml_pid}')
+        elif not uploads.get(package_id):
+            uploads[package_id] = {}
+    with stage('upload_eml'):
+        eml_pid, eml_md5, eml_size = pool.call(upload_eml, orcid, package_id, rpid, eml_string)
+    if old_eml_pid:
+        L.info(f'{package_id} Adding obsoletedBy to old EML sysmeta object: {old_eml_pid}')
+        with stage('obsolete'):
+            pool.call(sysmeta_obsolete_updates, old_pid=old_eml_pid, new_pid=eml_pid)
+    if eml_pid:
+        with LEDGER_LOCK:
+            uploads[package_id]['eml'] = {
+                'filename': eml_path.name,
+                'size': eml_size,
+                'doi': package_id,
+                'identifier': eml_pid,
+                'md5': eml_md5,
+                # set once the resource map is uploaded, so that an incomplete package counts as changed
+                'content_md5': None,
+                'formatId': "https://eml.ecoinformatics.org/eml-2.2.0",
+                'url': f"{CN_URL}{sep}v2/resolve/{eml_pid}",
+                'obsoletes': old_eml_pid,
+            }
+            with stage('ledger'):
+                save_uploads(uploads, fp=uploads_loc)
+        # Generate the DataONE resource map (with the EML and data PIDs)
+        rm_pid = f"resource_map_{rpid}" if rpid else pool.call(lambda client: client.generateIdentifier(scheme="UUID", fragment="resource_map_urn:uuid:").value())
+        pid_list = [eml_pid] + list(data_pids or [])
+        with stage('resource_map'):
+            resource_map = generate_resource_map(eml_pid=eml_pid, rm_pid=rm_pid, data_pids=pid_list)
+        if uploads[package_id].get('resource_map'):
+            old_resource_map_pid = uploads[package_id]['resource_map']['identifier']
+            L.info(f'{package_id} Found previous resource map: {old_resource_map_pid}')
+        with stage('upload_resource_map'):
+            resource_map_pid, resource_map_md5, resource_map_size = pool.call(
+                upload_resource_map,
+                doi=package_id,
+                rm_pid=rm_pid,
+                resource_map=resource_map,
+                orcid=orcid,
+            )
+        if old_resource_map_pid:
+            L.info(f'{package_id} Adding obsoletedBy to old resource map sysmeta object: {old_resource_map_pid}')
+            with stage('obsolete'):
+                pool.call(sysmeta_obsolete_updates, old_pid=old_resource_map_pid, new_pid=rm_pid)
+        if resource_map_pid:
+            with LEDGER_LOCK:
+                uploads[package_id]['resource_map'] = {
+                    'filename': 'resource_map.xml',
+                    'size': resource_map_size,
+                    'doi': package_id,
+                    'identifier': resource_map_pid,
+                    'md5': resource_map_md5,
+                    'formatId': "http://www.openarchives.org/ore/terms",
+                    'url': f"{CN_URL}{sep}v2/resolve/{resource_map_pid}",
+                    'obsoletes': old_resource_map_pid,
+                    'data': list(data_pids or []),
+                }
+                uploads[package_id]['eml']['content_md5'] = content_md5
+                with stage('ledger'):
+                    save_uploads(uploads, fp=uploads_loc)
+            L.info(f'{package_id} Resource map uploaded successfully: {resource_map_pid}')
+        else:
+            uploads[package_id]['resource_map'] = None
+            raise exceptions.DataONEException(f'{package_id} Resource map upload failed')
+    else:
+        uploads[package_id]['eml'] = None
+        raise exceptions.DataONEException(f'{package_id} EML upload failed')
+
+
+def upload_metadata_to_new_packages(eml_folder: str, orcid: str, pool: ClientPool, node: str, shard: tuple | None=None, mirror=None, index=None):
     """
     Upload only metadata (EML) and data packages (resource maps) for each EML file in the given folder, using packageId as the identifier.
 
+    If ``shard`` is given, only the packages whose alternateIdentifier hashes
+    to that shard are uploaded, and the results are written to the shard's own
+    ledger. Use :py:func:`fwc_import.utils.merge_uploads` to combine the shard
+    ledgers after all shards have finished.
+
+    Each Member Node call leases a client from ``pool``, so a token that is
+    replaced on disk during a long run is picked up without restarting.
+
     :param eml_folder: Path to the folder containing EML files.
     :param orcid: The ORCID of the uploader.
-    :param client: The Member Node client.
+    :param pool: The Member Node client pool.
     :param node: The node identifier.
+    :param shard: The shard index and shard count, e.g. ``(0, 4)``, or None.
+    :param mirror: The local object mirror (see :py:mod:`fwc_import.mirror`).
+        If given, packages that are already on the Member Node unchanged are
+        skipped.
+    :type mirror: sqlite3.Connection or None
+    :param index: The directory index (see :py:mod:`fwc_import.dirindex`). If
+        given, the EML files are enumerated from it as they are needed
+        instead of globbing the folder.
+    :type index: fwc_import.dirindex.DirIndex or None
     """
     import xml.etree.ElementTree as ET
     L = getLogger(__name__)
-    sep = '' if CN_URL.endswith('/') else '/'
-    eml_dir = Path(eml_folder)
-    eml_files = sorted(list(eml_dir.glob('*.xml')))
-    L.debug(f'Found {len(eml_files)} EML files in {eml_folder}')
-    n = len(eml_files)
+    n, eml_files = list_files(eml_folder, '*.xml', index=index)
+    L.debug(f'Found {n} EML files in {eml_folder}')
     i = 0
     er = 0
+    skipped = 0
+    unchanged = 0
     succ_list = []
     err_list = []
-    uploads_loc = Path(WORK_LOC / f'{node}.json')
+    uploads_loc = uploads_path(node, shard)
     register_namespaces()
-    try:
-        uploads = load_uploads(uploads_loc)
-    except FileNotFoundError:
-        uploads = {}
+    if shard:
+        L.info(f'Running shard {shard[0]}/{shard[1]}; writing ledger to {uploads_loc}')
+        uploads = load_shard_uploads(node, shard)
+    else:
+        try:
+            uploads = load_uploads(uploads_loc)
+        except FileNotFoundError:
+            uploads = {}
+    started = datetime.datetime.now(datetime.timezone.utc)
     try:
         for eml_path in eml_files:
-            old_eml_pid, old_resource_map_pid = None, None
             i += 1
             L.debug(f'Processing file: {eml_path}')
             try:
-                eml_string = eml_path.read_text(encoding='utf-8')
-                # Parse packageId from EML header
-                root = ET.fromstring(eml_string)
+                with stage('parse'):
+                    eml_string = eml_path.read_text(encoding='utf-8')
+                    # Parse packageId from EML header
+                    root = ET.fromstring(eml_string)
                 # Get the content of the first alternateIdentifier tag
                 alt_id_elem = root.find('.//alternateIdentifier')
                 package_id = alt_id_elem.text if alt_id_elem is not None else None
-                rpid = client.generateIdentifier(scheme="UUID", fragment="urn:uuid:").value()
-                root.attrib['packageId'] = str(rpid)
-                write_pretty_xml(root, eml_path, repretty=False)
-                eml_string = eml_path.read_text(encoding='utf-8')
+                if shard and package_id and (shard_of(package_id, shard[1]) != shard[0]):
+                    # belongs to another shard; don't count it as processed
+                    i -= 1
+                    skipped += 1
+                    continue
+                if mirror and is_uploaded(mirror, uploads.get(package_id), eml_string, root.attrib.get('packageId')):
+                    L.debug(f'{package_id} is already on the Member Node; skipping')
+                    i -= 1
+                    unchanged += 1
+                    continue
+                sample_package(package_id)
                 L.debug(f'Parsed packageId: {package_id}')
                 if not package_id:
                     L.error(f'No packageId found in {eml_path.name}, skipping.')
@@ -335,95 +555,116 @@ def upload_metadata_to_new_packages(eml_folder: str, orcid: str, client: MemberN
                     err_list.append(eml_path.name)
                     continue
                 L.info(f'({i}/{n}) Working on {package_id} from {eml_path.name}')
-                # Use packageId as the identifier
-                if uploads.get(package_id) and uploads[package_id].get('eml'):
-                    old_eml_pid = uploads[package_id]['eml']['identifier']
-                    L.info(f'{package_id} Found previous EML: {old_eml_pid}')
-                else:
-                    if not uploads.get(package_id):
-                        uploads[package_id] = {}
-                eml_pid, eml_md5, eml_size = upload_eml(orcid, package_id, rpid, eml_string, client)
-                if old_eml_pid:
-                    L.info(f'{package_id} Adding obsoletedBy to old EML sysmeta object: {old_eml_pid}')
-                    sysmeta_obsolete_updates(client, old_eml_pid, eml_pid)
-                if eml_pid:
-                    uploads[package_id]['eml'] = {
-                        'filename': eml_path.name,
-                        'size': eml_size,
-                        'doi': package_id,
-                        'identifier': eml_pid,
-                        'md5': eml_md5,
-                        'formatId': "https://eml.ecoinformatics.org/eml-2.2.0",
-                        'url': f"{CN_URL}{sep}v2/resolve/{eml_pid}",
-                    }
-                    save_uploads(uploads, fp=uploads_loc)
-                    # Generate the DataONE resource map (with only the EML PID)
-                    rm_pid = f"resource_map_{rpid}" if rpid else client.generateIdentifier(scheme="UUID", fragment="resource_map_urn:uuid:").value()
-                    pid_list = [eml_pid]
-                    resource_map = generate_resource_map(eml_pid=eml_pid, rm_pid=rm_pid, data_pids=pid_list)
-                    if uploads[package_id].get('resource_map'):
-                        old_resource_map_pid = uploads[package_id]['resource_map']['identifier']
-                        L.info(f'{package_id} Found previous resource map: {old_resource_map_pid}')
-                    resource_map_pid, resource_map_md5, resource_map_size = upload_resource_map(
-                        doi=package_id,
-                        rm_pid=rm_pid,
-                        resource_map=resource_map,
-                        client=client,
-                        orcid=orcid,
-                    )
-                    if old_resource_map_pid:
-                        L.info(f'{package_id} Adding obsoletedBy to old resource map sysmeta object: {old_resource_map_pid}')
-                        sysmeta_obsolete_updates(client, old_pid=old_resource_map_pid, new_pid=resource_map.getResourceMapPid())
-                    if resource_map_pid:
-                        uploads[package_id]['resource_map'] = {
-                            'filename': 'resource_map.xml',
-                            'size': resource_map_size,
-                            'doi': package_id,
-                            'identifier': resource_map_pid,
-                            'md5': resource_map_md5,
-                            'formatId': "http://www.openarchives.org/ore/terms",
-                            'url': f"{CN_URL}{sep}v2/resolve/{resource_map_pid}",
-                        }
-                        save_uploads(uploads, fp=uploads_loc)
-                        L.info(f'{package_id} Resource map uploaded successfully: {resource_map_pid}')
-                    else:
-                        uploads[package_id]['resource_map'] = None
-                        raise exceptions.DataONEException(f'{package_id} Resource map upload failed')
-                else:
-                    uploads[package_id]['eml'] = None
-                    raise exceptions.DataONEException(f'{package_id} EML upload failed')
+                upload_package(eml_path, root, package_id, orcid, pool, uploads, uploads_loc)
                 succ_list.append(package_id)
+                checkpoint(i)
+                # project the finish time from the rate so far
+                now = datetime.datetime.now(datetime.timezone.utc)
+                pool.warn_if_expiring(now + (now - started) / i * (n - i))
             except Exception as e:
                 er += 1
                 err_list.append(str(eml_path))
                 L.error(f'{eml_path} / {repr(e)}')
+            finally:
+                sample_package(None)
     except KeyboardInterrupt:
         L.info('Caught KeyboardInterrupt; generating report...')
     finally:
         save_uploads(uploads, fp=uploads_loc)
+        if shard:
+            L.info(f'Skipped {skipped} packages belonging to other shards')
+        if mirror:
+            L.info(f'Skipped {unchanged} packages already on the Member Node')
         report(succ=i-er, fail=er, finished_dois=succ_list, failed_dois=err_list)
 
-def run_data_upload():
+def run_data_upload(shard: tuple | None=None):
     """
     Set config items then start upload loop. This function is called when the
     script is run directly.
+
+    If the config file has a ``targets`` list of node configs (each with
+    ``nodeid``, ``mnurl`` and optionally ``token_file``), every package is
+    prepared once and uploaded to all of them (see
+    :py:func:`fwc_import.fanout.upload_to_targets`).
+
+    If ``dir_index`` is true in the config file, the EML folder is enumerated
+    from a persistent directory index (see :py:mod:`fwc_import.dirindex`)
+    that is refreshed at the start of the run.
+
+    If ``data_files`` is set in the config file to a directory, the files in
+    ``{data_files}/{package_id}/`` are uploaded as data objects with each
+    package, through separate lanes for small and large objects (see
+    :py:func:`fwc_import.schedule.upload_scheduled`). The ``lanes`` config
+    item sets ``small_workers``, ``large_workers`` and ``large_size``. Files
+    whose content is already on the Member Node are uploaded once and shared
+    between packages, unless ``dedup_data`` is false.
+
+    :param shard: The shard index and shard count to upload, e.g. ``(0, 4)``.
+        Defaults to None, which uploads every package.
+    :type shard: tuple or None
     """
+    setup_logging()
     L = getLogger(__name__)
     # Set config items
-    auth_token = get_token()
     config = get_config()
+    configure_hot_path_logging(queue=config.get('log_queue', False),
+                               sample_rate=config.get('log_sample_rate'))
     orcid = config.get('rightsholder_orcid')
+    data_root = config.get('data_root', 'output_eml')
+    index = open_index(data_root) if config.get('dir_index') else None
+    if config.get('targets'):
+        from .fanout import Target, upload_to_targets
+        L.info(f'Rightsholder ORCiD {orcid}')
+        targets = [Target(t, shard=shard) for t in config['targets']]
+        upload_to_targets(eml_folder=data_root, orcid=orcid, targets=targets, shard=shard, index=index)
+        for t in targets:
+            t.pool.close()
+        if index:
+            index.close()
+        return
+    if config.get('data_files'):
+        from .schedule import upload_scheduled
+        node = config.get('nodeid')
+        L.info(f'Rightsholder ORCiD {orcid}')
+        L.info(f'Using {node} at {config.get("mnurl")}')
+        data_index = open_index(config['data_files']) if config.get('dir_index') else None
+        lanes = config.get('lanes', {})
+        pool = ClientPool(config.get('mnurl'), token_file=config.get('token_file'),
+                          size=lanes.get('small_workers', 4) + lanes.get('large_workers', 2))
+        mirror = None
+        if mirror_path(node).exists():
+            mirror = open_mirror(node)
+            pool.call(lambda client: sync_mirror(mirror, client))
+        upload_scheduled(eml_folder=data_root, data_dir=config['data_files'], orcid=orcid, pool=pool, node=node,
+                         shard=shard, index=index, data_index=data_index,
+                         dedup=config.get('dedup_data', True), mirror=mirror, **lanes)
+        pool.close()
+        if mirror:
+            mirror.close()
+        for i in (index, data_index):
+            if i:
+                i.close()
+        return
     node = config.get('nodeid')
     mn_url = config.get('mnurl')
-    data_root = config.get('data_root', 'output_eml')
     L.info(f'Rightsholder ORCiD {orcid}')
     L.info(f'Using {node} at {mn_url}')
     L.info(f'Metadata path: {DATA_ROOT}')
-    # Create the Member Node Client
-    client: MemberNodeClient_2_0 = create_client(mn_url, auth_token=auth_token)
+    # Create the Member Node client pool
+    pool = ClientPool(mn_url, token_file=config.get('token_file'))
+    mirror = None
+    if mirror_path(node).exists():
+        # only use the mirror if one has been built with `fwcimport mirror`
+        mirror = open_mirror(node)
+        pool.call(lambda client: sync_mirror(mirror, client))
     L.info(f'Uploading EMLs from folder: {data_root}')
-    upload_metadata_to_new_packages(eml_folder=data_root, orcid=orcid, client=client, node=node)
-    client._session.close()
+    upload_metadata_to_new_packages(eml_folder=data_root, orcid=orcid, pool=pool, node=node, shard=shard, mirror=mirror,
+                                    index=index)
+    pool.close()
+    if mirror:
+        mirror.close()
+    if index:
+        index.close()
 
 
 if __name__ == "__main__":
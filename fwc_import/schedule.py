@@ -0,0 +1,521 @@
+from __future__ import annotations
+
+import os
+import uuid
+import queue
+import hashlib
+import functools
+import datetime
+import itertools
+import threading
+from pathlib import Path
+from logging import getLogger
+from concurrent.futures import Future
+import xml.etree.ElementTree as ET
+
+from d1_common.types import dataoneTypes, exceptions
+
+from .defs import CN_URL
+from .utils import load_uploads, save_uploads, shard_of, uploads_path
+from .conv import register_namespaces
+from .dirindex import list_files
+from .archives import ArchiveMember, archive_members, is_archive
+from .sysmeta import SysMeta
+from .run_data_upload import LEDGER_LOCK, get_format, is_uploaded, load_shard_uploads, report, \
+            sysmeta_obsolete_updates, upload_package
+from .plan import scan_eml, classify
+
+SMALL_WORKERS = 4
+"""
+The default number of concurrent uploads in the small lane (metadata and
+small data objects).
+"""
+
+LARGE_WORKERS = 2
+"""
+The default number of concurrent uploads in the large lane.
+"""
+
+LARGE_SIZE = 64 * 1024 * 1024
+"""
+Objects of at least this many bytes go to the large lane. Defaults to 64 MiB.
+"""
+
+CHUNK_SIZE = 1024 * 1024
+"""
+The read size when hashing data files.
+"""
+
+
+class Lane:
+    """
+    A group of worker threads that take jobs from a priority queue, largest
+    job first.
+
+    :param str name: The lane name, for logging.
+    :param int workers: The number of worker threads.
+    """
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.queue = queue.PriorityQueue()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.work, name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def work(self):
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                break
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def stop(self, wait: bool=True):
+        for _ in self.threads:
+            # sorts after every real job, so queued work is finished first
+            self.queue.put((float('inf'), 0, None))
+        if wait:
+            for t in self.threads:
+                t.join()
+
+
+class SizeScheduler:
+    """
+    Run jobs in two lanes by size: objects smaller than ``large_size`` in the
+    small lane and the rest in the large lane, each with its own number of
+    workers, so that a few multi-GB transfers cannot hold up thousands of
+    small objects. Within a lane, the largest waiting job runs first, which
+    keeps the longest transfers from starting last.
+
+    Jobs submitted before :py:meth:`start` are all ordered by size; jobs
+    submitted later are ordered among those still waiting.
+
+    :param int small_workers: The number of concurrent small-lane jobs.
+    :param int large_workers: The number of concurrent large-lane jobs.
+    :param int large_size: The size in bytes from which a job is large.
+    """
+    def __init__(self, small_workers: int=SMALL_WORKERS, large_workers: int=LARGE_WORKERS, large_size: int=LARGE_SIZE):
+        self.large_size = large_size
+        self.small = Lane('small', small_workers)
+        self.large = Lane('large', large_workers)
+        self._seq = itertools.count()
+
+    def submit(self, size: int, fn, *args, **kwargs):
+        """
+        Queue a job.
+
+        :param int size: The number of bytes the job transfers.
+        :param fn: The function to call.
+        :return: A future for the result.
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        lane = self.large if size >= self.large_size else self.small
+        lane.queue.put((-size, next(self._seq), (future, fn, args, kwargs)))
+        return future
+
+    def start(self):
+        self.small.start()
+        self.large.start()
+        return self
+
+    def shutdown(self, wait: bool=True):
+        self.small.stop(wait=wait)
+        self.large.stop(wait=wait)
+
+
+def hash_file(path: Path | ArchiveMember, chunk_size: int=CHUNK_SIZE):
+    """
+    Compute the MD5 of a file without reading it into memory at once.
+
+    :param path: The file or archive member.
+    :type path: Path or ArchiveMember
+    :param int chunk_size: The read size.
+    :return: The MD5 hex digest and the size in bytes.
+    :rtype: tuple
+    """
+    md5 = hashlib.md5()
+    size = 0
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+            size += len(chunk)
+    return md5.hexdigest(), size
+
+
+def package_data_files(data_dir: Path, package_id: str, index=None):
+    """
+    List a package's data files: the files in ``{data_dir}/{package_id}/``.
+    Zip and tar archives are listed as their members, which are read from
+    the archive in place (see :py:mod:`fwc_import.archives`).
+
+    :param Path data_dir: The data file root.
+    :param str package_id: The package's alternateIdentifier.
+    :param index: The directory index of ``data_dir``, or None. The files
+        are listed from the index but stat'ed on disk.
+    :type index: fwc_import.dirindex.DirIndex or None
+    :return: ``(path, size, mtime_ns)`` for each file or archive member.
+    :rtype: list
+    """
+    folder = Path(data_dir) / package_id
+    if index is not None:
+        # the index is only refreshed when a directory changes, so a file
+        # rewritten in place is stat'ed to see its current size and mtime
+        files = []
+        for p in index.files(folder):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((p, st.st_size, st.st_mtime_ns))
+    else:
+        try:
+            with os.scandir(folder) as it:
+                files = sorted((Path(e.path), e.stat().st_size, e.stat().st_mtime_ns) for e in it if e.is_file())
+        except FileNotFoundError:
+            return []
+    listing = []
+    for path, size, mtime in files:
+        if is_archive(path):
+            listing += [(m, m.size, m.mtime_ns) for m in archive_members(path)]
+        else:
+            listing.append((path, size, mtime))
+    return listing
+
+
+class ContentStore:
+    """
+    The data objects already on the Member Node, by content: a map from
+    ``(md5, size)`` to the identifier and formatId of the object, built from
+    the ``data`` entries of every package in the ledger and added to as files
+    are uploaded. A file whose content is already in the store is not
+    uploaded again; the package lists the existing object in its resource
+    map instead.
+
+    Files with the same content that are uploaded at the same time are
+    serialized on their checksum, so only the first is sent.
+
+    :param dict uploads: The ledger.
+    """
+    def __init__(self, uploads: dict):
+        self.objects = {}
+        for entry in uploads.values():
+            for d in ((entry or {}).get('data') or {}).values():
+                if d.get('identifier') and d.get('md5'):
+                    self.objects.setdefault((d['md5'], d['size']), (d['identifier'], d.get('formatId')))
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def lock(self, key: tuple):
+        """
+        Get the lock for one content key.
+
+        :param tuple key: ``(md5, size)``.
+        :rtype: threading.Lock
+        """
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+def upload_data_file(path: Path | ArchiveMember, orcid: str, client, store: ContentStore | None=None):
+    """
+    Upload one data file as a new object. The file is hashed in chunks and
+    then streamed to the Member Node. If its content is already in the
+    store, the existing object is returned instead of uploading a copy.
+
+    :param path: The file or archive member.
+    :type path: Path or ArchiveMember
+    :param str orcid: The rightsHolder.
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :param ContentStore store: The content store, or None to always upload.
+    :return: The identifier, MD5, size and formatId of the object, and
+        whether it was already on the Member Node.
+    :rtype: tuple
+    """
+    L = getLogger(__name__)
+    md5, size = hash_file(path)
+    key = (md5, size)
+    if store is None:
+        return (*create_data_object(path, md5, size, orcid, client), False)
+    with store.lock(key):
+        if key in store.objects:
+            pid, format_id = store.objects[key]
+            L.debug(f'{path} has the same content as {pid}; not uploading it again')
+            return pid, md5, size, format_id, True
+        pid, md5, size, format_id = create_data_object(path, md5, size, orcid, client)
+        store.objects[key] = (pid, format_id)
+    return pid, md5, size, format_id, False
+
+
+def create_data_object(path: Path | ArchiveMember, md5: str, size: int, orcid: str, client):
+    """
+    Stream a hashed data file to the Member Node as a new object.
+
+    :param path: The file or archive member.
+    :type path: Path or ArchiveMember
+    :param str md5: The MD5 hex digest of the file.
+    :param int size: The size of the file in bytes.
+    :param str orcid: The rightsHolder.
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :return: The identifier, MD5, size and formatId of the new object.
+    :rtype: tuple
+    """
+    pid = f'urn:uuid:{uuid.uuid4()}'
+    format_id = get_format(path)
+    sysmeta = SysMeta(pid, format_id, size, md5, datetime.datetime.now(), orcid)
+    if getattr(client, 'watchdog', None):
+        # opened again for each attempt, so that a stalled upload can be retried
+        response = client.create(pid, functools.partial(path.open, 'rb'), sysmeta)
+    else:
+        with path.open('rb') as f:
+            response = client.create(pid, f, sysmeta)
+    if not (isinstance(response, dataoneTypes.Identifier) and response.value() == pid):
+        raise exceptions.DataONEException(f'Unexpected response creating {pid} from {path}: {response}')
+    return pid, md5, size, format_id
+
+
+def upload_scheduled(eml_folder: str, data_dir: str, orcid: str, pool, node: str, shard: tuple | None=None,
+                     index=None, data_index=None, small_workers: int=SMALL_WORKERS, large_workers: int=LARGE_WORKERS,
+                     large_size: int=LARGE_SIZE, dedup: bool=True, mirror=None):
+    """
+    Upload packages with their data files through a :py:class:`SizeScheduler`.
+
+    Every data file (``{data_dir}/{package_id}/*``) that is not in the ledger
+    with the same size and modification time is queued first, by size, in
+    the small or large lane. A package's EML and resource map are queued in
+    the small lane as soon as its last data file is uploaded, or straight
+    away if it has none, so packages without large files are not held up by
+    large transfers. A package whose data files fail is not uploaded and is
+    retried on the next run.
+
+    The EML and resource map are only uploaded again if the EML content has
+    changed since the last upload (see :py:func:`fwc_import.plan.classify`),
+    if the package's data identifiers differ from those in its resource map,
+    or, with ``mirror``, if the Member Node does not have them. A data file
+    that changed is uploaded as a new object that obsoletes the old one,
+    unless the old object is still listed by another package or the new
+    content is an object that already exists.
+
+    With ``dedup``, a data file whose content is already on the Member Node
+    (see :py:class:`ContentStore`) is not uploaded again: its package's
+    resource map lists the existing object.
+
+    :param str eml_folder: Path to the folder containing EML files.
+    :param str data_dir: The data file root.
+    :param str orcid: The ORCID of the uploader.
+    :param pool: The Member Node client pool.
+    :type pool: fwc_import.pool.ClientPool
+    :param str node: The node identifier.
+    :param tuple shard: The shard index and shard count, or None.
+    :param index: The directory index of the EML folder, or None.
+    :type index: fwc_import.dirindex.DirIndex or None
+    :param data_index: The directory index of the data file root, or None.
+    :type data_index: fwc_import.dirindex.DirIndex or None
+    :param int small_workers: The number of concurrent small-lane uploads.
+    :param int large_workers: The number of concurrent large-lane uploads.
+    :param int large_size: The size in bytes from which an upload is large.
+    :param bool dedup: Upload each distinct file content only once.
+    :param mirror: The local object mirror, or None (see
+        :py:func:`fwc_import.run_data_upload.is_uploaded`).
+    :type mirror: sqlite3.Connection or None
+    :return: The successful and failed package identifiers.
+    :rtype: tuple
+    """
+    L = getLogger(__name__)
+    register_namespaces()
+    sep = '' if CN_URL.endswith('/') else '/'
+    uploads_loc = uploads_path(node, shard)
+    try:
+        uploads = load_shard_uploads(node, shard) if shard else load_uploads(uploads_loc)
+    except FileNotFoundError:
+        uploads = {}
+    # group the EML files by package, keeping file order within a package
+    packages = {}
+    n, eml_files = list_files(eml_folder, '*.xml', index=index)
+    for eml_path in eml_files:
+        try:
+            root = ET.fromstring(eml_path.read_bytes())
+        except ET.ParseError as e:
+            L.error(f'{eml_path} / {repr(e)}')
+            continue
+        alt_id_elem = root.find('.//alternateIdentifier')
+        package_id = alt_id_elem.text if alt_id_elem is not None else None
+        if not package_id:
+            L.error(f'No packageId found in {eml_path.name}, skipping.')
+            continue
+        if shard and (shard_of(package_id, shard[1]) != shard[0]):
+            continue
+        packages.setdefault(package_id, []).append(eml_path)
+    scheduler = SizeScheduler(small_workers=small_workers, large_workers=large_workers, large_size=large_size)
+    store = ContentStore(uploads) if dedup else None
+    done = queue.Queue()
+    pending = {}
+    nbytes = 0
+    shared_bytes = 0
+    for package_id in packages:
+        entry = uploads.setdefault(package_id, {})
+        known = entry.setdefault('data', {})
+        todo = [(p, size, mtime) for p, size, mtime in package_data_files(data_dir, package_id, index=data_index)
+                if not (known.get(p.name) and (known[p.name]['size'], known[p.name].get('mtime_ns')) == (size, mtime))]
+        pending[package_id] = len(todo)
+        for path, size, mtime in todo:
+            nbytes += size
+            future = scheduler.submit(size, pool.call, upload_data_file, path, orcid, store=store)
+            future.add_done_callback(lambda f, job=('data', package_id, path, mtime): done.put((job, f)))
+    L.info(f'Uploading {len(packages)} packages from {eml_folder} with {sum(pending.values())} data files '
+           f'({nbytes} bytes) from {data_dir}; lanes: {small_workers} small, {large_workers} large '
+           f'(from {large_size} bytes)' + (f'; {len(store)} objects in the content store' if dedup else ''))
+
+    def package_data_pids(package_id: str):
+        with LEDGER_LOCK:
+            # identical files in one package are one object
+            return list(dict.fromkeys(d['identifier'] for d in uploads[package_id].get('data', {}).values()))
+
+    def metadata_current(package_id: str):
+        """
+        Check whether a package's EML and resource map on the node are up
+        to date, so that they need not be uploaded again.
+        """
+        entry = uploads.get(package_id)
+        if package_id in data_changed:
+            return False
+        rm = entry.get('resource_map') if entry else None
+        if rm and ('data' in rm) and (sorted(rm['data']) != sorted(package_data_pids(package_id))):
+            # an earlier run uploaded data objects but not the resource map listing them
+            return False
+        for eml_path in packages[package_id]:
+            if classify(scan_eml(eml_path), entry) != 'unchanged':
+                return False
+            if mirror:
+                eml_string = eml_path.read_text(encoding='utf-8')
+                if not is_uploaded(mirror, entry, eml_string, ET.fromstring(eml_string).attrib.get('packageId')):
+                    return False
+        return True
+
+    def upload_metadata(package_id: str):
+        with LEDGER_LOCK:
+            # old data objects still listed by the package's last resource map were not obsoleted yet
+            listed = (uploads[package_id].get('resource_map') or {}).get('data')
+            replaced = [(d['obsoletes'], d['identifier']) for d in uploads[package_id].get('data', {}).values()
+                        if d.get('obsoletes') and ((listed is None) or (d['obsoletes'] in listed))]
+        for old_pid, new_pid in replaced:
+            L.info(f'{package_id} Adding obsoletedBy to old data object sysmeta: {old_pid}')
+            pool.call(sysmeta_obsolete_updates, old_pid=old_pid, new_pid=new_pid)
+        data_pids = package_data_pids(package_id)
+        for eml_path in packages[package_id]:
+            root = ET.fromstring(eml_path.read_bytes())
+            upload_package(eml_path, root, package_id, orcid, pool, uploads, uploads_loc, data_pids=data_pids)
+
+    def queue_metadata(package_id: str):
+        """
+        Queue a package's EML and resource map, if they changed.
+
+        :return: Whether they were queued.
+        :rtype: bool
+        """
+        if metadata_current(package_id):
+            L.debug(f'{package_id} is unchanged; skipping')
+            unchanged.append(package_id)
+            return False
+        size = sum(p.stat().st_size for p in packages[package_id])
+        future = scheduler.submit(size, upload_metadata, package_id)
+        future.add_done_callback(lambda f, job=('metadata', package_id, None, None): done.put((job, f)))
+        return True
+
+    succ_list, err_list, unchanged = [], [], []
+    failed = set()
+    data_changed = set()
+    outstanding = sum(pending.values()) + len(packages)
+    for package_id, k in pending.items():
+        if (k == 0) and not queue_metadata(package_id):
+            outstanding -= 1
+    scheduler.start()
+    try:
+        while outstanding:
+            (kind, package_id, path, mtime), future = done.get()
+            outstanding -= 1
+            error = future.exception()
+            if kind == 'metadata':
+                if error:
+                    L.error(f'{package_id} / {repr(error)}')
+                    err_list.append(package_id)
+                else:
+                    succ_list.append(package_id)
+                continue
+            if error:
+                L.error(f'{package_id} {path} / {repr(error)}')
+                failed.add(package_id)
+            else:
+                pid, md5, size, format_id, shared = future.result()
+                if shared:
+                    shared_bytes += size
+                    L.info(f'{package_id} data file {path.name} is already on the Member Node: {pid}')
+                else:
+                    L.info(f'{package_id} data file {path.name} uploaded: {pid}')
+                with LEDGER_LOCK:
+                    previous = uploads[package_id]['data'].get(path.name)
+                    old_pid = previous['identifier'] if previous else None
+                    uploads[package_id]['data'][path.name] = {
+                        'filename': path.name,
+                        'size': size,
+                        'mtime_ns': mtime,
+                        'doi': package_id,
+                        'identifier': pid,
+                        'md5': md5,
+                        'formatId': format_id,
+                        'url': f"{CN_URL}{sep}v2/resolve/{pid}",
+                        'shared': shared,
+                        'obsoletes': None,
+                    }
+                    if pid != old_pid:
+                        data_changed.add(package_id)
+                    # an old object that another package still lists, or an existing object that the
+                    # new content matches, is left alone: obsoleting it would change that package too
+                    in_use = old_pid and any(d.get('identifier') == old_pid
+                                             for e in uploads.values() if e for d in (e.get('data') or {}).values())
+                    if old_pid and (pid != old_pid) and not shared and not in_use:
+                        # obsoleted with the package's metadata (see upload_metadata)
+                        uploads[package_id]['data'][path.name]['obsoletes'] = old_pid
+                    elif old_pid and (pid != old_pid):
+                        L.info(f'{package_id} not obsoleting {old_pid}: '
+                               f'{"the new content is an existing object" if shared else "another package lists it"}')
+                    save_uploads(uploads, fp=uploads_loc)
+            pending[package_id] -= 1
+            if pending[package_id] == 0:
+                if package_id in failed:
+                    L.error(f'{package_id} has data files that failed to upload; not uploading its metadata')
+                    err_list.append(package_id)
+                    outstanding -= 1
+                elif not queue_metadata(package_id):
+                    outstanding -= 1
+    except KeyboardInterrupt:
+        L.info('Caught KeyboardInterrupt; waiting for uploads in progress and generating report...')
+        for lane in (scheduler.small, scheduler.large):
+            while not lane.queue.empty():
+                _, _, job = lane.queue.get_nowait()
+                job[0].cancel()
+    finally:
+        scheduler.shutdown()
+        if unchanged:
+            L.info(f'Skipped {len(unchanged)} packages whose EML, resource map and data files are unchanged')
+        if shared_bytes:
+            L.info(f'{shared_bytes} bytes of data files were already on the Member Node and were not uploaded again')
+        with LEDGER_LOCK:
+            save_uploads(uploads, fp=uploads_loc)
+        report(succ=len(succ_list), fail=len(err_list), finished_dois=succ_list, failed_dois=err_list)
+    return succ_list, err_list
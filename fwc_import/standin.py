@@ -0,0 +1,241 @@
+import gzip
+import uuid
+import hashlib
+import datetime
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from logging import getLogger
+from time import sleep
+
+
+class StandInMemberNode:
+    """
+    A local stand-in for a DataONE Member Node, for benchmarks and tests.
+
+    It implements only the calls fwc-import makes (``ping``,
+    ``generateIdentifier``, ``create``, ``getSystemMetadata``,
+    ``updateSystemMetadata``, ``listObjects`` and ``describe``) and keeps the objects in memory.
+    Authentication is not checked. Request bodies sent with
+    ``Content-Encoding: gzip`` are decompressed, or, with ``gzip=False``,
+    rejected with ``415 Unsupported Media Type``.
+
+    Usage::
+
+        with StandInMemberNode() as mn:
+            client = create_client(mn.base_url, 'token')
+
+    :param float latency: Seconds to wait before answering each request, to
+        approximate a remote Member Node.
+    :param str host: The address to listen on.
+    :param int port: The port to listen on; 0 picks a free port.
+    :param bool gzip: Accept gzip-compressed request bodies.
+    """
+    def __init__(self, latency: float=0.0, host: str='127.0.0.1', port: int=0, gzip: bool=True):
+        self.latency = latency
+        self.gzip = gzip
+        self.objects = {}
+        self.sysmeta = {}
+        self.requests = 0
+        self.gzip_requests = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """
+        The Member Node base URL, e.g. ``http://127.0.0.1:8765/mn/``.
+        """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/mn/'
+
+    def start(self):
+        """
+        Start serving on a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        getLogger(__name__).debug(f'Stand-in Member Node listening at {self.base_url}')
+        return self
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _handler(mn: StandInMemberNode):
+    """
+    Make the request handler class for a stand-in Member Node.
+    """
+    from d1_common.types import dataoneTypes, exceptions
+
+    def now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            getLogger(__name__).debug(format % args)
+
+        def route(self):
+            with mn.lock:
+                mn.requests += 1
+            if mn.latency:
+                sleep(mn.latency)
+            url = urlsplit(self.path)
+            parts = [unquote(p) for p in url.path.split('/') if p]
+            # drop the /mn/v2 prefix
+            return parts[2:], {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        def fields(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with mn.lock:
+                mn.bytes_received += len(body)
+            if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+                if not mn.gzip:
+                    self.send(b'Content-Encoding gzip is not supported', status=415, content_type='text/plain')
+                    return None
+                body = gzip.decompress(body)
+                with mn.lock:
+                    mn.gzip_requests += 1
+            head = f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode('utf-8')
+            msg = BytesParser(policy=HTTP).parsebytes(head + body)
+            return {p.get_param('name', header='content-disposition'): p.get_payload(decode=True)
+                    for p in msg.iter_parts()}
+
+        def send(self, body: bytes, status: int=200, content_type: str='text/xml', headers: dict={}):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def send_pyxb(self, obj):
+            self.send(obj.toxml('utf-8'))
+
+        def send_error_d1(self, e: exceptions.DataONEException):
+            if self.command == 'HEAD':
+                self.send(b'', status=e.errorCode, headers=e.serialize_to_headers())
+            else:
+                self.send(e.serialize_to_transport(), status=e.errorCode)
+
+        def do_GET(self):
+            parts, query = self.route()
+            if parts == ['monitor', 'ping']:
+                return self.send(b'', content_type='text/plain')
+            if parts == ['object']:
+                return self.list_objects(query)
+            if (len(parts) == 2) and (parts[0] == 'meta'):
+                sm = mn.sysmeta.get(parts[1])
+                if sm is None:
+                    return self.send_error_d1(exceptions.NotFound(0, f'No object with PID {parts[1]}'))
+                return self.send_pyxb(sm)
+            if (len(parts) == 2) and (parts[0] == 'object'):
+                if parts[1] not in mn.objects:
+                    return self.send_error_d1(exceptions.NotFound(0, f'No object with PID {parts[1]}'))
+                return self.send(mn.objects[parts[1]], content_type='application/octet-stream')
+            self.send_error_d1(exceptions.NotImplemented(0, f'{self.command} {self.path}'))
+
+        def do_HEAD(self):
+            parts, _ = self.route()
+            if (len(parts) == 2) and (parts[0] == 'object'):
+                sm = mn.sysmeta.get(parts[1])
+                if sm is None:
+                    return self.send_error_d1(exceptions.NotFound(0, f'No object with PID {parts[1]}'))
+                return self.send(b'', content_type=str(sm.formatId), headers={
+                    'DataONE-FormatId': str(sm.formatId),
+                    'DataONE-Checksum': f'{sm.checksum.algorithm},{sm.checksum.value()}',
+                    'DataONE-SerialVersion': str(sm.serialVersion or 1),
+                    'Last-Modified': sm.dateSysMetadataModified.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+                    'X-Object-Size': str(sm.size),
+                })
+            self.send_error_d1(exceptions.NotImplemented(0, f'{self.command} {self.path}'))
+
+        def do_POST(self):
+            parts, _ = self.route()
+            fields = self.fields()
+            if fields is None:
+                return
+            if parts == ['generate']:
+                fragment = (fields.get('fragment') or b'').decode('utf-8')
+                return self.send_pyxb(dataoneTypes.identifier(f'{fragment}{uuid.uuid4()}'))
+            if parts == ['object']:
+                pid = fields['pid'].decode('utf-8')
+                if pid in mn.objects:
+                    return self.send_error_d1(exceptions.IdentifierNotUnique(0, f'PID {pid} is already in use', pid))
+                sm = dataoneTypes.CreateFromDocument(fields['sysmeta'])
+                obj = fields['object']
+                if hashlib.md5(obj).hexdigest() != sm.checksum.value():
+                    return self.send_error_d1(exceptions.InvalidSystemMetadata(0, f'Checksum mismatch for {pid}'))
+                t = now()
+                sm.serialVersion = 1
+                sm.dateUploaded = sm.dateUploaded or t
+                sm.dateSysMetadataModified = t
+                with mn.lock:
+                    mn.objects[pid] = obj
+                    mn.sysmeta[pid] = sm
+                return self.send_pyxb(dataoneTypes.identifier(pid))
+            self.send_error_d1(exceptions.NotImplemented(0, f'{self.command} {self.path}'))
+
+        def do_PUT(self):
+            parts, _ = self.route()
+            fields = self.fields()
+            if fields is None:
+                return
+            if parts == ['meta']:
+                pid = fields['pid'].decode('utf-8')
+                if pid not in mn.sysmeta:
+                    return self.send_error_d1(exceptions.NotFound(0, f'No object with PID {pid}'))
+                sm = dataoneTypes.CreateFromDocument(fields['sysmeta'])
+                sm.serialVersion = (mn.sysmeta[pid].serialVersion or 1) + 1
+                sm.dateSysMetadataModified = now()
+                with mn.lock:
+                    mn.sysmeta[pid] = sm
+                return self.send(b'')
+            self.send_error_d1(exceptions.NotImplemented(0, f'{self.command} {self.path}'))
+
+        def list_objects(self, query: dict):
+            start = int(query.get('start', 0))
+            count = int(query.get('count', 1000))
+            from_date = query.get('fromDate')
+            objs = sorted(mn.sysmeta.values(), key=lambda sm: sm.dateSysMetadataModified)
+            if from_date:
+                from_date = datetime.datetime.fromisoformat(from_date.replace('Z', '+00:00'))
+                if from_date.tzinfo is None:
+                    from_date = from_date.replace(tzinfo=datetime.timezone.utc)
+                objs = [sm for sm in objs if sm.dateSysMetadataModified >= from_date]
+            page = objs[start:start + count]
+            ol = dataoneTypes.objectList()
+            for sm in page:
+                info = dataoneTypes.ObjectInfo()
+                info.identifier = sm.identifier
+                info.formatId = sm.formatId
+                info.checksum = sm.checksum
+                info.dateSysMetadataModified = sm.dateSysMetadataModified
+                info.size = sm.size
+                ol.objectInfo.append(info)
+            ol.start = start
+            ol.count = len(page)
+            ol.total = len(objs)
+            self.send_pyxb(ol)
+
+    return Handler
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import datetime
+from functools import lru_cache
+from xml.sax.saxutils import escape, quoteattr
+
+from .utils import get_config
+
+SYSMETA_NS = 'http://ns.dataone.org/service/types/v2.0'
+"""
+The DataONE v2 types namespace.
+"""
+
+SYSMETA_TEMPLATE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    f'<ns1:systemMetadata xmlns:ns1="{SYSMETA_NS}">'
+    '<identifier>{pid}</identifier>'
+    '<formatId>{format_id}</formatId>'
+    '<size>{size}</size>'
+    '<checksum algorithm="MD5">{md5}</checksum>'
+    '{fixed}'
+    '<dateUploaded>{now}</dateUploaded>'
+    '<dateSysMetadataModified>{now}</dateSysMetadataModified>'
+    '</ns1:systemMetadata>'
+)
+"""
+The system metadata document, in the element order and form that pyxb
+writes for :py:func:`fwc_import.run_data_upload.generate_sys_meta`.
+``{fixed}`` is the rightsHolder and access policy, which are the same for
+every object in a run.
+"""
+
+PERMISSIONS = [('read_groups', 'read'), ('write_groups', 'write'), ('changePermission_groups', 'changePermission')]
+"""
+The config keys of the access policy groups, and the permission each gets.
+"""
+
+
+def format_datetime(dt: datetime.datetime):
+    """
+    Format a datetime as pyxb does for ``xs:dateTime``: aware times are
+    converted to UTC and written with ``Z``, and trailing zeros are dropped
+    from the fraction of a second.
+
+    :param datetime.datetime dt: The time.
+    :rtype: str
+    """
+    suffix = ''
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        suffix = 'Z'
+    s = dt.strftime('%Y-%m-%dT%H:%M:%S')
+    if dt.microsecond:
+        s += '.' + f'{dt.microsecond:06d}'.rstrip('0')
+    return s + suffix
+
+
+def access_policy_xml(config: dict):
+    """
+    Serialize the access policy from the config groups, as
+    :py:func:`fwc_import.utils.generate_access_policy` builds it. Returns an
+    empty string when there are no groups, since an empty ``accessPolicy`` is
+    not valid.
+
+    :param dict config: The config dictionary.
+    :rtype: str
+    """
+    rules = ''.join(f'<allow><subject>{escape(group)}</subject><permission>{permission}</permission></allow>'
+                    for key, permission in PERMISSIONS for group in config.get(key) or [])
+    return f'<accessPolicy>{rules}</accessPolicy>' if rules else ''
+
+
+@lru_cache(maxsize=None)
+def fixed_block(orcid: str):
+    """
+    Serialize the rightsHolder and the access policy once per run (per
+    ORCID). Call ``fixed_block.cache_clear()`` after changing the groups in
+    the config.
+
+    :param str orcid: The rightsHolder.
+    :rtype: str
+    """
+    return f'<rightsHolder>{escape(orcid)}</rightsHolder>{access_policy_xml(get_config())}'
+
+
+class SysMeta:
+    """
+    A system metadata document filled in from :py:data:`SYSMETA_TEMPLATE`.
+    It can be passed to ``MemberNodeClient_2_0.create`` in place of a pyxb
+    ``systemMetadata``, since the client only calls ``toxml``.
+
+    :param str pid: The object identifier.
+    :param str format_id: The format of the object.
+    :param int size: The size of the object in bytes.
+    :param str md5: The MD5 hex digest of the object.
+    :param datetime.datetime now: The upload time.
+    :param str orcid: The rightsHolder.
+    """
+    def __init__(self, pid: str, format_id: str, size: int, md5: str, now: datetime.datetime, orcid: str):
+        self.size = int(size)
+        self.xml = SYSMETA_TEMPLATE.format(
+            pid=escape(str(pid)),
+            format_id=escape(format_id),
+            size=int(size),
+            md5=escape(str(md5)),
+            fixed=fixed_block(orcid),
+            now=format_datetime(now),
+        ).encode('utf-8')
+
+    def toxml(self, encoding: str='utf-8'):
+        """
+        Get the serialized document.
+
+        :param str encoding: The encoding.
+        :rtype: bytes
+        """
+        if encoding.lower() in ('utf-8', 'utf8'):
+            return self.xml
+        return self.xml.decode('utf-8').replace('encoding="utf-8"', f'encoding={quoteattr(encoding)}', 1).encode(encoding)
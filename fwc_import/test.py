@@ -1,34 +1,227 @@
+import json
 import unittest
-from fwc_import.conv import fwc_to_eml
+import xml.etree.ElementTree as ET
+from pathlib import Path
 
-class TestFWCToEML(unittest.TestCase):
+from fwc_import.conv import build_eml, write_pretty_xml
+from fwc_import.utils import get_lat_lon
+
+CROSSWALK_FILE = Path(__file__).parent.joinpath('manifest', 'fwc_crosswalk.json')
+
+
+class TestBuildEML(unittest.TestCase):
     def setUp(self):
         """
-        Set up the test case with the test article.
+        Set up the test case with the test record and the crosswalk.
         """
-        self.test_article = TEST_ARTICLE
+        import pandas as pd
+        self.row = pd.Series(TEST_RECORD)
+        with open(CROSSWALK_FILE) as f:
+            self.crosswalk = json.load(f)
 
     def test_conversion_to_eml(self):
         """
-        Test the conversion of a FWC article to EML.
+        Test the conversion of a FWC record to EML.
         """
-        # Perform the conversion
-        eml_result = fwc_to_eml(self.test_article)
-        # Verify the conversion
+        eml_root, id = build_eml(self.row, self.crosswalk, 'records_to_fwri.xlsx')
+        self.assertEqual(id, 'fwc-fwri.478.1')
+        eml_result = ET.tostring(eml_root, encoding='unicode')
         self.assertIn('<eml:eml', eml_result)
         self.assertIn('<dataset>', eml_result)
-        self.assertIn('<title>', eml_result)
-        self.assertIn(self.test_article['title'], eml_result)
-        self.assertIn('<creator>', eml_result)
-        self.assertIn(self.test_article['authors'][0]['full_name'], eml_result)
-        self.assertIn('<abstract>', eml_result)
-        self.assertIn(self.test_article['description'], eml_result)
-        if 'keywords' in self.test_article:
-            for keyword in self.test_article['keywords']:
-                self.assertIn(keyword, eml_result)
-        self.assertIn('<pubDate>', eml_result)
-        self.assertIn(self.test_article['publication_date'], eml_result)
+        self.assertEqual(eml_root.find('dataset/title').text, TEST_RECORD['Title'])
+        self.assertEqual(eml_root.find('dataset/alternateIdentifier').text, id)
+        self.assertEqual(eml_root.find('dataset/creator/individualName/surName').text, 'Smith')
+        self.assertEqual(eml_root.find('dataset/creator/organizationName').text, 'Habitat Research')
+        self.assertEqual(eml_root.find('dataset/pubDate').text, '2019-06-01')
+        self.assertEqual(len(eml_root.findall('dataset/abstract/para')), 2)
+        self.assertIsNotNone(eml_root.find('dataset/coverage/temporalCoverage/rangeOfDates'))
+
+    def test_bounding_box(self):
+        """
+        Test that a bounding box found in the record text fills empty
+        bounding coordinate columns.
+        """
+        import pandas as pd
+        bbox = pd.Series({'WestBC': -82.6, 'EastBC': -82.5, 'NorthBC': 27.9, 'SouthBC': 27.8})
+        eml_root, _ = build_eml(self.row, self.crosswalk, 'records_to_fwri.xlsx', bbox=bbox)
+        bc = eml_root.find('dataset/coverage/geographicCoverage/boundingCoordinates')
+        self.assertEqual(bc.find('westBoundingCoordinate').text, '-82.600000')
+        self.assertEqual(bc.find('northBoundingCoordinate').text, '27.900000')
+
+    def test_write_pretty_xml(self):
+        """
+        Test that the written EML parses back to the same document.
+        """
+        import tempfile
+        eml_root, _ = build_eml(self.row, self.crosswalk, 'records_to_fwri.xlsx')
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = Path(tmp, 'eml.xml')
+            write_pretty_xml(eml_root, fp)
+            root = ET.parse(fp).getroot()
+        self.assertEqual(root.find('dataset/title').text, TEST_RECORD['Title'])
+
+
+class TestSysMeta(unittest.TestCase):
+    def test_template_matches_pyxb(self):
+        """
+        Test that the templated system metadata is the same document as the
+        one pyxb builds, for identifiers that need escaping and for naive and
+        aware upload times.
+        """
+        import datetime
+        from unittest import mock
+        from d1_common.types import dataoneTypes
+        from fwc_import.run_data_upload import generate_sys_meta
+        from fwc_import.sysmeta import SysMeta, fixed_block
+        orcid = 'http://orcid.org/0000-0001-5828-6070'
+        # fixed groups instead of the developer's config file
+        config = {'read_groups': ['public'], 'write_groups': ['CN=Test_Group,DC=dataone,DC=org'],
+                  'changePermission_groups': ['CN=Test_Group,DC=dataone,DC=org']}
+        patcher = mock.patch.multiple('fwc_import.utils', CONFIG=config, CONFIG_LOADED=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        fixed_block.cache_clear()
+        self.addCleanup(fixed_block.cache_clear)
+        cases = [
+            ('urn:uuid:1d2f', 'https://eml.ecoinformatics.org/eml-2.2.0', 4021,
+             datetime.datetime(2025, 3, 1, 12, 30, 5, 250000)),
+            ('resource_map_urn:uuid:a&b<c>"d"', 'http://www.openarchives.org/ore/terms', 0,
+             datetime.datetime(2025, 3, 1, 12, 30, 5)),
+            ('urn:uuid:7e', 'text/csv', 2**40,
+             datetime.datetime(2025, 3, 1, 7, 0, 0, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=-5)))),
+        ]
+        for pid, format_id, size, now in cases:
+            with self.subTest(pid=pid):
+                md5 = '900150983cd24fb0d6963f7d28e17f72'
+                expected = generate_sys_meta(pid, None, format_id, size, md5, now, orcid).toxml('utf-8')
+                result = SysMeta(pid, format_id, size, md5, now, orcid).toxml('utf-8')
+                self.assertEqual(ET.canonicalize(result.decode('utf-8')), ET.canonicalize(expected.decode('utf-8')))
+                parsed = dataoneTypes.CreateFromDocument(result)
+                self.assertEqual(parsed.identifier.value(), pid)
+                self.assertEqual(parsed.size, size)
+
+
+class TestWatchdog(unittest.TestCase):
+    def test_stalled_calls(self):
+        """
+        Test that a read that stalls past its deadline is answered by the
+        hedged duplicate, and that a stalled write that the node already has
+        is not sent again.
+        """
+        import time
+        import threading
+        from fwc_import.hedge import Watchdog
+        wd = Watchdog(floor=0.05, min_samples=3)
+        for _ in range(3):
+            wd.record('read', 0.001)
+            wd.record('write', 0.001)
+        release = threading.Event()
+        calls = []
 
+        def stall_first(x):
+            calls.append(x)
+            if len(calls) == 1:
+                release.wait(5)
+            return x
+        start = time.monotonic()
+        self.assertEqual(wd.read('read', stall_first, 'a'), 'a')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual((len(calls), wd.hedged), (2, 1))
+        calls.clear()
+        self.assertEqual(wd.write('write', stall_first, ('b',), {}, applied=lambda: 'b', retryable=True), 'b')
+        self.assertEqual((len(calls), wd.abandoned), (1, 1))
+        release.set()
+
+    def test_stalled_stream(self):
+        """
+        Test that a stalled upload whose body is given as a function is sent
+        again with a freshly opened stream.
+        """
+        import io
+        import threading
+        from types import SimpleNamespace
+        from d1_common.types import exceptions
+        from fwc_import.hedge import Watchdog, enable_watchdog
+        wd = Watchdog(floor=0.05, min_samples=3)
+        for _ in range(3):
+            wd.record('create:3', 0.001)
+        release = threading.Event()
+        streams = []
+
+        def create(pid, obj, sysmeta_pyxb, vendorSpecific=None):
+            streams.append(obj)
+            if len(streams) == 1:
+                release.wait(5)
+            return obj.read()
+
+        def describe(pid):
+            raise exceptions.NotFound(0, 'not found')
+        client = SimpleNamespace(create=create, update=None, updateSystemMetadata=None, describe=describe,
+                                 getSystemMetadata=None, get=None, getChecksum=None, listObjects=None)
+        enable_watchdog(client, wd)
+        body = client.create('pid', lambda: io.BytesIO(b'data'), SimpleNamespace(size=4))
+        self.assertEqual((body, len(streams), wd.abandoned), (b'data', 2, 1))
+        self.assertIsNot(streams[0], streams[1])
+        self.assertTrue(streams[1].closed)
+        release.set()
+
+
+class TestGovernor(unittest.TestCase):
+    def test_profiles_and_bucket(self):
+        """
+        Test that the first matching time-of-day profile sets the limits,
+        including one that runs past midnight, and that a token bucket holds
+        its rate after the burst.
+        """
+        import time
+        import datetime
+        from fwc_import.governor import TokenBucket, profile_limits
+        settings = {'bytes_per_second': 1000, 'requests_per_second': 5, 'profiles': [
+            {'days': ['Sat', 'Sun'], 'bytes_per_second': None},
+            {'start': '19:00', 'end': '07:00', 'bytes_per_second': 8000, 'requests_per_second': 20},
+        ]}
+        monday = datetime.datetime(2026, 10, 19)
+        self.assertEqual(profile_limits(settings, monday.replace(hour=12)), (1000, 5))
+        self.assertEqual(profile_limits(settings, monday.replace(hour=23)), (8000, 20))
+        self.assertEqual(profile_limits(settings, monday.replace(hour=6, minute=59)), (8000, 20))
+        self.assertEqual(profile_limits(settings, monday.replace(day=24, hour=12)), (None, 5))
+        bucket = TokenBucket(rate=100, burst=0.1)
+        start = time.monotonic()
+        for _ in range(30):
+            bucket.take(1)
+        self.assertGreater(time.monotonic() - start, 0.15)
+
+
+class TestGetLatLon(unittest.TestCase):
+    def test_coordinate_formats(self):
+        """
+        Test that every coordinate format in the test article description is
+        found. The pair that appears twice is reported once.
+        """
+        found = {(round(c.lat, 4), round(c.lon, 4)) for c in get_lat_lon(TEST_ARTICLE['description'])}
+        self.assertEqual(found, {
+            (8.6457, -79.0481), (8.9944, -79.543), (8.9107, -79.5289), (7.6404, -81.7013),
+            (9.1618, -79.8377), (-0.6833, -76.4), (7.6963, -81.616),
+        })
+
+
+TEST_RECORD = {
+    'Title': 'Tampa Bay seagrass survey',
+    'PrincipalInvestigator': 'John Smith',
+    'SubunitID': '4',
+    'Contact': 'john.smith@myfwc.com',
+    'PubDate': '2019-06-01 00:00:00',
+    'Description': 'Seagrass survey of Tampa Bay.\nTransects sampled annually.',
+    'ProjectURL': '',
+    'DatasetURL': 'https://myfwc.com/research/dataset/478',
+    'StudyArea': 'Tampa Bay',
+    'DatasetID': '478',
+    'StartDate': '2010-01-01 00:00:00',
+    'EndDate': '2019-12-31 00:00:00',
+}
+"""
+An example FWC record.
+"""
 
 TEST_ARTICLE = {
       "files": [
@@ -1,17 +1,21 @@
+from __future__ import annotations
+
 import json
 import re
-from pygeodesy.namedTuples import LatLon3Tuple
-from logging import getLogger
-
-from d1_client.mnclient_2_0 import MemberNodeClient_2_0
-from d1_common.types import dataoneTypes
-from d1_common import const
+import hashlib
+from typing import TYPE_CHECKING
 
 from pathlib import Path
 from logging import getLogger
 from datetime import datetime, timedelta
 
-from .defs import GROUP_ID, CN_URL, CONFIG_LOC, CONFIG
+from .defs import GROUP_ID, CN_URL, CONFIG_LOC, CONFIG, WORK_LOC
+from .logs import Lazy
+
+# the d1 client stack and pygeodesy are slow to import, so they are imported
+# in the functions that need them
+if TYPE_CHECKING:
+    from d1_client.mnclient_2_0 import MemberNodeClient_2_0
 
 
 def get_token():
@@ -40,17 +44,28 @@ def get_ll_token():
         return tf.read().split('\n')[0]
 
 
-def get_config():
+CONFIG_LOADED = False
+"""
+Whether ``{CONFIG_LOC}/config.json`` has been read by :py:func:`get_config`.
+"""
+
+
+def get_config(reload: bool=False):
     """
     Config values not including the DataONE token are stored in
-    ``{CONFIG_LOC}/config.json``.
+    ``{CONFIG_LOC}/config.json``. The file is read on the first call and the
+    result is reused afterwards.
 
+    :param bool reload: Read the config file again even if it has been read.
     :return: The ORCID, node identifier, Member Node URL, and metadata JSON file.
     :rtype: tuple
     """
     global DATA_ROOT
     global CN_URL
     global CONFIG
+    global CONFIG_LOADED
+    if CONFIG_LOADED and not reload:
+        return CONFIG
     # Set your ORCID
     CONFIG_F = CONFIG_LOC.joinpath('config.json')
     with open(CONFIG_F, 'r') as lc:
@@ -58,25 +73,55 @@ def get_config():
     # set the data root and CN URL
     DATA_ROOT = Path(config['data_root'])
     CN_URL = config['cnurl'] if config.get('cnurl') else CN_URL
-    config['metadata_loc'] = str(Path(config['metadata_loc']).expanduser().absolute())
+    if config.get('metadata_loc'):
+        config['metadata_loc'] = str(Path(config['metadata_loc']).expanduser().absolute())
     CONFIG = config
+    CONFIG_LOADED = True
     return config
 
 
-def create_client(mn_url: str, auth_token: str):
+def create_client(mn_url: str, auth_token: str, gzip: bool | None=None, watchdog: bool | None=None,
+                  governor: bool | None=None):
     """
     Instantiate a DataONE Member Node client.
 
     :param str mn_url: The URL of the Member Node.
     :param str auth_token: The authentication token.
+    :param bool gzip: Send ``create`` and ``update`` bodies gzip-compressed
+        (see :py:mod:`fwc_import.compress`). Defaults to ``gzip_uploads`` in
+        the config file.
+    :param bool watchdog: Hedge stalled reads and check for and retry stalled
+        writes (see :py:mod:`fwc_import.hedge`), with an HTTP read timeout of
+        ``watchdog_timeout`` seconds. Defaults to ``watchdog`` in the config
+        file.
+    :param bool governor: Limit the upload bytes and requests per second
+        (see :py:mod:`fwc_import.governor`). Defaults to ``governor`` in the
+        config file.
     :return: The Member Node client.
     :rtype: MemberNodeClient_2_0
     """
+    from d1_client.mnclient_2_0 import MemberNodeClient_2_0
+    watchdog = get_config().get('watchdog') if watchdog is None else watchdog
     options: dict = {
         "headers": {"Authorization": "Bearer " + auth_token},
         "timeout_sec": 9999,
         }
-    return MemberNodeClient_2_0(mn_url, **options)
+    if watchdog:
+        # a stalled call can only be given up on if it eventually fails
+        from .hedge import TIMEOUT
+        options["timeout_sec"] = get_config().get('watchdog_timeout', TIMEOUT)
+    client = MemberNodeClient_2_0(mn_url, **options)
+    if get_config().get('gzip_uploads') if gzip is None else gzip:
+        from .compress import enable_gzip
+        enable_gzip(client, **get_config().get('gzip_options', {}))
+    if get_config().get('governor') if governor is None else governor:
+        # before the watchdog, so that its retries are governed too
+        from .governor import enable_governor, get_governor
+        enable_governor(client, get_governor(fp=get_config().get('governor_file')))
+    if watchdog:
+        from .hedge import enable_watchdog, get_watchdog
+        enable_watchdog(client, get_watchdog(**get_config().get('watchdog_options', {})))
+    return client
 
 
 def parse_name(fullname: str):
@@ -106,10 +151,11 @@ def parse_name(fullname: str):
         for q in [' del ', ' van ', ' de ', ' von ', ' der ', ' di ', ' la ', ' le ', ' da ', ' el ', ' al ', ' bin ']:
             if q in fullname.lower():
                 # split the fullname by the query string, assign the given name and family name
-                [given, family] = fullname.lower().split(q)
+                [given, family] = fullname.lower().split(q, 1)
                 # capitalize the and concat the query string to the family name
                 given = given.title()
                 family = f'{q.strip()} {family.title()}'
+                break
     if (given == None) and (family == None):
         # split the fullname by space and capitalize each part
         nlist = fullname.title().split()
@@ -186,6 +232,10 @@ def get_lat_lon(desc: str):
     This function extracts latitude and longitude pairs from a given description string.
     It supports various formats of location strings and converts them to decimal degrees.
     The function returns all pairs found as a list of LatLon3Tuple objects.
+    The description is scanned once with
+    :py:func:`fwc_import.coords.find_coordinates`; to scan a whole column of
+    records, use :py:func:`fwc_import.coords.scan_coordinates` (or
+    :py:func:`fwc_import.coords.bounding_boxes`) instead.
 
     Supported formats:
     
@@ -199,61 +249,20 @@ def get_lat_lon(desc: str):
 
     :param desc: The description string containing latitude and longitude information.
     :type desc: str
-    :returns: A list of LatLon3Tuple objects representing the extracted latitude and longitude pairs, or None if no pairs are found.
+    :returns: A list of LatLon3Tuple objects representing the extracted latitude and longitude pairs (empty if none parse), or None if the description has no coordinate markers.
     :rtype: list of LatLon3Tuple or None
     """
+    from pygeodesy.namedTuples import LatLon3Tuple
+    from .coords import find_coordinates
     L = getLogger(__name__)
-    patterns = [
-        r'\b([+-]?\d+(\.\d+)?)°?\s*,\s*([+-]?\d+(\.\d+)?)°?\b',  # 8.994410°, - 79.543000°
-        r'\b([+-]?\d+(\.\d+)?)°?\s*([NS]),\s*([+-]?\d+(\.\d+)?)°?\s*([EW])\b',  # 8.910718°N, -79.528919°
-        r'\b(\d+)°\s*(\d+(\.\d+)?)\'?\s*([NS]),\s*(\d+)°\s*(\d+(\.\d+)?)\'?\s*([EW])\b',  # 7° 38.422'N, 81° 42.079'W
-        r'\b(\d+)°\s*(\d+)\'\s*(\d+(\.\d+)?)\"?\s*([NS]),\s*(\d+)°\s*(\d+)\'\s*(\d+(\.\d+)?)\"?\s*([EW])\b',  # 9°9'42.36"N, 79°50'15.67"W
-        r'\b(\d+)°\s*(\d+)′\s*([NS])\s*latitude,\s*(\d+)°\s*(\d+)′\s*([EW])\s*longitude\b',  # 0°41′ S latitude, 76°24′ W longitude
-        r'\b(\d+)°\s*(\d+(\.\d+)?)\'?\s*([NS])\s+(\d+)°\s*(\d+(\.\d+)?)\'?\s*([EW])\b',  # 8° 38.743'N    79° 2.887'W
-        r'\bLocation:\s*([+-]?\d+(\.\d+)?)\s+([+-]?\d+(\.\d+)?)\b'  # Location: 7.69633 -81.61603
-    ]
-    latlon = []
-    if ('°' in desc) or ('Location:' in desc):
-        for pattern in patterns:
-            matches = re.findall(pattern, desc)
-            for match in matches:
-                L.info(f'Match list: {match}')
-                if len(match) == 4:
-                    # Decimal degrees format
-                    lat = float(match[0])
-                    lon = float(match[2])
-                    L.info(f'Found decimal degrees; lat, lon: {lat}, {lon}')
-                    latlon.append(LatLon3Tuple(lat, lon, 0))
-                elif len(match) == 6 and 'latitude' in desc and 'longitude' in desc:
-                    # Degrees and minutes with direction (special format)
-                    lat = dm_to_decimal(match[0], match[1], match[2])
-                    lon = dm_to_decimal(match[3], match[4], match[5])
-                    L.info(f'Found degrees and minutes; lat, lon: {lat}, {lon}')
-                    latlon.append(LatLon3Tuple(lat, lon, 0))
-                elif len(match) == 6:
-                    # Decimal degrees with direction
-                    lat = float(match[0]) * (-1 if match[2] == 'S' else 1)
-                    lon = float(match[3]) * (-1 if match[5] == 'W' else 1)
-                    L.info(f'Found directional decimal degrees; lat, lon: {lat}, {lon}')
-                    latlon.append(LatLon3Tuple(lat, lon, 0))
-                elif len(match) == 8:
-                    # Degrees and decimal minutes with direction
-                    lat = dms_to_decimal(match[0], match[1], 0, match[3])
-                    lon = dms_to_decimal(match[4], match[5], 0, match[7])
-                    L.info(f'Found DDM; lat, lon: {lat}, {lon}')
-                    latlon.append(LatLon3Tuple(lat, lon, 0))
-                elif len(match) == 10:
-                    # Degrees, minutes, and seconds with direction
-                    lat = dms_to_decimal(match[0], match[1], match[2], match[4])
-                    lon = dms_to_decimal(match[5], match[6], match[7], match[9])
-                    L.info(f'Found DMS; lat, lon: {lat}, {lon}')
-                    latlon.append(LatLon3Tuple(lat, lon, 0))
-        # consolidate duplicates
-        latlon = list(set(latlon))
-        return latlon
-    else:
-        L.info('No lat/lon pairs found in description.')
+    found = find_coordinates(desc)
+    if found is None:
+        L.debug('No lat/lon pairs found in description.')
         return None
+    # consolidate duplicates
+    latlon = list(set(LatLon3Tuple(lat, lon, 0) for lat, lon in found))
+    L.debug(f'Found {len(latlon)} lat/lon pairs in description.')
+    return latlon
 
 
 def pathify(title: str):
@@ -289,64 +298,53 @@ def rectify_uploads(uploads: Path | str, client: MemberNodeClient_2_0 | None=Non
         uploads = Path(uploads)
     if not uploads.exists():
         raise FileNotFoundError(f'Could not find an uploads info json file at {uploads}')
+    config = get_config()
     if not client:
-        config = get_config()
-        mn_url = config['mnurl']
-        options: dict = {
-            "headers": {"Authorization": "Bearer " + get_token()},
-            "timeout_sec": 9999,
-            }
-        client = MemberNodeClient_2_0(mn_url, **options)
+        client = create_client(config['mnurl'], get_token())
     uploads_dict = load_uploads(uploads)
-    uploads_dict = get_d1_ids(uploads_dict, client)
+    uploads_dict = get_d1_ids(uploads_dict, client, node=config['nodeid'])
     client._session.close()
     save_uploads(uploads_dict, fp=uploads)
     return uploads_dict
 
 
-def get_d1_ids(filedict: dict, client: MemberNodeClient_2_0):
+def get_d1_ids(filedict: dict, client: MemberNodeClient_2_0, node: str | None=None):
     """
     Retrieve DataONE object identifiers for hashed files in a file dictionary.
-    This function uses a :py:mod:`d1_client.mnclient_2_0.MemberNodeClient_2_0`
-    client to retrieve a list of objects from the Member Node and updates the
-    file dictionary with the object identifiers, formatIds, and URLs.
+    This function brings the local object mirror
+    (:py:mod:`fwc_import.mirror`) up to date using a
+    :py:mod:`d1_client.mnclient_2_0.MemberNodeClient_2_0` client, then looks
+    up each MD5 in the mirror and updates the file dictionary with the object
+    identifiers, formatIds, and URLs.
 
     :param dict filedict: A dictionary containing file information.
     :param MemberNodeClient_2_0 client: A DataONE MemberNodeClient_2_0 object.
+    :param str node: The node identifier used to name the mirror. Defaults to
+        ``nodeid`` in the config file.
     :return: A dictionary with updated file information including identifiers, formatIds, and URLs.
     :rtype: dict
     """
+    from .mirror import open_mirror, sync_mirror, find_by_checksum
     L = getLogger(__name__)
     sep = '' if CN_URL.endswith('/') else '/'
+    conn = open_mirror(node or get_config()['nodeid'])
     try:
-        object_list = client.listObjects(start=0, count=1)
-        tot = object_list.total
-        L.info(f'Total number of objects in MN {client.base_url}: {tot}')
-        object_list_list = []
-        object_list_list.append(client.listObjects(start=0, count=tot))
-        if not (object_list_list[0].total == tot):
-            L.info(f'Got {object_list_list[0].total} of {tot} objects, requesting the rest...')
-            object_list_list.append([client.listObjects(start=i, count=tot) for i in range(object_list_list[0].count, tot, object_list_list[0].count)])
-            L.info('Done.')
+        sync_mirror(conn, client)
     except Exception as e:
-        L.error(f"Failed to retrieve object list from DataONE: {e}")
+        L.error(f"Failed to update the object mirror from DataONE: {e}")
+        conn.close()
         return filedict
-    # Create a dictionary to map MD5 sums to identifiers, formatIds, and URLs
-    obj_info = {}
-    for object_list in object_list_list:
-        for obj in object_list.objectInfo:
-            obj_info[obj.checksum.value()] = {
-                'identifier': obj.identifier.value(),
-                'formatId': obj.formatId,
-                'url': f"{CN_URL}{sep}v2/resolve/{obj.identifier.value()}"
-            }
     # Update the file info dictionary
     for doi, files in filedict.items():
         for md5, file_info in files.items():
-            if md5 in obj_info:
-                file_info['identifier'] = obj_info[md5]['identifier']
-                file_info['formatId'] = obj_info[md5]['formatId']
-                file_info['url'] = obj_info[md5]['url']
+            objs = find_by_checksum(conn, md5)
+            if objs:
+                if len(objs) > 1:
+                    L.warning(f'{doi} Found {len(objs)} objects with MD5 {md5}; using {objs[0]["pid"]}')
+                file_info['identifier'] = objs[0]['pid']
+                file_info['formatId'] = objs[0]['format_id']
+                file_info['url'] = f"{CN_URL}{sep}v2/resolve/{objs[0]['pid']}"
+    conn.close()
     return filedict
 
 
@@ -357,6 +355,7 @@ def generate_access_policy():
     :return: The access policy.
     :rtype: dataoneTypes.accessPolicy
     """
+    from d1_common.types import dataoneTypes
     accessPolicy = dataoneTypes.accessPolicy()
     config = get_config()
     if config.get('read_groups'):
@@ -386,35 +385,125 @@ def generate_access_policy():
     return accessPolicy
 
 
-def fix_access_policies():
+def policy_rules(access_policy):
+    """
+    Flatten an access policy into a set of (subject, permission) pairs so
+    that two policies can be compared regardless of rule order or grouping.
+
+    :param access_policy: The access policy, or None.
+    :type access_policy: dataoneTypes.accessPolicy
+    :return: The set of (subject, permission) pairs.
+    :rtype: frozenset
+    """
+    if access_policy is None:
+        return frozenset()
+    return frozenset((subj.value(), str(perm))
+                     for rule in access_policy.allow
+                     for subj in rule.subject
+                     for perm in rule.permission)
+
+
+def fix_access_policy(pid: str, desired: frozenset, dry_run: bool, client: MemberNodeClient_2_0):
     """
-    Fix the access policies for objects uploaded in the last three days.
+    Update the access policy of a single object if it differs from the
+    desired policy.
+
+    :param str pid: The object identifier.
+    :param frozenset desired: The desired (subject, permission) pairs.
+    :param bool dry_run: Only compare; do not update.
+    :param MemberNodeClient_2_0 client: A DataONE MemberNodeClient_2_0 object.
+    :return: One of ``'unchanged'``, ``'differs'`` (dry run) or ``'updated'``.
+    :rtype: str
+    """
+    sysmeta = client.getSystemMetadata(pid)
+    if policy_rules(sysmeta.accessPolicy) == desired:
+        return 'unchanged'
+    if dry_run:
+        return 'differs'
+    sysmeta.accessPolicy = generate_access_policy()
+    client.updateSystemMetadata(pid, sysmeta)
+    return 'updated'
+
+
+def fix_access_policies(days: int | None=3, dry_run: bool=False, workers: int=8):
+    """
+    Fix the access policies of the objects modified in the last ``days``
+    days, or of every object on the Member Node.
 
     This function uses a :py:mod:`d1_client.mnclient_2_0.MemberNodeClient_2_0`
-    client to retrieve a list of objects uploaded in the last three days, and
-    modifies their access policies to include the groups specified in the
-    config document.
+    client to page through the objects modified in the last ``days`` days (or
+    all objects), compares each object's access policy with
+    :py:func:`generate_access_policy`, and updates only the objects whose
+    policy differs, using ``workers`` concurrent clients.
+
+    Progress is checkpointed to ``{WORK_LOC}/{nodeid}.acl.json`` after each
+    chunk of objects, so an interrupted run resumes where it stopped. The
+    checkpoint is deleted when a run finishes without failures, so that the
+    next run checks every object again, and is discarded when the desired
+    policy changes.
+
+    :param int days: Only check objects modified in the last ``days`` days.
+        None checks every object on the Member Node.
+    :param bool dry_run: Only report how many objects differ.
+    :param int workers: The number of concurrent requests.
+    :return: The number of objects in each outcome.
+    :rtype: dict
     """
+    from concurrent.futures import ThreadPoolExecutor
+    from .pool import ClientPool
+    from .mirror import iter_object_pages
+    L = getLogger(__name__)
     config = get_config()
-    token = get_ll_token()
-    mnurl = config['mnurl']
-    # Initialize the mn client
-    options: dict = {
-        "headers": {"Authorization": "Bearer " + token},
-        "timeout_sec": 9999,
-        }
-    client: MemberNodeClient_2_0 = MemberNodeClient_2_0(mnurl, **options)
-    # Retrieve the list of objects uploaded in the last three days
-    three_days_ago = datetime.now() - timedelta(days=3)
-    object_list = client.listObjects(fromDate=three_days_ago)
-    for obj in object_list.objectInfo:
-        # Retrieve the system metadata
-        sysmeta = client.getSystemMetadata(obj.identifier.value())
-        # Modify the access policy
-        sysmeta.accessPolicy = generate_access_policy()
-        # Update the system metadata with the new access policy
-        client.updateSystemMetadata(obj.identifier.value(), sysmeta)
-    client._session.close()
+    pool = ClientPool(config['mnurl'], token_file=CONFIG_LOC / '.ll_token', size=workers)
+    desired = policy_rules(generate_access_policy())
+    policy_key = hashlib.md5(json.dumps(sorted(desired)).encode('utf-8')).hexdigest()
+    checkpoint_loc = Path(WORK_LOC / f"{config['nodeid']}.acl.json")
+    done = set()
+    if (not dry_run) and checkpoint_loc.exists():
+        with open(checkpoint_loc, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('policy') == policy_key:
+            done = set(checkpoint['done'])
+            L.info(f'Resuming from checkpoint with {len(done)} objects already done')
+    # Collect the identifiers first: updating sysmeta changes the modification
+    # date, which would shift later pages of the listing under us.
+    from_date = (datetime.now() - timedelta(days=days)) if days is not None else None
+    with pool.client() as client:
+        pids = [obj.identifier.value()
+                for page in iter_object_pages(client, from_date=from_date)
+                for obj in page.objectInfo]
+    todo = [pid for pid in pids if pid not in done]
+    L.info(f'Checking access policies of {len(todo)} objects ({len(pids) - len(todo)} already done)')
+    counts = {'unchanged': 0, 'differs': 0, 'updated': 0, 'failed': 0}
+
+    def fix(pid):
+        try:
+            return pid, pool.call(fix_access_policy, pid, desired, dry_run)
+        except Exception as e:
+            L.error(f'{pid} Failed to fix access policy: {repr(e)}')
+            return pid, 'failed'
+
+    chunk = workers * 50
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for c in range(0, len(todo), chunk):
+                for pid, outcome in ex.map(fix, todo[c:c + chunk]):
+                    counts[outcome] += 1
+                    if outcome in ('unchanged', 'updated'):
+                        done.add(pid)
+                if not dry_run:
+                    with open(checkpoint_loc, 'w') as f:
+                        json.dump({'policy': policy_key, 'done': sorted(done)}, fp=f)
+                L.info(f'Checked {min(c + chunk, len(todo))}/{len(todo)} objects: {counts}')
+        if (not dry_run) and (not counts['failed']):
+            # a complete pass; drift after this run must be found by the next one
+            checkpoint_loc.unlink(missing_ok=True)
+    finally:
+        pool.close()
+    verb = 'would be updated' if dry_run else 'updated'
+    L.info(f'Access policy summary: {len(todo)} checked, {counts["unchanged"]} unchanged, '
+           f'{counts["differs"] if dry_run else counts["updated"]} {verb}, {counts["failed"]} failed')
+    return counts
 
 
 def save_uploads(uploads: dict, fp: Path='./uploads.json'):
@@ -454,15 +543,115 @@ def load_uploads(fp: Path='./uploads.json'):
     if fp.exists():
         L.info(f'Loading uploads from {fp}')
         with open(fp, 'r') as f:
-            try:
-                uploads = json.load(fp=f)
-            except json.JSONDecodeError as e:
-                L.warning(f'Caught JSONDecodeError: {e}. This probably happened because there is no file to read. Continuing with empty dict...')
-                uploads = {}
+            text = f.read()
+        try:
+            uploads = json.loads(text)
+        except json.JSONDecodeError as e:
+            L.warning(f'Caught JSONDecodeError: {e}. This probably happened because there is no file to read. Continuing with empty dict...')
+            uploads, text = {}, '{}'
         l = len(uploads)
         L.info(f'Loaded info for {l} uploads.')
-        L.debug(f'Loaded upload dump:\n{json.dumps(uploads,indent=2)}')
+        # dumped from the file text, since the ledger may change before a queued record is formatted
+        L.debug('Loaded upload dump:\n%s', Lazy(lambda: json.dumps(json.loads(text), indent=2)))
         return uploads
     else:
         L.error('Could not find uploads file!')
         raise FileNotFoundError('Could not find an uploads info json file!')
+
+
+def parse_shard(spec: str):
+    """
+    Parse a shard specification of the form ``i/N`` (e.g. ``0/4``) into a
+    shard index and shard count.
+
+    :param str spec: The shard specification.
+    :return: The shard index and the total number of shards.
+    :rtype: tuple[int, int]
+    """
+    try:
+        [i, n] = [int(x) for x in spec.split('/')]
+    except ValueError:
+        raise ValueError(f'Invalid shard specification "{spec}"; expected i/N, e.g. 0/4')
+    if (n < 1) or not (0 <= i < n):
+        raise ValueError(f'Invalid shard specification "{spec}"; need 0 <= i < N')
+    return i, n
+
+
+def shard_of(key: str, n: int):
+    """
+    Assign a key (typically the package alternateIdentifier) to one of ``n``
+    shards. The MD5 of the key is used rather than :py:func:`hash` so that the
+    assignment is stable across processes and hosts.
+
+    :param str key: The key to assign.
+    :param int n: The number of shards.
+    :return: The shard index.
+    :rtype: int
+    """
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16) % n
+
+
+def uploads_path(node: str, shard: tuple | None=None):
+    """
+    Get the location of the uploads ledger for a node, or for one shard of a
+    node if ``shard`` is given.
+
+    :param str node: The node identifier.
+    :param tuple shard: The shard index and shard count, or None.
+    :return: The path to the ledger file.
+    :rtype: Path
+    """
+    if shard:
+        return Path(WORK_LOC / f'{node}.shard-{shard[0]}-of-{shard[1]}.json')
+    return Path(WORK_LOC / f'{node}.json')
+
+
+def merge_uploads(node: str):
+    """
+    Merge the shard ledgers ``{WORK_LOC}/{node}.shard-*.json`` into the main
+    ``{WORK_LOC}/{node}.json`` ledger.
+
+    Shard entries supersede the entries in the main ledger, since each shard
+    run starts from the main ledger. If the same package appears with
+    different entries in more than one shard ledger, the package is a conflict:
+    its main ledger entry is left untouched and the competing entries are
+    written to ``{WORK_LOC}/{node}.conflicts.json`` for manual resolution.
+
+    :param str node: The node identifier.
+    :return: The merged uploads dictionary and the conflicts dictionary.
+    :rtype: tuple[dict, dict]
+    """
+    L = getLogger(__name__)
+    main_loc = uploads_path(node)
+    try:
+        merged = load_uploads(main_loc)
+    except FileNotFoundError:
+        merged = {}
+    shard_locs = sorted(WORK_LOC.glob(f'{node}.shard-*-of-*.json'))
+    if not shard_locs:
+        L.warning(f'No shard ledgers found for {node} in {WORK_LOC}')
+        return merged, {}
+    seen = {}
+    conflicts = {}
+    for loc in shard_locs:
+        for package_id, entry in load_uploads(loc).items():
+            if package_id in conflicts:
+                conflicts[package_id][loc.name] = entry
+            elif (package_id in seen) and (seen[package_id][1] != entry):
+                prev_loc, prev_entry = seen.pop(package_id)
+                conflicts[package_id] = {prev_loc: prev_entry, loc.name: entry}
+            elif package_id not in seen:
+                seen[package_id] = (loc.name, entry)
+    for package_id, (_, entry) in seen.items():
+        merged[package_id] = entry
+    L.info(f'Merged {len(seen)} packages from {len(shard_locs)} shard ledgers')
+    save_uploads(merged, fp=main_loc)
+    conflicts_loc = Path(WORK_LOC / f'{node}.conflicts.json')
+    if conflicts:
+        L.error(f'Found {len(conflicts)} conflicting packages; see {conflicts_loc}')
+        with open(conflicts_loc, 'w') as f:
+            json.dump(conflicts, fp=f, indent=2)
+    elif conflicts_loc.exists():
+        # left over from a previous merge
+        conflicts_loc.unlink()
+    return merged, conflicts
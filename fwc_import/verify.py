@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+
+from d1_common.types import exceptions
+
+from .defs import WORK_LOC
+from .utils import get_config, load_uploads, uploads_path
+from .pool import ClientPool
+
+KINDS = ['eml', 'resource_map']
+"""
+The ledger object kinds that are verified, besides the data objects listed
+under ``data``.
+"""
+
+
+def verify_path(node: str):
+    """
+    Get the location of the verification report for a node.
+
+    :param str node: The node identifier.
+    :return: The path to the report.
+    :rtype: Path
+    """
+    return Path(WORK_LOC / f'{node}.verify.json')
+
+
+def ledger_objects(uploads: dict):
+    """
+    List the objects recorded in a ledger.
+
+    :param dict uploads: The ledger.
+    :return: One ``(package_id, kind, entry)`` tuple per object.
+    :rtype: list
+    """
+    objects = [(package_id, kind, entry[kind])
+               for package_id, entry in uploads.items() if entry
+               for kind in KINDS if entry.get(kind) and entry[kind].get('identifier')]
+    objects += [(package_id, 'data', obj)
+                for package_id, entry in uploads.items() if entry
+                for obj in (entry.get('data') or {}).values() if obj.get('identifier')]
+    return objects
+
+
+def describe_checksum(pid: str, client):
+    """
+    Get an object's checksum with a ``describe`` (HEAD) request.
+
+    :param str pid: The object identifier.
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :return: The checksum value, or None if the object does not exist.
+    :rtype: str or None
+    """
+    try:
+        headers = client.describe(pid)
+    except exceptions.NotFound:
+        return None
+    return headers.get('DataONE-Checksum', '').partition(',')[2]
+
+
+def check_chain(pid: str, old_pid: str, client):
+    """
+    Check that an object and the object it replaced point at each other.
+
+    :param str pid: The new object identifier.
+    :param str old_pid: The identifier of the object it obsoletes.
+    :param client: The Member Node client.
+    :type client: MemberNodeClient_2_0
+    :return: A description of what is wrong, or None.
+    :rtype: str or None
+    """
+    new_sm = client.getSystemMetadata(pid)
+    problems = []
+    if (new_sm.obsoletes is None) or (new_sm.obsoletes.value() != old_pid):
+        problems.append(f'{pid} obsoletes {new_sm.obsoletes.value() if new_sm.obsoletes else None}, expected {old_pid}')
+    try:
+        old_sm = client.getSystemMetadata(old_pid)
+    except exceptions.NotFound:
+        problems.append(f'{old_pid} does not exist')
+    else:
+        if (old_sm.obsoletedBy is None) or (old_sm.obsoletedBy.value() != pid):
+            problems.append(f'{old_pid} obsoletedBy {old_sm.obsoletedBy.value() if old_sm.obsoletedBy else None}, expected {pid}')
+    return '; '.join(problems) or None
+
+
+def verify_uploads(node: str | None=None, mn_url: str | None=None, token_file: Path | None=None,
+                   use_mirror: bool=False, workers: int=32):
+    """
+    Check a node's ledger against the Member Node: every recorded object must
+    exist with the recorded MD5, and every object recorded as obsoleting an
+    earlier version must have an intact ``obsoletes``/``obsoletedBy`` chain.
+
+    Existence and checksums are checked with concurrent ``describe`` (HEAD)
+    requests, or, with ``use_mirror``, against the local object mirror after
+    an incremental sync (see :py:mod:`fwc_import.mirror`), which needs no
+    per-object requests at all. Chains are checked with
+    ``getSystemMetadata``, only for objects with an ``obsoletes`` entry.
+
+    The report is written to ``{WORK_LOC}/{node}.verify.json``.
+
+    :param str node: The node identifier. Defaults to ``nodeid`` in the config.
+    :param str mn_url: The Member Node URL. Defaults to the ``mnurl`` of the
+        entry in ``targets`` with this ``nodeid``, if there is one, and to
+        ``mnurl`` in the config otherwise.
+    :param Path token_file: The token file. Defaults to the target's
+        ``token_file`` in the same way.
+    :param bool use_mirror: Check existence and checksums against the mirror.
+    :param int workers: The number of concurrent requests.
+    :return: The report: counts and lists of missing objects, checksum
+        mismatches, broken chains and errors.
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    config = get_config()
+    node = node or config['nodeid']
+    # a fan-out target's ledger is checked against that target's node
+    target = next((t for t in config.get('targets') or [] if t.get('nodeid') == node), config)
+    mn_url = mn_url or target.get('mnurl') or config['mnurl']
+    token_file = token_file or target.get('token_file') or config.get('token_file')
+    uploads = load_uploads(uploads_path(node))
+    objects = ledger_objects(uploads)
+    pool = ClientPool(mn_url, token_file=token_file, size=workers)
+    report = {'node': node, 'checked': len(objects), 'missing': [], 'mismatch': [], 'broken_chains': [], 'errors': []}
+    L.info(f'Verifying {len(objects)} objects from the {node} ledger against {mn_url}')
+
+    def record(package_id, kind, obj, checksum):
+        if checksum is None:
+            report['missing'].append({'package': package_id, 'kind': kind, 'pid': obj['identifier']})
+        elif checksum != obj['md5']:
+            report['mismatch'].append({'package': package_id, 'kind': kind, 'pid': obj['identifier'],
+                                       'ledger': obj['md5'], 'node': checksum})
+
+    try:
+        if use_mirror:
+            from .mirror import open_mirror, sync_mirror, find_by_pid
+            conn = open_mirror(node)
+            pool.call(sync_mirror, conn)
+            for package_id, kind, obj in objects:
+                row = find_by_pid(conn, obj['identifier'])
+                record(package_id, kind, obj, row['checksum'] if row else None)
+            conn.close()
+        else:
+            def describe(item):
+                package_id, kind, obj = item
+                try:
+                    return item, pool.call(describe_checksum, obj['identifier']), None
+                except Exception as e:
+                    return item, None, e
+
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                for n, ((package_id, kind, obj), checksum, error) in enumerate(ex.map(describe, objects), start=1):
+                    if error:
+                        report['errors'].append({'pid': obj['identifier'], 'error': repr(error)})
+                    else:
+                        record(package_id, kind, obj, checksum)
+                    if n % 10000 == 0:
+                        L.info(f'Described {n}/{len(objects)} objects')
+        missing = {m['pid'] for m in report['missing']}
+        chains = [(package_id, kind, obj) for package_id, kind, obj in objects
+                  if obj.get('obsoletes') and obj['identifier'] not in missing]
+
+        def chain(item):
+            package_id, kind, obj = item
+            try:
+                return item, pool.call(check_chain, obj['identifier'], obj['obsoletes']), None
+            except Exception as e:
+                return item, None, e
+
+        L.info(f'Checking {len(chains)} obsoletes chains')
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for (package_id, kind, obj), problem, error in ex.map(chain, chains):
+                if error:
+                    report['errors'].append({'pid': obj['identifier'], 'error': repr(error)})
+                elif problem:
+                    report['broken_chains'].append({'package': package_id, 'kind': kind, 'pid': obj['identifier'],
+                                                    'obsoletes': obj['obsoletes'], 'problem': problem})
+    finally:
+        pool.close()
+    with open(verify_path(node), 'w') as f:
+        json.dump(report, fp=f, indent=2)
+    L.info(f'Verified {len(objects)} objects: {len(report["missing"])} missing, {len(report["mismatch"])} checksum '
+           f'mismatches, {len(report["broken_chains"])} broken chains, {len(report["errors"])} errors; '
+           f'report written to {verify_path(node)}')
+    return report
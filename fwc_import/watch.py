@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import os
+import json
+import queue
+import datetime
+from pathlib import Path
+from logging import getLogger
+from time import monotonic, sleep
+import xml.etree.ElementTree as ET
+
+from .defs import WORK_LOC
+from .utils import load_uploads, save_uploads, uploads_path
+from .conv import CROSSWALK_FILE, SHEETS_DIR, add_unique_id, build_eml, record_filename, record_id, \
+            register_namespaces, write_pretty_xml
+from .dedup import record_key
+from .plan import scan_eml, classify, backfill_content_hashes
+from .catalog import open_catalog, add_package
+
+POLL_INTERVAL = 5.0
+"""
+Seconds between directory scans when inotify (watchdog) is not available.
+"""
+
+DEBOUNCE = 10.0
+"""
+Seconds without further changes before a batch of changes is processed, so
+that a sheet that is still being saved is not read half-written.
+"""
+
+MAX_WAIT = 120.0
+"""
+The longest a change waits for processing while other files keep changing.
+"""
+
+
+def watch_state_path(node: str):
+    """
+    Get the location of the watch state file for a node.
+
+    :param str node: The node identifier.
+    :return: The path to the state file.
+    :rtype: Path
+    """
+    return Path(WORK_LOC / f'{node}.watch.json')
+
+
+def load_state(fp: Path):
+    """
+    Read the watch state: the row hash and EML file of each converted record,
+    and the time of the last pass.
+
+    :param Path fp: The state file.
+    :return: The state dictionary.
+    :rtype: dict
+    """
+    try:
+        with open(fp, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'records': {}, 'last_pass': None}
+
+
+def save_state(state: dict, fp: Path):
+    """
+    Write the watch state.
+
+    :param dict state: The state dictionary.
+    :param Path fp: The state file.
+    """
+    tmp = Path(f'{fp}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, fp=f, indent=2)
+    os.replace(tmp, fp)
+
+
+def is_sheet(path: Path):
+    """
+    Check whether a file is an FWC sheet that :py:func:`fwc_import.conv.convert`
+    would read.
+
+    :param Path path: The file.
+    :rtype: bool
+    """
+    return ('records_to' in path.name) and path.name.endswith('.xlsx') and not path.name.startswith('~$')
+
+
+class PollingWatcher:
+    """
+    Report changed files by comparing the size and modification time of every
+    file in a set of directories between scans.
+
+    :param list dirs: The directories to watch (not recursive).
+    :param float interval: Seconds between scans.
+    """
+    def __init__(self, dirs: list, interval: float=POLL_INTERVAL):
+        self.dirs = [Path(d) for d in dirs]
+        self.interval = interval
+        self.stats = self.scan()
+
+    def scan(self):
+        stats = {}
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            st = entry.stat()
+                            stats[entry.path] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+        return stats
+
+    def poll(self, timeout: float):
+        """
+        Wait up to ``timeout`` seconds and return the files that were created
+        or modified since the previous call.
+
+        :param float timeout: Seconds to wait.
+        :rtype: set
+        """
+        sleep(min(timeout, self.interval))
+        stats = self.scan()
+        changed = {Path(p) for p, st in stats.items() if self.stats.get(p) != st}
+        self.stats = stats
+        return changed
+
+    def stop(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Report changed files using filesystem events (inotify on Linux) through
+    the optional ``watchdog`` package.
+
+    :param list dirs: The directories to watch (not recursive).
+    :raises ImportError: If watchdog is not installed.
+    """
+    def __init__(self, dirs: list):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+        events = self.events = queue.Queue()
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory or (event.event_type not in ('created', 'modified', 'moved', 'closed')):
+                    return
+                events.put(Path(getattr(event, 'dest_path', '') or event.src_path))
+
+        self.observer = Observer()
+        for d in dirs:
+            self.observer.schedule(Handler(), str(d), recursive=False)
+        self.observer.start()
+
+    def poll(self, timeout: float):
+        """
+        Wait up to ``timeout`` seconds for an event and return the files that
+        were created or modified.
+
+        :param float timeout: Seconds to wait.
+        :rtype: set
+        """
+        changed = set()
+        try:
+            changed.add(self.events.get(timeout=timeout))
+            while True:
+                changed.add(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return changed
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+def make_watcher(dirs: list, poll: bool=False, interval: float=POLL_INTERVAL):
+    """
+    Watch directories with inotify if watchdog is installed, and by polling
+    otherwise.
+
+    :param list dirs: The directories to watch.
+    :param bool poll: Always poll.
+    :param float interval: Seconds between scans when polling.
+    :return: The watcher.
+    :rtype: InotifyWatcher or PollingWatcher
+    """
+    L = getLogger(__name__)
+    if not poll:
+        try:
+            watcher = InotifyWatcher(dirs)
+            L.info(f'Watching {", ".join(str(d) for d in dirs)} with filesystem events')
+            return watcher
+        except (ImportError, OSError) as e:
+            L.info(f'Filesystem events are not available ({repr(e)}); polling every {interval}s instead')
+    else:
+        L.info(f'Polling {", ".join(str(d) for d in dirs)} every {interval}s')
+    return PollingWatcher(dirs, interval=interval)
+
+
+def convert_changed_rows(sheet: Path, state: dict, crosswalk: dict, output_dir: Path, drop: set | None=None):
+    """
+    Convert only the records in a sheet that are new or whose values have
+    changed since they were last converted, and write their EML files.
+
+    Each record is identified by its unique package id (as used in the EML
+    file name by ``fwcconvert``), so inserting a row does not mark the rows
+    after it as changed. Records that have disappeared from the sheet are
+    dropped from the state; their EML files and Member Node objects are left
+    alone.
+
+    :param Path sheet: The sheet.
+    :param dict state: The watch state (updated in place).
+    :param dict crosswalk: The column crosswalk.
+    :param Path output_dir: The directory to write the EML files to.
+    :param set drop: Record keys (see :py:func:`fwc_import.dedup.record_key`)
+        not to convert.
+    :return: The EML files written.
+    :rtype: list
+    """
+    import pandas as pd
+    from .coords import bounding_boxes
+    L = getLogger(__name__)
+    fname = sheet.name
+    df = pd.read_excel(sheet, dtype=str)
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    records = state['records']
+    taken = {uid for uid, r in records.items() if r['sheet'] != fname}
+    seen, changed = set(), []
+    for idx, row in df.iterrows():
+        if drop and (record_key(fname, idx) in drop):
+            continue
+        uid = add_unique_id(record_id(row, fname), table=taken)
+        seen.add(uid)
+        old = records.get(uid)
+        if old and (old['hash'] == str(hashes[idx])) and output_dir.joinpath(old['file']).exists():
+            continue
+        changed.append((idx, uid))
+    for uid in [uid for uid, r in records.items() if (r['sheet'] == fname) and (uid not in seen)]:
+        L.warning(f'{uid} is no longer in {fname}; its EML and Member Node objects are left as they are')
+        del records[uid]
+    if not changed:
+        L.info(f'{fname}: no records changed')
+        return []
+    bboxes = bounding_boxes(df.loc[[idx for idx, _ in changed]])
+    catalog = open_catalog()
+    written = []
+    for idx, uid in changed:
+        row = df.loc[idx]
+        eml_tree, _ = build_eml(row, crosswalk, fname, bbox=bboxes.loc[idx])
+        filename = record_filename(row, crosswalk, uid)
+        old = records.get(uid)
+        if old and (old['file'] != filename):
+            # the title changed; keep one EML file per record
+            output_dir.joinpath(old['file']).unlink(missing_ok=True)
+        write_pretty_xml(eml_tree, output_dir.joinpath(filename))
+        add_package(catalog, eml_tree, output_dir.joinpath(filename))
+        records[uid] = {'sheet': fname, 'hash': str(hashes[idx]), 'file': filename}
+        written.append(output_dir.joinpath(filename))
+    catalog.commit()
+    catalog.close()
+    L.info(f'{fname}: converted {len(written)} new or changed records of {len(df)}')
+    return written
+
+
+def upload_changed(eml_paths: list, orcid: str, pool, uploads: dict, uploads_loc: Path):
+    """
+    Upload the EML files whose content differs from the version in the
+    ledger (see :py:func:`fwc_import.plan.classify`); unchanged files,
+    including files rewritten by an upload, are skipped.
+
+    :param list eml_paths: The EML files.
+    :param str orcid: The ORCID of the uploader.
+    :param pool: The Member Node client pool.
+    :type pool: fwc_import.pool.ClientPool
+    :param dict uploads: The ledger.
+    :param Path uploads_loc: The ledger file.
+    :return: The successful and failed package identifiers.
+    :rtype: tuple
+    """
+    from .run_data_upload import upload_package
+    L = getLogger(__name__)
+    succ_list, err_list = [], []
+    for eml_path in sorted(eml_paths):
+        scanned = scan_eml(eml_path)
+        package_id = scanned['package_id']
+        status = classify(scanned, uploads.get(package_id))
+        if status == 'unchanged':
+            continue
+        if status == 'invalid':
+            L.error(f'{eml_path.name} is not a valid EML file ({scanned["error"]}); skipping')
+            err_list.append(str(eml_path))
+            continue
+        try:
+            L.info(f'Uploading {package_id} ({status}) from {eml_path.name}')
+            root = ET.fromstring(eml_path.read_bytes())
+            upload_package(eml_path, root, package_id, orcid, pool, uploads, uploads_loc)
+            succ_list.append(package_id)
+        except Exception as e:
+            err_list.append(str(eml_path))
+            L.error(f'{eml_path} / {repr(e)}')
+    save_uploads(uploads, fp=uploads_loc)
+    return succ_list, err_list
+
+
+def watch(sheets_dir: str=SHEETS_DIR, eml_folder: str | None=None, crosswalk_file: str=CROSSWALK_FILE,
+          drop: str | None=None, poll: bool=False, interval: float=POLL_INTERVAL,
+          debounce: float=DEBOUNCE, max_wait: float=MAX_WAIT, once: bool=False):
+    """
+    Watch the sheets directory and the EML folder, and convert and upload
+    changes as they happen.
+
+    When a sheet changes, only its new and changed records are converted
+    (:py:func:`convert_changed_rows`), and the resulting EML files are
+    uploaded. When an EML file in the folder is added or edited, it is
+    uploaded if its content differs from the ledger. Changes are collected
+    until nothing has changed for ``debounce`` seconds (or for at most
+    ``max_wait`` seconds) and then processed as one batch.
+
+    On start, sheets changed since the last pass are converted and EML files
+    modified since the last pass are uploaded; on the first start every
+    record is converted, and only EML content that is not already in the
+    ledger is uploaded. Ledger entries written before content hashes were
+    recorded are first filled in from the EML files in the folder (see
+    :py:func:`fwc_import.plan.backfill_content_hashes`), so that converting
+    a record again does not make its package look changed.
+
+    :param str sheets_dir: The directory with the FWC sheets.
+    :param str eml_folder: The EML folder. Defaults to ``data_root`` in the
+        config.
+    :param str crosswalk_file: The column crosswalk file.
+    :param str drop: A JSON file with a list of record keys not to convert.
+    :param bool poll: Poll the directories even if watchdog is installed.
+    :param float interval: Seconds between scans when polling.
+    :param float debounce: Seconds of quiet before a batch is processed.
+    :param float max_wait: The longest a change waits for processing.
+    :param bool once: Catch up once and return instead of watching.
+    """
+    from .utils import get_config
+    from .pool import ClientPool
+    L = getLogger(__name__)
+    config = get_config()
+    node = config.get('nodeid')
+    orcid = config.get('rightsholder_orcid')
+    sheets_dir = Path(sheets_dir).absolute()
+    eml_folder = Path(eml_folder or config.get('data_root', 'output_eml')).absolute()
+    eml_folder.mkdir(parents=True, exist_ok=True)
+    with open(crosswalk_file) as f:
+        crosswalk = json.load(f)
+    drop_keys = set()
+    if drop:
+        with open(drop) as f:
+            drop_keys = set(json.load(f))
+    register_namespaces()
+    state_loc = watch_state_path(node)
+    state = load_state(state_loc)
+    uploads_loc = uploads_path(node)
+    try:
+        uploads = load_uploads(uploads_loc)
+    except FileNotFoundError:
+        uploads = {}
+    # before any record is converted again, while the EML files are still the uploaded versions
+    if backfill_content_hashes(eml_folder, uploads):
+        save_uploads(uploads, fp=uploads_loc)
+    pool = ClientPool(config.get('mnurl'), token_file=config.get('token_file'))
+    # (mtime, size) of the EML files this process wrote or uploaded, so that
+    # their own change events are not processed again
+    written = {}
+
+    def stat(p: Path):
+        try:
+            st = p.stat()
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def process(paths: set):
+        started = datetime.datetime.now(datetime.timezone.utc)
+        sheets = sorted(p for p in paths if (p.parent == sheets_dir) and is_sheet(p) and p.exists())
+        emls = {p for p in paths if (p.parent == eml_folder) and (p.suffix == '.xml') and
+                p.exists() and (written.get(p) != stat(p))}
+        for sheet in sheets:
+            try:
+                emls.update(convert_changed_rows(sheet, state, crosswalk, eml_folder, drop=drop_keys))
+            except Exception as e:
+                L.error(f'{sheet} / {repr(e)}')
+        state['last_pass'] = started.isoformat()
+        save_state(state, state_loc)
+        if emls:
+            succ, failed = upload_changed(emls, orcid, pool, uploads, uploads_loc)
+            L.info(f'Batch done: {len(sheets)} sheets, {len(emls)} EML files checked, {len(succ)} uploaded, {len(failed)} failed')
+        for p in emls:
+            written[p] = stat(p)
+
+    # catch up on what changed while nothing was watching
+    last = datetime.datetime.fromisoformat(state['last_pass']).timestamp() if state.get('last_pass') else None
+    startup = set()
+    for d, keep in ((sheets_dir, is_sheet), (eml_folder, lambda p: p.suffix == '.xml')):
+        with os.scandir(d) as it:
+            for entry in it:
+                if entry.is_file() and keep(Path(entry.path)) and ((last is None) or (entry.stat().st_mtime > last)):
+                    startup.add(Path(entry.path))
+    L.info(f'Catching up on {len(startup)} files changed since {state.get("last_pass") or "the beginning"}')
+    try:
+        process(startup)
+        if once:
+            return
+        watcher = make_watcher([sheets_dir, eml_folder], poll=poll, interval=interval)
+        pending, first, latest = set(), None, None
+        try:
+            while True:
+                changed = watcher.poll(timeout=debounce if pending else interval)
+                now = monotonic()
+                if changed:
+                    pending |= changed
+                    first = first or now
+                    latest = now
+                if pending and ((now - latest >= debounce) or (now - first >= max_wait)):
+                    L.info(f'Processing {len(pending)} changed files')
+                    batch, pending, first, latest = pending, set(), None, None
+                    process(batch)
+        except KeyboardInterrupt:
+            L.info('Caught KeyboardInterrupt; stopping')
+        finally:
+            watcher.stop()
+    finally:
+        pool.close()
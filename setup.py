@@ -19,18 +19,23 @@ setuptools.setup(
         'dataone.libclient',
         'pyld',
         'pandas',
+        'numpy',
         'openpyxl',
     ],
     extras_require={
         'dev': [
             'sphinx',
-        ]
+        ],
+        'watch': [
+            'watchdog',
+        ],
     },
     entry_points = {
         'console_scripts': [
             'fwcconvert=fwc_import.conv:main',
-            'fwcimport=fwc_import.run_data_upload:run_data_upload',
-            'testfwcimport=fwc_import.test:main'
+            'fwcimport=fwc_import.cli:fwcimport',
+            'testfwcimport=fwc_import.test:main',
+            'benchfwcimport=fwc_import.bench:main',
         ],
     },
     python_requires='>=3.9, <4.0',